@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The app's modules import each other from src/, as they do in the image.
+SRC_DIR = Path(__file__).resolve().parents[1] / "src"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
@@ -0,0 +1,326 @@
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import random
+import uuid
+from dataclasses import dataclass
+from typing import Any, Collection, Dict, List, Tuple
+
+import asyncpg
+from sqlalchemy import Table
+from sqlalchemy.dialects.postgresql import MONEY
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from data_engine import async_database_url
+from migrate import pending_migrations
+from models.shopify_store import (
+    ShopifyStoreImage,
+    ShopifyStoreProduct,
+    ShopifyStoreProductNotification,
+    ShopifyStoreVariant,
+    ShopifyStoreVariantsChange,
+    metadata,
+)
+
+logger = logging.getLogger(__name__)
+
+CATALOG_TABLES = [
+    ShopifyStoreProduct.__table__,
+    ShopifyStoreImage.__table__,
+    ShopifyStoreVariant.__table__,
+    ShopifyStoreVariantsChange.__table__,
+    ShopifyStoreProductNotification.__table__,
+]
+
+VENDORS = [
+    "UniFi",
+    "Rove Concepts - New York/New Jersey - CL",
+    "Herman Miller",
+    "Sonos",
+]
+PRODUCT_TYPES = ["Networking", "Camera", "Sofa", "Chair", "Lamp", "Speaker"]
+WORDS = [
+    "dream", "machine", "switch", "gateway", "access", "point", "camera", "doorbell",
+    "sofa", "sectional", "chair", "lounge", "lamp", "floor", "speaker", "soundbar",
+    "pro", "lite", "max", "mini", "ultra", "outdoor", "walnut", "oak", "leather",
+]  # fmt: skip
+OPTIONS = ["Small", "Medium", "Large", "Black", "White", "Walnut", "Oak"]
+
+
+@dataclass
+class CatalogSpec:
+    products: int = 1000
+    variants_per_product: int = 3
+    images_per_product: int = 2
+    changes_per_variant: int = 3
+    notifications: int = 200
+    seed: int = 0
+
+
+def generate_catalog(spec: CatalogSpec) -> Dict[str, List[Tuple[Any, ...]]]:
+    """Build the rows of a synthetic catalog, the same ones for the same spec.
+
+    Args:
+        spec (CatalogSpec): The size and seed of the catalog.
+
+    Returns:
+        Dict[str, List[Tuple[Any, ...]]]: The rows of every catalog table, keyed by table name.
+    """
+    rng = random.Random(spec.seed)
+    now = datetime.datetime(2023, 6, 1, tzinfo=datetime.timezone.utc)
+    rows: Dict[str, List[Tuple[Any, ...]]] = {
+        table.name: [] for table in CATALOG_TABLES
+    }
+    latest_changes = []
+
+    for product_id in range(1, spec.products + 1):
+        title = " ".join(rng.sample(WORDS, 3)).title()
+        published_at = now - datetime.timedelta(minutes=rng.randrange(60 * 24 * 365))
+        rows["shopify_store_products"].append(
+            (
+                product_id,
+                published_at,
+                published_at,
+                title,
+                f"https://shop.example.com/products/{product_id}",
+                rng.choice(VENDORS),
+                rng.choice(PRODUCT_TYPES),
+                rng.sample(WORDS, 2),
+                published_at,
+                rng.random() < 0.1,
+            )
+        )
+
+        variant_ids = [
+            product_id * 100 + position
+            for position in range(1, spec.variants_per_product + 1)
+        ]
+        for position in range(1, spec.images_per_product + 1):
+            rows["shopify_store_images"].append(
+                (
+                    product_id * 100 + position,
+                    published_at,
+                    published_at,
+                    position,
+                    product_id,
+                    [] if position == 1 else [rng.choice(variant_ids)],
+                    f"https://cdn.example.com/{product_id}/{position}.jpg",
+                    800,
+                    800,
+                )
+            )
+
+        for position, variant_id in enumerate(variant_ids, start=1):
+            option = "Default Title" if len(variant_ids) == 1 else OPTIONS[position % 7]
+            price = rng.randrange(1000, 200000) / 100
+            available = rng.random() < 0.7
+            rows["shopify_store_variants"].append(
+                (
+                    variant_id,
+                    published_at,
+                    published_at,
+                    option,
+                    f"SKU-{variant_id}",
+                    available,
+                    f"{price:.2f}",
+                    position,
+                    product_id,
+                )
+            )
+
+            changed_at = published_at
+            change_id = None
+            for _ in range(spec.changes_per_variant):
+                changed_at += datetime.timedelta(minutes=rng.randrange(1, 60 * 24))
+                if rng.random() < 0.5:
+                    available = not available
+                else:
+                    price = round(price * rng.choice([0.8, 0.9, 1.1, 1.25]), 2)
+                change_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+                rows["shopify_store_variants_changes"].append(
+                    (
+                        change_id,
+                        "UPDATE",
+                        variant_id,
+                        changed_at,
+                        changed_at,
+                        option,
+                        f"SKU-{variant_id}",
+                        available,
+                        f"{price:.2f}",
+                        product_id,
+                        changed_at,
+                    )
+                )
+            if change_id is not None:
+                latest_changes.append((product_id, variant_id, change_id, changed_at))
+
+    for product_id, variant_id, change_id, changed_at in rng.sample(
+        latest_changes, min(spec.notifications, len(latest_changes))
+    ):
+        rows["shopify_store_product_notifications"].append(
+            (
+                uuid.UUID(int=rng.getrandbits(128), version=4),
+                product_id,
+                variant_id,
+                changed_at,
+                False,
+                change_id,
+            )
+        )
+    return rows
+
+
+COLUMNS = {
+    "shopify_store_products": [
+        "id", "created_at", "updated_at", "title", "handle", "vendor",
+        "product_type", "tags", "published_at", "track",
+    ],
+    "shopify_store_images": [
+        "id", "created_at", "updated_at", "position", "product_id",
+        "variant_ids", "src", "width", "height",
+    ],
+    "shopify_store_variants": [
+        "id", "created_at", "updated_at", "title", "sku", "available",
+        "price", "position", "product_id",
+    ],
+    "shopify_store_variants_changes": [
+        "change_id", "operation", "id", "created_at", "updated_at", "title",
+        "sku", "available", "price", "product_id", "changed_at",
+    ],
+    "shopify_store_product_notifications": [
+        "id", "product_id", "variant_id", "notification_at", "delivered", "change_id",
+    ],
+}  # fmt: skip
+
+
+async def copy_rows(
+    conn: asyncpg.Connection, table: Table, rows: List[Tuple[Any, ...]]
+) -> None:
+    """Bulk insert rows, passing money as text since asyncpg cannot encode it."""
+    columns = COLUMNS[table.name]
+    if not any(isinstance(table.c[column].type, MONEY) for column in columns):
+        await conn.copy_records_to_table(table.name, records=rows, columns=columns)
+        return
+
+    values = ", ".join(
+        f"${index}::text::money"
+        if isinstance(table.c[column].type, MONEY)
+        else f"${index}"
+        for index, column in enumerate(columns, start=1)
+    )
+    await conn.executemany(
+        f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({values})", rows
+    )
+
+
+async def load_catalog(
+    postgres_url: str,
+    spec: CatalogSpec,
+    skip_migrations: Collection[str] = (),
+    features: Collection[str] = (),
+) -> Dict[str, int]:
+    """Replace the catalog tables of a scratch database with a synthetic catalog.
+
+    The catalog tables are dropped and created again, the rows are copied in
+    bulk, and the migrations are applied on top, which also builds the search
+    documents.  A migration that cannot be applied fails the load, unless it is
+    one of `skip_migrations`, such as one needing an extension the database lacks.
+
+    Args:
+        postgres_url (str): The URL of the scratch database.
+        spec (CatalogSpec): The size and seed of the catalog.
+        skip_migrations (Collection[str], optional): Migrations, by name, skipped with a warning if they fail. Defaults to ().
+        features (Collection[str], optional): The optional features whose migrations are applied, such as "search_trigram". Defaults to ().
+
+    Raises:
+        RuntimeError: A migration not in `skip_migrations` failed.
+
+    Returns:
+        Dict[str, int]: The number of rows loaded, keyed by table name.
+    """
+    rows = generate_catalog(spec)
+
+    conn = await asyncpg.connect(postgres_url)
+    try:
+        try:
+            await conn.execute('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"')
+        except asyncpg.PostgresError as exc:
+            logger.warning("The uuid-ossp extension is unavailable: %s", exc)
+        await conn.execute(
+            "CREATE SEQUENCE IF NOT EXISTS shopify_store_variants_changes_id_seq"
+        )
+    finally:
+        await conn.close()
+
+    engine = create_async_engine(async_database_url(postgres_url))
+    try:
+        async with engine.begin() as sa_conn:
+            search_documents = metadata.tables["shopify_store_search_documents"]
+            await sa_conn.run_sync(
+                metadata.drop_all, tables=[*CATALOG_TABLES, search_documents]
+            )
+            await sa_conn.run_sync(metadata.create_all, tables=CATALOG_TABLES)
+    finally:
+        await engine.dispose()
+
+    conn = await asyncpg.connect(postgres_url)
+    try:
+        for table in CATALOG_TABLES:
+            await copy_rows(conn, table, rows[table.name])
+        for path in pending_migrations((), features):
+            try:
+                async with conn.transaction():
+                    await conn.execute(path.read_text())
+            except asyncpg.PostgresError as exc:
+                if path.stem not in skip_migrations:
+                    raise RuntimeError(f"Migration {path.stem} failed: {exc}") from exc
+                logger.warning("Skipped migration %s: %s", path.stem, exc)
+        await conn.execute("ANALYZE")
+    finally:
+        await conn.close()
+    return {table: len(table_rows) for table, table_rows in rows.items()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load a synthetic catalog into a scratch database."
+    )
+    parser.add_argument(
+        "--postgres-url",
+        default=os.environ.get("BENCHMARK_POSTGRES_URL"),
+        help="The scratch database; its catalog tables are replaced. (env: BENCHMARK_POSTGRES_URL)",
+    )
+    parser.add_argument("--products", type=int, default=CatalogSpec.products)
+    parser.add_argument("--notifications", type=int, default=CatalogSpec.notifications)
+    parser.add_argument("--seed", type=int, default=CatalogSpec.seed)
+    parser.add_argument(
+        "--search-trigram",
+        action="store_true",
+        help="Apply the migration of trigram search, which needs the pg_trgm extension.",
+    )
+    parser.add_argument(
+        "--skip-migration",
+        action="append",
+        default=[],
+        help="A migration, such as 0002_search_trigram, to skip if it fails. Repeatable.",
+    )
+    args = parser.parse_args()
+    if not args.postgres_url:
+        parser.error("--postgres-url or BENCHMARK_POSTGRES_URL is required")
+
+    logging.basicConfig(level=logging.INFO)
+    spec = CatalogSpec(
+        products=args.products, notifications=args.notifications, seed=args.seed
+    )
+    features = ["search_trigram"] if args.search_trigram else []
+    counts = asyncio.run(
+        load_catalog(args.postgres_url, spec, args.skip_migration, features)
+    )
+    logger.info("Loaded %s", counts)
+
+
+if __name__ == "__main__":
+    main()
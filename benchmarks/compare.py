@@ -0,0 +1,38 @@
+"""Compare two benchmark results: python -m benchmarks.compare before.json after.json"""
+import json
+import sys
+from typing import Any, Dict, Tuple
+
+METRICS = ["throughput", "p50", "p99", "peak_bytes"]
+
+
+def load(path: str) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    with open(path) as file:
+        report = json.load(file)
+    return {
+        (result["name"], json.dumps(result["params"], sort_keys=True)): result
+        for result in report["results"]
+    }
+
+
+def change(before: float, after: float) -> str:
+    return f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        sys.exit(__doc__)
+    before, after = load(sys.argv[1]), load(sys.argv[2])
+    print(f"{'scenario':<28} {'params':<48} " + " ".join(f"{m:>12}" for m in METRICS))
+    for key in sorted(before.keys() & after.keys()):
+        name, params = key
+        changes = [change(before[key][m], after[key][m]) for m in METRICS]
+        print(f"{name:<28} {params:<48} " + " ".join(f"{c:>12}" for c in changes))
+    for key in sorted(before.keys() ^ after.keys()):
+        print(
+            f"{key[0]:<28} {key[1]:<48} only in {'before' if key in before else 'after'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
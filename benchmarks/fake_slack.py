@@ -0,0 +1,235 @@
+"""A local stand-in for the Slack Web API and Socket Mode, for load tests.
+
+    python -m benchmarks.fake_slack --port 3000 --latency 0.05 --rate-limit-ratio 0.01
+    SLACK_API_URL=http://localhost:3000/api/ python3 app.py
+
+Interactions are pushed to the connected app through POST /_interact and the
+calls it made are counted at GET /_stats.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiohttp import WSMsgType, web
+
+# The methods answered with a 429 when a rate limit is injected
+RATE_LIMITED_METHODS = frozenset(
+    {"chat.postMessage", "chat.update", "views.open", "views.update", "views.publish"}
+)
+
+
+class FakeSlack:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit_ratio: float = 0.0,
+        retry_after: int = 1,
+    ):
+        """Answers the Web API methods the app calls and serves its Socket Mode connection.
+
+        Args:
+            latency (float, optional): Seconds every Web API call takes. Defaults to 0.0.
+            jitter (float, optional): Up to this many seconds are added to the latency at random. Defaults to 0.0.
+            rate_limit_ratio (float, optional): The share of rate limited calls answered with a 429. Defaults to 0.0.
+            retry_after (int, optional): The Retry-After seconds of an injected 429. Defaults to 1.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.rate_limited: Counter = Counter()
+        self.acks = 0
+        self._ts = itertools.count(1)
+        self._sockets: List[web.WebSocketResponse] = []
+        self._next_socket = itertools.count()
+        self._acks: Dict[str, asyncio.Future] = {}
+        # Interactions waiting for the view the app updates in response, by view or user ID
+        self._views: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    def routes(self) -> List[web.RouteDef]:
+        return [
+            web.post("/api/{method}", self.handle_api),
+            web.get("/link", self.handle_socket),
+            web.post("/_interact", self.handle_interact),
+            web.get("/_stats", self.handle_stats),
+        ]
+
+    async def handle_api(self, req: web.Request) -> web.Response:
+        method = req.match_info["method"]
+        self.calls[method] += 1
+        if req.content_type == "application/json":
+            args = await req.json()
+        else:
+            args = dict(await req.post())
+
+        await asyncio.sleep(self.latency + random.uniform(0.0, self.jitter))
+        if method in RATE_LIMITED_METHODS and random.random() < self.rate_limit_ratio:
+            self.rate_limited[method] += 1
+            return web.json_response(
+                {"ok": False, "error": "ratelimited"},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        data: Dict[str, Any] = {"ok": True}
+        if method == "auth.test":
+            data.update(
+                url="https://fake-slack.example.com/",
+                team="Fake Slack",
+                team_id="T0FAKE",
+                user="bot",
+                user_id="U0BOT",
+                bot_id="B0BOT",
+            )
+        elif method == "apps.connections.open":
+            data["url"] = f"ws://{req.host}/link?ticket={uuid.uuid4()}"
+        elif method in ("chat.postMessage", "chat.update"):
+            data.update(
+                channel=args.get("channel"),
+                ts=args.get("ts") or f"{int(time.time())}.{next(self._ts):06d}",
+                message={"text": args.get("text")},
+            )
+        elif method.startswith("views."):
+            view_id = args.get("view_id") or f"V{next(self._ts):010d}"
+            data["view"] = {"id": view_id, "hash": f"{time.time():.6f}"}
+            key = ("user", args["user_id"]) if "user_id" in args else ("view", view_id)
+            future = self._views.pop(key, None)
+            if future is not None and not future.done():
+                future.set_result(None)
+        else:
+            data = {"ok": False, "error": "unknown_method"}
+        return web.json_response(data)
+
+    async def handle_socket(self, req: web.Request) -> web.WebSocketResponse:
+        socket = web.WebSocketResponse(autoping=True)
+        await socket.prepare(req)
+        await socket.send_json(
+            {
+                "type": "hello",
+                "num_connections": len(self._sockets) + 1,
+                "connection_info": {"app_id": "A0FAKE"},
+            }
+        )
+        self._sockets.append(socket)
+        try:
+            async for message in socket:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                envelope_id = json.loads(message.data).get("envelope_id")
+                future = self._acks.pop(envelope_id, None)
+                if future is not None and not future.done():
+                    self.acks += 1
+                    future.set_result(None)
+        finally:
+            self._sockets.remove(socket)
+        return socket
+
+    async def interact(
+        self,
+        envelope_type: str,
+        payload: Dict[str, Any],
+        wait_for: Optional[Tuple[str, str]] = None,
+        timeout: float = 30.0,
+    ) -> Dict[str, float]:
+        """Send an envelope to a connected app and time its ack and, optionally, its view update.
+
+        Args:
+            envelope_type (str): "interactive", "slash_commands" or "events_api".
+            payload (Dict[str, Any]): The request body Slack would send.
+            wait_for (Optional[Tuple[str, str]], optional): ("view", view ID) or ("user", user ID) of the view the app updates in response.
+            timeout (float, optional): Seconds to wait for the app. Defaults to 30.0.
+
+        Returns:
+            Dict[str, float]: Seconds until the ack, and until the view update if one was awaited.
+        """
+        if not self._sockets:
+            raise ConnectionError("No app is connected")
+        socket = self._sockets[next(self._next_socket) % len(self._sockets)]
+
+        loop = asyncio.get_running_loop()
+        envelope_id = str(uuid.uuid4())
+        acked = self._acks[envelope_id] = loop.create_future()
+        updated = None
+        if wait_for is not None:
+            updated = self._views[wait_for] = loop.create_future()
+
+        started = time.perf_counter()
+        try:
+            await socket.send_json(
+                {
+                    "envelope_id": envelope_id,
+                    "type": envelope_type,
+                    "accepts_response_payload": False,
+                    "payload": payload,
+                }
+            )
+            timings = {}
+            await asyncio.wait_for(acked, timeout)
+            timings["ack"] = time.perf_counter() - started
+            if updated is not None:
+                await asyncio.wait_for(updated, timeout)
+                timings["complete"] = time.perf_counter() - started
+            return timings
+        finally:
+            self._acks.pop(envelope_id, None)
+            if wait_for is not None:
+                self._views.pop(wait_for, None)
+
+    async def handle_interact(self, req: web.Request) -> web.Response:
+        body = await req.json()
+        try:
+            timings = await self.interact(
+                body["type"],
+                body["payload"],
+                wait_for=tuple(body["wait_for"]) if body.get("wait_for") else None,
+                timeout=body.get("timeout", 30.0),
+            )
+        except ConnectionError as exc:
+            return web.json_response({"error": str(exc)}, status=503)
+        except asyncio.TimeoutError:
+            return web.json_response({"error": "timeout"}, status=504)
+        return web.json_response(timings)
+
+    async def handle_stats(self, req: web.Request) -> web.Response:
+        return web.json_response(self.stats())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "rate_limited": dict(self.rate_limited),
+            "sockets": len(self._sockets),
+            "acks": self.acks,
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    args = parser.parse_args()
+
+    fake_slack = FakeSlack(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after=args.retry_after,
+    )
+    app = web.Application()
+    app.add_routes(fake_slack.routes())
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""Drive one app instance with CloudEvents and search interactions at a target rate.
+
+The app must be connected to `benchmarks.fake_slack`, through which the search
+interactions are sent.  Notification IDs and variants are read from the scratch
+database (see `python -m benchmarks.catalog`), whose notifications are marked
+undelivered first:
+
+    BENCHMARK_POSTGRES_URL=postgresql://... python -m benchmarks.loadgen \\
+        --target http://localhost:8080 --slack http://localhost:3000 --rps 10,50,100
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Tuple
+
+import aiohttp
+import asyncpg
+
+from benchmarks.catalog import WORDS
+from benchmarks.report import git_commit, percentile
+
+NOTIFICATIONS_TABLE = "shopify_store_product_notifications"
+VARIANTS_TABLE = "shopify_store_variants"
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse "notification=1,catalog=3,search=1" into the weight of each kind of request."""
+    mix = {}
+    for item in value.split(","):
+        kind, weight = item.split("=", 1)
+        mix[kind.strip()] = float(weight)
+    unknown = set(mix) - {"notification", "catalog", "search"}
+    if unknown:
+        raise argparse.ArgumentTypeError(f"Unknown request kinds: {sorted(unknown)}")
+    return mix
+
+
+def debezium_event(
+    table: str, op: str, before: Any, after: Any
+) -> Tuple[Dict[str, str], bytes]:
+    """The headers and body of a binary mode CloudEvent, as the Kafka source sends it."""
+    now = int(time.time() * 1000)
+    headers = {
+        "ce-specversion": "1.0",
+        "ce-id": str(uuid.uuid4()),
+        "ce-source": f"/apis/v1/namespaces/default/kafkasources/loadgen#{table}",
+        "ce-type": "dev.knative.kafka.event",
+        "content-type": "application/json",
+    }
+    body = {
+        "payload": {
+            "before": before,
+            "after": after,
+            "source": {"db": "inventory", "schema": "public", "table": table},
+            "op": op,
+            "ts_ms": now,
+        }
+    }
+    return headers, json.dumps(body).encode()
+
+
+class LoadGenerator:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        target: str,
+        slack: str,
+        notifications: List[Dict[str, Any]],
+        variants: List[Dict[str, Any]],
+        timeout: float = 30.0,
+    ):
+        """Sends requests of each kind and records their outcome.
+
+        Args:
+            session (aiohttp.ClientSession): The HTTP session.
+            target (str): The base URL of the app.
+            slack (str): The base URL of the fake Slack server the app is connected to.
+            notifications (List[Dict[str, Any]]): The notification rows to announce, each once.
+            variants (List[Dict[str, Any]]): The variant rows whose price changes are announced.
+            timeout (float, optional): Seconds a request may take. Defaults to 30.0.
+        """
+        self.session = session
+        self.target = target.rstrip("/")
+        self.slack = slack.rstrip("/")
+        self.notifications = iter(notifications)
+        self.variants = variants
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.outcomes: Dict[str, Counter] = defaultdict(Counter)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+
+    def reset(self) -> None:
+        self.outcomes.clear()
+        self.latencies.clear()
+
+    async def send(self, kind: str) -> None:
+        started = time.perf_counter()
+        try:
+            if kind == "search":
+                outcome = await self.search()
+            else:
+                outcome = await self.cloudevent(kind)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            outcome = type(exc).__name__
+        self.outcomes[kind][outcome] += 1
+        if outcome in ("200", "202"):
+            self.latencies[kind].append(time.perf_counter() - started)
+
+    async def cloudevent(self, kind: str) -> str:
+        if kind == "notification":
+            row = next(self.notifications, None)
+            if row is None:
+                return "exhausted"
+            headers, body = debezium_event(NOTIFICATIONS_TABLE, "c", None, row)
+        else:
+            before = random.choice(self.variants)
+            price = float(before["price"].lstrip("$").replace(",", ""))
+            after = {**before, "price": f"{price * random.choice([0.9, 1.1]):.2f}"}
+            headers, body = debezium_event(VARIANTS_TABLE, "u", before, after)
+
+        async with self.session.post(
+            f"{self.target}/cloudevents",
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+        ) as response:
+            await response.read()
+            return str(response.status)
+
+    async def search(self) -> str:
+        view_id = f"V{uuid.uuid4().hex[:10].upper()}"
+        query = " ".join(random.sample(WORDS, random.choice([1, 2])))
+        payload = {
+            "type": "block_actions",
+            "api_app_id": "A0FAKE",
+            "team": {"id": "T0FAKE"},
+            "user": {"id": "U0LOADGEN", "team_id": "T0FAKE"},
+            "trigger_id": str(uuid.uuid4()),
+            "container": {"type": "view", "view_id": view_id},
+            "view": {
+                "id": view_id,
+                "type": "modal",
+                "callback_id": "view-id",
+                "hash": "1",
+                "private_metadata": "",
+                "state": {
+                    "values": {
+                        "search-query": {
+                            "search-query": {"type": "plain_text_input", "value": query}
+                        }
+                    }
+                },
+            },
+            "actions": [
+                {
+                    "type": "plain_text_input",
+                    "block_id": "search-query",
+                    "action_id": "search-query",
+                    "value": query,
+                    "action_ts": f"{time.time():.6f}",
+                }
+            ],
+        }
+        # The fake Slack server answers once the app has updated the view
+        async with self.session.post(
+            f"{self.slack}/_interact",
+            json={
+                "type": "interactive",
+                "payload": payload,
+                "wait_for": ["view", view_id],
+                "timeout": self.timeout.total,
+            },
+            timeout=self.timeout,
+        ) as response:
+            await response.read()
+            return str(response.status)
+
+
+async def run_stage(
+    generator: LoadGenerator,
+    rps: float,
+    duration: float,
+    mix: Dict[str, float],
+) -> Dict[str, Any]:
+    """Start requests at a fixed rate, whether or not earlier ones finished."""
+    generator.reset()
+    kinds, weights = zip(*mix.items())
+    tasks = set()
+    started = time.perf_counter()
+    for index in range(int(rps * duration)):
+        delay = started + index / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.ensure_future(generator.send(random.choices(kinds, weights)[0]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    sent_in = time.perf_counter() - started
+    if tasks:
+        await asyncio.wait(tasks)
+    elapsed = time.perf_counter() - started
+
+    kinds_report = {}
+    for kind, outcomes in generator.outcomes.items():
+        latencies = generator.latencies[kind]
+        kinds_report[kind] = {
+            "sent": sum(outcomes.values()),
+            "outcomes": dict(outcomes),
+            "p50": percentile(latencies, 0.50) if latencies else None,
+            "p99": percentile(latencies, 0.99) if latencies else None,
+        }
+    completed = sum(len(latencies) for latencies in generator.latencies.values())
+    sent = sum(sum(outcomes.values()) for outcomes in generator.outcomes.values())
+    return {
+        "target_rps": rps,
+        "offered_rps": sent / sent_in if sent_in else 0.0,
+        "completed_rps": completed / elapsed if elapsed else 0.0,
+        "error_rate": (sent - completed) / sent if sent else 0.0,
+        "elapsed": elapsed,
+        "kinds": kinds_report,
+    }
+
+
+async def load_rows(
+    postgres_url: str, reset: bool
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    conn = await asyncpg.connect(postgres_url)
+    try:
+        if reset:
+            await conn.execute(f"UPDATE {NOTIFICATIONS_TABLE} SET delivered = false")
+        notifications = [
+            {
+                "id": str(row["id"]),
+                "product_id": row["product_id"],
+                "variant_id": row["variant_id"],
+                # Debezium sends timestamps as microseconds since the epoch
+                "notification_at": row["notification_at"]
+                and int(row["notification_at"].timestamp() * 1_000_000),
+                "delivered": row["delivered"],
+                "change_id": str(row["change_id"]),
+            }
+            for row in await conn.fetch(
+                f"SELECT * FROM {NOTIFICATIONS_TABLE} WHERE NOT delivered ORDER BY random()"
+            )
+        ]
+        variants = [
+            dict(row)
+            for row in await conn.fetch(
+                f"SELECT id, product_id, title, sku, available, price::text AS price"
+                f" FROM {VARIANTS_TABLE} ORDER BY random() LIMIT 10000"
+            )
+        ]
+    finally:
+        await conn.close()
+    return notifications, variants
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    notifications, variants = await load_rows(args.postgres_url, not args.no_reset)
+    connector = aiohttp.TCPConnector(limit=args.max_connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        generator = LoadGenerator(
+            session,
+            args.target,
+            args.slack,
+            notifications,
+            variants,
+            timeout=args.timeout,
+        )
+        stages = []
+        for rps in args.rps:
+            stage = await run_stage(generator, rps, args.stage_duration, args.mix)
+            stages.append(stage)
+            print(
+                f"target {rps:>8.1f}/s  offered {stage['offered_rps']:>8.1f}/s"
+                f"  completed {stage['completed_rps']:>8.1f}/s"
+                f"  errors {stage['error_rate']:>6.1%}  "
+                + "  ".join(
+                    f"{kind} p99 {report['p99'] * 1000:.0f} ms"
+                    for kind, report in stage["kinds"].items()
+                    if report["p99"] is not None
+                ),
+                file=sys.stderr,
+            )
+        async with session.get(f"{args.slack.rstrip('/')}/_stats") as response:
+            slack_stats = await response.json()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "args": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("postgres_url", "output")
+            },
+        },
+        "stages": stages,
+        "slack": slack_stats,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--target", default="http://localhost:8080")
+    parser.add_argument("--slack", default="http://localhost:3000")
+    parser.add_argument(
+        "--postgres-url",
+        default=os.environ.get("BENCHMARK_POSTGRES_URL"),
+        help="The scratch database the app uses. (env: BENCHMARK_POSTGRES_URL)",
+    )
+    parser.add_argument(
+        "--rps",
+        type=lambda value: [float(rps) for rps in value.split(",")],
+        default=[10.0, 50.0, 100.0],
+        help="Comma separated request rates, one stage each. (default: 10,50,100)",
+    )
+    parser.add_argument("--stage-duration", type=float, default=30.0)
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=parse_mix("notification=1,catalog=3,search=1"),
+        help="Weights of the request kinds. (default: notification=1,catalog=3,search=1)",
+    )
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument(
+        "--no-reset",
+        action="store_true",
+        help="Leave delivered notifications delivered.",
+    )
+    parser.add_argument("--output", help="Write the results to this file as JSON.")
+    args = parser.parse_args()
+    if not args.postgres_url:
+        parser.error("--postgres-url or BENCHMARK_POSTGRES_URL is required")
+
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
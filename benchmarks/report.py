@@ -0,0 +1,20 @@
+import subprocess
+from typing import List, Optional
+
+
+def percentile(durations: List[float], share: float) -> float:
+    ordered = sorted(durations)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+def git_commit() -> Optional[str]:
+    """The commit the results were measured at, if this is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,367 @@
+"""Benchmarks of the search, rendering and notification paths.
+
+Loads a synthetic catalog into a scratch Postgres database (its catalog tables are
+replaced), answers Slack API calls with a stub and writes the timings as JSON:
+
+    BENCHMARK_POSTGRES_URL=postgresql://... python -m benchmarks.run --output before.json
+    python -m benchmarks.compare before.json after.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from benchmarks.catalog import VENDORS, CatalogSpec, load_catalog
+from benchmarks.report import git_commit, percentile
+from benchmarks.slack_stub import StubSlackClient
+from blocks_machine import MAX_SEARCH_RESULTS, build_search_results
+from bolt_app import KnativeSlackBolt
+from data_engine import DataEngine
+from home_view import HomeViewCache
+from idempotency import IdempotencyCache
+from notifications import NotificationCoalescer
+from slack_scheduler import SlackScheduler
+
+SEARCH_TERMS = [
+    "dream machine",
+    "camera",
+    "walnut sofa",
+    "pro",
+    "outdoor access point",
+    "leather lounge chair",
+    "floor lamp",
+    "soundbar mini",
+]
+# Rate limits high enough that the scheduler never makes a call wait
+UNLIMITED = (1e9, 1_000_000)
+
+Operation = Callable[[int], Awaitable[Any]]
+
+
+async def measure(
+    name: str,
+    operation: Operation,
+    iterations: int,
+    warmup: int = 3,
+    items: int = 1,
+    reset: Optional[Callable[[], Awaitable[None]]] = None,
+    **params: Any,
+) -> Dict[str, Any]:
+    """Time `operation(i)` for `iterations` runs, then trace its allocations.
+
+    Allocations are traced in a separate, shorter pass, since tracemalloc slows
+    everything down.
+
+    Args:
+        name (str): The scenario name.
+        operation (Operation): Runs one iteration, given its index.
+        iterations (int): The timed runs.
+        warmup (int, optional): Untimed runs before the timed ones. Defaults to 3.
+        items (int, optional): The units of work in one run, e.g. notifications. Defaults to 1.
+        reset (Optional[Callable[[], Awaitable[None]]], optional): Restores the state before each pass.
+        params: Parameters recorded with the result, e.g. the catalog size.
+
+    Returns:
+        Dict[str, Any]: The result of the scenario.
+    """
+    if reset is not None:
+        await reset()
+    for index in range(warmup):
+        await operation(index)
+
+    if reset is not None:
+        await reset()
+    durations = []
+    started = time.perf_counter()
+    for index in range(iterations):
+        run_started = time.perf_counter()
+        await operation(index)
+        durations.append(time.perf_counter() - run_started)
+    elapsed = time.perf_counter() - started
+
+    if reset is not None:
+        await reset()
+    traced_runs = min(iterations, 20)
+    peak = retained = 0
+    tracemalloc.start()
+    for index in range(traced_runs):
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        await operation(index)
+        current, run_peak = tracemalloc.get_traced_memory()
+        peak += run_peak - before
+        retained += current - before
+    tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "params": params,
+        "iterations": iterations,
+        "items_per_iteration": items,
+        "throughput": iterations * items / elapsed,
+        "mean": statistics.fmean(durations),
+        "p50": percentile(durations, 0.50),
+        "p99": percentile(durations, 0.99),
+        "peak_bytes": peak // traced_runs,
+        "retained_bytes": retained // traced_runs,
+    }
+    print(
+        f"{name:<28} {json.dumps(params):<48} {result['throughput']:>10.1f}/s"
+        f"  p50 {result['p50'] * 1000:>8.2f} ms  p99 {result['p99'] * 1000:>8.2f} ms"
+        f"  peak {result['peak_bytes'] / 1024:>9.1f} KiB",
+        file=sys.stderr,
+    )
+    return result
+
+
+async def search_scenarios(
+    postgres_url: str, size: int, iterations: int, search_trigram: bool
+) -> List[Dict[str, Any]]:
+    results = []
+    for cached in (False, True):
+        data_engine = DataEngine(
+            postgres_url,
+            search_trigram=search_trigram,
+            search_cache_size=500 if cached else 0,
+        )
+        try:
+
+            async def search(index: int) -> None:
+                await data_engine.search_products(
+                    SEARCH_TERMS[index % len(SEARCH_TERMS)],
+                    limit=MAX_SEARCH_RESULTS + 1,
+                )
+
+            results.append(
+                await measure(
+                    "search_cached" if cached else "search",
+                    search,
+                    iterations,
+                    # Every term is cached before the cached runs are timed
+                    warmup=len(SEARCH_TERMS) if cached else 3,
+                    products=size,
+                )
+            )
+        finally:
+            await data_engine.close()
+    return results
+
+
+async def rendering_scenarios(
+    postgres_url: str, size: int, iterations: int
+) -> List[Dict[str, Any]]:
+    data_engine = DataEngine(postgres_url, search_cache_size=0)
+    try:
+        rows = []
+        for term in SEARCH_TERMS:
+            rows = await data_engine.search_products(term, limit=MAX_SEARCH_RESULTS)
+            if len(rows) == MAX_SEARCH_RESULTS:
+                break
+
+        async def render_search(index: int) -> None:
+            build_search_results(rows, page=1, next_page="[0.1, 1]")
+
+        results = [
+            await measure(
+                "render_search_results",
+                render_search,
+                iterations * 10,
+                products=size,
+                rows=len(rows),
+            )
+        ]
+
+        home_view = HomeViewCache(data_engine, VENDORS[:2], render_interval=0.0)
+
+        async def home_view_cold(index: int) -> None:
+            home_view.invalidate()
+            await home_view.get_blocks()
+
+        async def home_view_warm(index: int) -> None:
+            # The rows are cached; only the blocks are rendered again
+            await home_view.get_blocks()
+
+        results.append(
+            await measure("home_view_cold", home_view_cold, iterations, products=size)
+        )
+        results.append(
+            await measure("home_view_warm", home_view_warm, iterations, products=size)
+        )
+    finally:
+        await data_engine.close()
+    return results
+
+
+async def notification_scenarios(
+    postgres_url: str, size: int, iterations: int, batch_size: int, batch_wait: float
+) -> List[Dict[str, Any]]:
+    client = StubSlackClient()
+    app = KnativeSlackBolt(
+        slack_bot_token=None,
+        slack_app_token="xapp-benchmark",
+        postgres_url=postgres_url,
+        channel_id="C0BENCHMARK",
+        client=client,
+        notification_batch_wait=batch_wait,
+        notification_coalesce_window=0.0,
+    )
+    app.logger.setLevel(logging.WARNING)
+    app.slack_scheduler = SlackScheduler(
+        client,
+        rate_limits={"chat_postMessage": UNLIMITED, "chat_update": UNLIMITED},
+    )
+    async with app.data_engine.engine.connect() as conn:
+        result = await conn.exec_driver_sql(
+            "SELECT id::text FROM shopify_store_product_notifications ORDER BY id"
+        )
+        notification_ids = [row[0] for row in result]
+
+    async def reset() -> None:
+        """Make every notification undelivered and unseen again."""
+        await app.delivery_recorder.close()
+        async with app.data_engine.engine.begin() as conn:
+            await conn.exec_driver_sql(
+                "UPDATE shopify_store_product_notifications SET delivered = false"
+            )
+        app.idempotency = IdempotencyCache()
+        app.notification_coalescer = NotificationCoalescer(window=0.0)
+
+    async def single(index: int) -> None:
+        await app.handle_cloudevent_notifications(notification_ids[index])
+
+    async def batch(index: int) -> None:
+        offset = index * batch_size
+        await asyncio.gather(
+            *(
+                app.handle_cloudevent_notifications(notification_id)
+                for notification_id in notification_ids[offset : offset + batch_size]
+            )
+        )
+
+    try:
+        return [
+            await measure(
+                "notification_single",
+                single,
+                min(iterations, len(notification_ids)),
+                reset=reset,
+                products=size,
+                batch_wait=batch_wait,
+            ),
+            await measure(
+                "notification_batch",
+                batch,
+                len(notification_ids) // batch_size,
+                warmup=1,
+                items=batch_size,
+                reset=reset,
+                products=size,
+                batch_size=batch_size,
+                batch_wait=batch_wait,
+            ),
+        ]
+    finally:
+        await app.delivery_recorder.close()
+        await app.data_engine.close()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    results = []
+    for size in args.sizes:
+        spec = CatalogSpec(
+            products=size, notifications=args.notifications, seed=args.seed
+        )
+        started = time.perf_counter()
+        counts = await load_catalog(
+            args.postgres_url,
+            spec,
+            args.skip_migration,
+            ["search_trigram"] if args.search_trigram else [],
+        )
+        print(
+            f"Loaded {counts} in {time.perf_counter() - started:.1f}s", file=sys.stderr
+        )
+        results += await search_scenarios(
+            args.postgres_url, size, args.iterations, args.search_trigram
+        )
+
+    # The remaining scenarios run against the largest catalog, loaded last
+    size = args.sizes[-1]
+    results += await rendering_scenarios(args.postgres_url, size, args.iterations)
+    results += await notification_scenarios(
+        args.postgres_url,
+        size,
+        args.iterations,
+        args.batch_size,
+        args.notification_batch_wait,
+    )
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "args": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("postgres_url", "output")
+            },
+        },
+        "results": results,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--postgres-url",
+        default=os.environ.get("BENCHMARK_POSTGRES_URL"),
+        help="A scratch database; its catalog tables are replaced. (env: BENCHMARK_POSTGRES_URL)",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=lambda value: sorted(int(size) for size in value.split(",")),
+        default=[1000, 10000],
+        help="Comma separated catalog sizes, in products. (default: 1000,10000)",
+    )
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--notifications", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument(
+        "--notification-batch-wait",
+        type=float,
+        default=0.05,
+        help="Seconds a notification waits for others to batch with. (default: 0.05)",
+    )
+    parser.add_argument("--search-trigram", action="store_true")
+    parser.add_argument(
+        "--skip-migration",
+        action="append",
+        default=[],
+        help="A migration, such as 0002_search_trigram, to skip if it fails. Repeatable.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this file as JSON.")
+    args = parser.parse_args()
+    if not args.postgres_url:
+        parser.error("--postgres-url or BENCHMARK_POSTGRES_URL is required")
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run(args))
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
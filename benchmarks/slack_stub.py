@@ -0,0 +1,50 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from typing import Any, Optional
+
+from slack_sdk.web.async_client import AsyncSlackResponse, AsyncWebClient
+
+
+class StubSlackClient(AsyncWebClient):
+    def __init__(self, latency: float = 0.0, **kwargs: Any):
+        """An `AsyncWebClient` that answers every Web API call itself, after `latency` seconds.
+
+        Args:
+            latency (float, optional): Seconds every call takes. Defaults to 0.0.
+        """
+        super().__init__(token="xoxb-benchmark", **kwargs)
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._ts = itertools.count(1)
+
+    async def api_call(
+        self,
+        api_method: str,
+        *,
+        http_verb: str = "POST",
+        json: Optional[dict] = None,
+        params: Optional[dict] = None,
+        **kwargs: Any,
+    ) -> AsyncSlackResponse:
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        args = json or params or {}
+        data = {
+            "ok": True,
+            "channel": args.get("channel"),
+            "ts": args.get("ts") or f"{int(time.time())}.{next(self._ts):06d}",
+        }
+        if api_method.startswith("views."):
+            data["view"] = {"id": args.get("view_id") or "V0BENCHMARK"}
+        return AsyncSlackResponse(
+            client=self,
+            http_verb=http_verb,
+            api_url=f"{self.base_url}{api_method}",
+            req_args={"json": args},
+            data=data,
+            headers={},
+            status_code=200,
+        )
@@ -1,19 +1,110 @@
 import logging
 import os
+import tempfile
 
-from bolt_app import KnativeSlackBolt
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", 1))
+if WEB_WORKERS > 1:
+    # The workers share their metrics through files; prometheus_client looks for
+    # the directory when it is imported
+    os.environ.setdefault(
+        "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="prometheus-")
+    )
 
-logging.basicConfig(level=logging.INFO)
+from bolt_app import KnativeSlackBolt  # noqa: E402
+from metrics import clear_multiprocess_dir, configure_metrics  # noqa: E402
+from tracing import configure_tracing  # noqa: E402
+from utilities.structured_logging import (  # noqa: E402
+    configure_logging,
+    parse_sample_rates,
+)
+from workers import run_workers  # noqa: E402
 
+configure_logging(
+    level=os.environ.get("LOG_LEVEL", "INFO"),
+    json_output=os.environ.get("LOG_FORMAT", "text").lower() == "json",
+    sample_rates=parse_sample_rates(os.environ.get("LOG_SAMPLE_RATES", "")),
+    redacted_fields=[
+        field.strip()
+        for field in os.environ.get("LOG_REDACT_FIELDS", "").split(",")
+        if field.strip()
+    ],
+)
+logger = logging.getLogger("app")
+
+
+def run_worker(index: int = 0):
+    """Run the app in this process, one of `WEB_WORKERS` sharing the port."""
+    configure_metrics(worker=index)
+    export_path = os.environ.get("TRACE_EXPORT_PATH")
+    if export_path and WEB_WORKERS > 1:
+        # Each worker appends to a file of its own, so their spans do not interleave
+        export_path = f"{export_path}.{index}"
+    configure_tracing(
+        export_path=export_path,
+        slow_request_threshold=float(os.environ.get("SLOW_REQUEST_THRESHOLD", 0.0)),
+        profile_path=os.environ.get("SLOW_REQUEST_PROFILE_PATH", "slow_requests.jsonl"),
+    )
+
+    leader_election = os.environ.get("LEADER_ELECTION", "true").lower() == "true"
+    if WEB_WORKERS > 1 and not leader_election:
+        logger.warning("LEADER_ELECTION is required by WEB_WORKERS > 1; enabling it")
+        leader_election = True
+    change_broadcast = os.environ.get("CHANGE_BROADCAST", "true").lower() == "true"
+    if WEB_WORKERS > 1 and not change_broadcast:
+        logger.warning("CHANGE_BROADCAST is required by WEB_WORKERS > 1; enabling it")
+        change_broadcast = True
 
-def main():
     app = KnativeSlackBolt(
         slack_bot_token=os.environ["SLACK_BOT_TOKEN"],
         slack_app_token=os.environ["SLACK_APP_TOKEN"],
         postgres_url=os.environ["POSTGRES_URL"],
         channel_id=os.environ["CHANNEL_ID"],
+        db_pool_size=int(os.environ.get("DB_POOL_SIZE", 5)),
+        db_max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", 10)),
+        db_pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", 10.0)),
+        db_query_timeout=float(os.environ.get("DB_QUERY_TIMEOUT", 10.0)),
+        search_trigram=os.environ.get("SEARCH_TRIGRAM", "false").lower() == "true",
+        view_state_backend=os.environ.get("VIEW_STATE_BACKEND", "memory"),
+        view_state_ttl=float(os.environ.get("VIEW_STATE_TTL", 3600.0)),
+        search_cache_size=int(os.environ.get("SEARCH_CACHE_SIZE", 500)),
+        catalog_replica=os.environ.get("CATALOG_REPLICA", "false").lower() == "true",
+        catalog_replica_check_interval=float(
+            os.environ.get("CATALOG_REPLICA_CHECK_INTERVAL", 300.0)
+        ),
+        home_vendors=[
+            vendor.strip()
+            for vendor in os.environ.get("HOME_VENDORS", "").split(",")
+            if vendor.strip()
+        ],
+        notification_batch_size=int(os.environ.get("NOTIFICATION_BATCH_SIZE", 50)),
+        notification_batch_wait=float(os.environ.get("NOTIFICATION_BATCH_WAIT", 0.05)),
+        notification_concurrency=int(os.environ.get("NOTIFICATION_CONCURRENCY", 5)),
+        delivery_flush_interval=float(os.environ.get("DELIVERY_FLUSH_INTERVAL", 1.0)),
+        notification_coalesce_window=float(
+            os.environ.get("NOTIFICATION_COALESCE_WINDOW", 300.0)
+        ),
+        idempotency_cache_size=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 10000)),
+        cloudevent_async=os.environ.get("CLOUDEVENT_ASYNC", "false").lower() == "true",
+        cloudevent_queue_size=int(os.environ.get("CLOUDEVENT_QUEUE_SIZE", 1000)),
+        cloudevent_workers=int(os.environ.get("CLOUDEVENT_WORKERS", 50)),
+        cloudevent_max_attempts=int(os.environ.get("CLOUDEVENT_MAX_ATTEMPTS", 3)),
+        cloudevent_retry_delay=float(os.environ.get("CLOUDEVENT_RETRY_DELAY", 1.0)),
+        slack_max_in_flight=int(os.environ.get("SLACK_MAX_IN_FLIGHT", 10)),
+        slack_max_retries=int(os.environ.get("SLACK_MAX_RETRIES", 3)),
+        slack_api_url=os.environ.get("SLACK_API_URL"),
+        leader_election=leader_election,
+        leader_retry_interval=float(os.environ.get("LEADER_RETRY_INTERVAL", 1.0)),
+        change_broadcast=change_broadcast,
     )
-    app.run_app(port=os.environ.get("PORT", 8080))
+    app.run_app(port=int(os.environ.get("PORT", 8080)), reuse_port=WEB_WORKERS > 1)
+
+
+def main():
+    if WEB_WORKERS > 1:
+        clear_multiprocess_dir()
+        run_workers(run_worker, WEB_WORKERS)
+    else:
+        run_worker()
 
 
 if __name__ == "__main__":
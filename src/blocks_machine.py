@@ -1,177 +1,298 @@
 import datetime as datetime
-from typing import Any, Dict, List, Tuple
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Hashable, List, Optional, Tuple
 
 import humanize
-import pytz
-from slack_sdk.models.blocks import (
-    ActionsBlock,
-    Block,
-    ButtonElement,
-    ContextBlock,
-    DividerBlock,
-    HeaderBlock,
-    ImageElement,
-    MarkdownTextObject,
-    PlainTextObject,
-    SectionBlock,
-    TextObject,
-)
 
 from models.shopify_store import (
     ShopifyStoreImage,
     ShopifyStoreProduct,
     ShopifyStoreVariant,
 )
+from utilities.structured_logging import LazyJson
+
+if TYPE_CHECKING:
+    from typeahead import TypeaheadProduct
+
+logger = logging.getLogger(__name__)
+
+# Slack modals hold at most 100 blocks; keep room for the search inputs.
+MAX_RESULT_BLOCKS = 75
+BLOCKS_PER_RESULT = 4
+MAX_SEARCH_RESULTS = (MAX_RESULT_BLOCKS - 1) // BLOCKS_PER_RESULT
+MAX_HOME_RESULTS = MAX_RESULT_BLOCKS // BLOCKS_PER_RESULT
+
+DIVIDER = {"type": "divider"}
+IN_STOCK = {"type": "mrkdwn", "text": ":white_check_mark: *in stock*"}
+OUT_OF_STOCK = {"type": "mrkdwn", "text": ":x: *out of stock*"}
+NOW_IN_STOCK = {"type": "mrkdwn", "text": ":white_check_mark: *now in stock*"}
+NOW_OUT_OF_STOCK = {"type": "mrkdwn", "text": ":x: *now out of stock*"}
+
+SEARCH_QUERY_BLOCK = {
+    "type": "input",
+    "block_id": "search-query",
+    "dispatch_action": True,
+    "label": {"type": "plain_text", "text": "Search"},
+    "element": {"type": "plain_text_input", "action_id": "search-query"},
+}
+PRODUCT_PICKER_BLOCK = {
+    "type": "actions",
+    "block_id": "product-picker",
+    "elements": [
+        {
+            "type": "external_select",
+            "action_id": "product-picker",
+            "placeholder": {"type": "plain_text", "text": "Jump to a product"},
+            "min_query_length": 2,
+        }
+    ],
+}
+# Slack's limit on the text of a select menu option
+MAX_OPTION_TEXT = 75
 
 
 def cast_timestamp_utc(timestamp: datetime) -> datetime:
     # Check if the timestamp is offset-naive
     if timestamp.tzinfo is None:
-        return pytz.UTC.localize(timestamp)
-    return timestamp.astimezone(pytz.UTC)
+        return timestamp.replace(tzinfo=datetime.timezone.utc)
+    return timestamp.astimezone(datetime.timezone.utc)
 
 
-def build_search_results(
-    results: List[Tuple[ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage]]
-) -> List[Block]:
-    blocks = [
-        SectionBlock(text=MarkdownTextObject(text=f"*{len(results)}* results found")),
-    ]
-    for result in results:
-        product: ShopifyStoreProduct = result[0]
-        variant: ShopifyStoreVariant = result[1]
-        image: ShopifyStoreImage = result[2]
-
-        product_variant = "/".join(
-            [
-                str(product.id),
-                str(variant.id),
-            ]
-        )
+def plain_text(text: str) -> Dict[str, Any]:
+    return {"type": "plain_text", "text": text}
+
+
+@dataclass
+class ProductCard:
+    # The parts of a card that only change with the product or variant
+    section: Dict[str, Any]
+    actions: Dict[str, Any]
+    available: bool
+    updated_at: datetime.datetime
+    published_at: Optional[datetime.datetime]
+
+
+class ProductCardCache:
+    def __init__(self, max_entries: int = 2048):
+        """Product cards rendered as Slack block dicts, kept until their rows change.
+
+        A card is keyed by its product and variant with their `updated_at`, and by
+        the product's `track` flag, which changes without touching `updated_at`.
+        Only the relative time shown on a card is rendered again every time.
 
-        stock_status_memo = f'{":white_check_mark: *in stock*" if variant.available else ":x: *out of stock*"}'
-        last_updated = humanize.naturaldelta(
-            cast_timestamp_utc(datetime.datetime.now())
-            - cast_timestamp_utc(variant.updated_at)
+        Args:
+            max_entries (int, optional): Cards kept, least recently used first out. Defaults to 2048.
+        """
+        self.max_entries = max_entries
+        self._cards: "OrderedDict[Hashable, ProductCard]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self,
+        product: ShopifyStoreProduct,
+        variant: ShopifyStoreVariant,
+        image_src: Optional[str],
+    ) -> ProductCard:
+        key = (
+            product.id,
+            variant.id,
+            product.updated_at,
+            variant.updated_at,
+            product.track,
+            image_src,
         )
+        card = self._cards.get(key)
+        if card is not None:
+            self._cards.move_to_end(key)
+            self.hits += 1
+            return card
 
-        blocks.extend(
-            [
-                DividerBlock(),
-                SectionBlock(
-                    text=MarkdownTextObject(
-                        text=f"*<{product.handle}|{product.title}>*\n{product.vendor}\n{variant.price}"
-                    ),
-                    accessory=ImageElement(image_url=image.src, alt_text=product.title),
-                ),
-                ContextBlock(
-                    elements=[
-                        TextObject(
-                            type="mrkdwn",
-                            text=stock_status_memo,
-                        ),
-                        TextObject(
-                            type="mrkdwn",
-                            text=f"Updated {last_updated} ago",
-                        ),
-                    ]
-                ),
-                ActionsBlock(
-                    elements=[
-                        ButtonElement(
-                            action_id="untrack-product"
+        self.misses += 1
+        card = ProductCard(
+            section={
+                "type": "section",
+                "text": {
+                    "type": "mrkdwn",
+                    "text": f"*<{product.handle}|{product.title}>*\n{product.vendor}\n{variant.price}",
+                },
+                "accessory": {
+                    "type": "image",
+                    "image_url": image_src,
+                    "alt_text": product.title,
+                },
+            },
+            actions={
+                "type": "actions",
+                "elements": [
+                    {
+                        "type": "button",
+                        "action_id": "untrack-product"
+                        if product.track
+                        else "track-product",
+                        "text": plain_text(
+                            "Turn off notificaitons"
                             if product.track
-                            else "track-product",
-                            text=PlainTextObject(
-                                text="Turn off notificaitons"
-                                if product.track
-                                else "Turn on notifications"
-                            ),
-                            value=product_variant,
-                            style="danger" if product.track else "primary",
+                            else "Turn on notifications"
                         ),
-                        ButtonElement(
-                            action_id=product.handle,
-                            text=PlainTextObject(text="View online"),
-                            url=product.handle,
-                        ),
-                    ],
-                ),
-            ]
+                        "value": f"{product.id}/{variant.id}",
+                        "style": "danger" if product.track else "primary",
+                    },
+                    {
+                        "type": "button",
+                        "action_id": product.handle,
+                        "text": plain_text("View online"),
+                        "url": product.handle,
+                    },
+                ],
+            },
+            available=variant.available,
+            updated_at=cast_timestamp_utc(variant.updated_at),
+            published_at=product.published_at
+            and cast_timestamp_utc(product.published_at),
         )
-    return blocks[:75]
+        self._cards[key] = card
+        if len(self._cards) > self.max_entries:
+            self._cards.popitem(last=False)
+        return card
+
+    def clear(self) -> None:
+        self._cards.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cards": len(self._cards), "hits": self.hits, "misses": self.misses}
+
+
+product_cards = ProductCardCache()
+
+
+def render_card(
+    card: ProductCard, status: Dict[str, Any], time_text: str
+) -> List[Dict[str, Any]]:
+    """The divider, section, context and actions blocks of a listed product."""
+    return [
+        DIVIDER,
+        card.section,
+        {
+            "type": "context",
+            "elements": [status, {"type": "mrkdwn", "text": time_text}],
+        },
+        card.actions,
+    ]
+
+
+def build_search_results(
+    results: List[Tuple[ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage]],
+    page: int = 1,
+    next_page: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Build the blocks for one page of search results.
+
+    Args:
+        results: The rows shown on this page; those beyond the block budget are left out.
+        page (int, optional): The 1-based page number. Defaults to 1.
+        next_page (Optional[str], optional): The cursor of the next page, if there is one. Defaults to None.
+    """
+    if page > 1 or next_page is not None:
+        summary = f"Page *{page}*, showing *{len(results)}* results"
+    else:
+        summary = f"*{len(results)}* results found"
+    blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": summary}}]
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for result in results[:MAX_SEARCH_RESULTS]:
+        card = product_cards.get(result[0], result[1], result[2].src)
+        last_updated = humanize.naturaldelta(now - card.updated_at)
+        blocks.extend(
+            render_card(
+                card,
+                IN_STOCK if card.available else OUT_OF_STOCK,
+                f"Updated {last_updated} ago",
+            )
+        )
+
+    page_buttons = []
+    if page > 1:
+        page_buttons.append(
+            {
+                "type": "button",
+                "action_id": "search-previous-page",
+                "text": plain_text("Previous page"),
+                "value": str(page - 1),
+            }
+        )
+    if next_page is not None:
+        page_buttons.append(
+            {
+                "type": "button",
+                "action_id": "search-next-page",
+                "text": plain_text("Next page"),
+                "value": next_page,
+            }
+        )
+    if page_buttons:
+        blocks.extend([DIVIDER, {"type": "actions", "elements": page_buttons}])
+    return blocks
 
 
 def build_most_recently_released(
     results: List[Tuple[ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage]]
-) -> List[Block]:
+) -> List[Dict[str, Any]]:
     blocks = []
-    for result in results:
-        product: ShopifyStoreProduct = result[0]
-        variant: ShopifyStoreVariant = result[1]
-        image: ShopifyStoreImage = result[2]
-
-        product_variant = "/".join(
-            [
-                str(product.id),
-                str(variant.id),
-            ]
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for result in results[:MAX_HOME_RESULTS]:
+        card = product_cards.get(result[0], result[1], result[2].src)
+        released_ago = humanize.naturaldelta(now - card.published_at)
+        blocks.extend(
+            render_card(
+                card,
+                IN_STOCK if card.available else OUT_OF_STOCK,
+                f"Released {released_ago} ago",
+            )
         )
+    return blocks
 
-        stock_status_memo = f'{":white_check_mark: *in stock*" if variant.available else ":x: *out of stock*"}'
-        released_ago = humanize.naturaldelta(
-            cast_timestamp_utc(datetime.datetime.now())
-            - cast_timestamp_utc(product.published_at)
+
+def build_product_options(products: List["TypeaheadProduct"]) -> List[Dict[str, Any]]:
+    """Build the select menu options of the product picker, valued by product ID."""
+    options = []
+    for product in products:
+        text = (
+            f"{product.title} · {product.vendor}" if product.vendor else product.title
         )
+        if len(text) > MAX_OPTION_TEXT:
+            text = text[: MAX_OPTION_TEXT - 1] + "…"
+        options.append({"text": plain_text(text), "value": str(product.id)})
+    return options
 
-        blocks.extend(
-            [
-                DividerBlock(),
-                SectionBlock(
-                    text=MarkdownTextObject(
-                        text=f"*<{product.handle}|{product.title}>*\n{product.vendor}\n{variant.price}"
-                    ),
-                    accessory=ImageElement(
-                        image_url=image.src,
-                        alt_text=product.title,
-                    ),
-                ),
-                ContextBlock(
-                    elements=[
-                        TextObject(
-                            type="mrkdwn",
-                            text=stock_status_memo,
-                        ),
-                        TextObject(
-                            type="mrkdwn",
-                            text=f"Released {released_ago} ago",
-                        ),
-                    ]
-                ),
-                ActionsBlock(
-                    elements=[
-                        ButtonElement(
-                            action_id="untrack-product"
-                            if product.track
-                            else "track-product",
-                            text=PlainTextObject(
-                                text="Turn off notificaitons"
-                                if product.track
-                                else "Turn on notifications"
-                            ),
-                            value=product_variant,
-                            style="danger" if product.track else "primary",
-                        ),
-                        ButtonElement(
-                            action_id=product.handle,
-                            text=PlainTextObject(text="View online"),
-                            url=product.handle,
-                        ),
-                    ],
-                ),
-            ]
+
+def build_notification_title(
+    product: ShopifyStoreProduct,
+    variant: ShopifyStoreVariant,
+    notable_changes: Dict[str, Any],
+) -> str:
+    message_title_components = [product.title]
+    message_title_components.append(
+        variant.title if variant.title != "Default Title" else None
+    )
+
+    message_title_updates = []
+    if "available" in notable_changes:
+        availability = "available" if variant.available else "unavailable"
+        message_title_updates.append(f"now {availability}!")
+    if "price" in notable_changes:
+        d_price = (
+            "drop"
+            if notable_changes["price"][0] > notable_changes["price"][1]
+            else "increase"
         )
-    return blocks[:75]
+        message_title_updates.append(f"price {d_price}!")
+    message_title_components.append(
+        " with ".join(message_title_updates) if message_title_updates else None
+    )
+    return " ".join(list(filter(None.__ne__, message_title_components)))
 
 
 def build_notification_block(
@@ -180,41 +301,26 @@ def build_notification_block(
     header: str,
     featured_image: str,
     notable_changes: Dict[str, Any],
-) -> List[Block]:
-    print(str(notable_changes))
+) -> List[Dict[str, Any]]:
+    logger.debug("Notable changes: %s", LazyJson(notable_changes))
+    card = product_cards.get(product, variant, featured_image)
     updated_ago = humanize.naturaldelta(
-        cast_timestamp_utc(datetime.datetime.now())
-        - cast_timestamp_utc(variant.updated_at)
+        datetime.datetime.now(datetime.timezone.utc) - card.updated_at
     )
 
-    stock_status_memo = f'{":white_check_mark: *in stock*" if variant.available else ":x: *out of stock*"}'
     if "available" in notable_changes:
-        stock_status_memo = f'{":white_check_mark: *now in stock*" if variant.available else ":x: *now out of stock*"}'
-
-    blocks = list(
-        [
-            HeaderBlock(text=PlainTextObject(text=header)),
-            SectionBlock(
-                text=MarkdownTextObject(
-                    text=f"*<{product.handle}|{product.title}>*\n{product.vendor}\n{variant.price}"
-                ),
-                accessory=ImageElement(
-                    image_url=featured_image,
-                    alt_text=product.title,
-                ),
-            ),
-            ContextBlock(
-                elements=[
-                    TextObject(
-                        type="mrkdwn",
-                        text=stock_status_memo,
-                    ),
-                    TextObject(
-                        type="mrkdwn",
-                        text=f"Updated {updated_ago} ago",
-                    ),
-                ]
-            ),
-        ],
-    )
-    return blocks
+        status = NOW_IN_STOCK if card.available else NOW_OUT_OF_STOCK
+    else:
+        status = IN_STOCK if card.available else OUT_OF_STOCK
+
+    return [
+        {"type": "header", "text": plain_text(header)},
+        card.section,
+        {
+            "type": "context",
+            "elements": [
+                status,
+                {"type": "mrkdwn", "text": f"Updated {updated_ago} ago"},
+            ],
+        },
+    ]
@@ -1,25 +1,65 @@
+import asyncio
+import json
 from logging import Logger
-from typing import Optional
+from typing import TYPE_CHECKING, List, Optional
 
+import aiohttp
 from aiohttp import web
 from path_dict import PathDict
-from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
 from slack_bolt.async_app import AsyncAck, AsyncApp
 from slack_sdk.errors import SlackApiError
-from slack_sdk.models.blocks import InputBlock, PlainTextInputElement, PlainTextObject
-from slack_sdk.models.views import View
-from slack_sdk.socket_mode.aiohttp import SocketModeClient
 from slack_sdk.web.async_client import AsyncSlackResponse, AsyncWebClient
 
 from blocks_machine import (
-    build_most_recently_released,
+    MAX_SEARCH_RESULTS,
+    PRODUCT_PICKER_BLOCK,
+    SEARCH_QUERY_BLOCK,
     build_notification_block,
+    build_notification_title,
+    build_product_options,
     build_search_results,
+    product_cards,
 )
-from data_engine import DataEngine
-from utilities.middleware import cloudevent_handler, healthcheck_handler, log_request
+from change_broadcast import ChangeBroadcast
+from data_engine import DataEngine, NotificationEnrichment
+from home_view import DEFAULT_HOME_VENDORS, HomeViewCache
+from idempotency import IdempotencyCache
+from leader import LeaderElector
+from metrics import (
+    COMPONENT_STATS,
+    LISTENER_LATENCY,
+    SOCKET_MODE_RECONNECTS,
+    export_component_stats,
+    monitor_event_loop_lag,
+    timed,
+)
+from notifications import (
+    CoalescedMessage,
+    DeliveryRecorder,
+    EventWorkerPool,
+    NotificationBatcher,
+    NotificationCoalescer,
+)
+from slack_scheduler import Priority, SlackScheduler
+from startup import StartupTimer
+from supersession import Superseded, Supersession
+from tracing import traced, tracer
+from typeahead import TypeaheadIndex
+from utilities.middleware import (
+    cloudevent_handler,
+    healthcheck_handler,
+    liveness_handler,
+    log_request,
+    metrics_handler,
+)
+from utilities.structured_logging import LazyJson
 
-socket_mode_client: Optional[SocketModeClient] = None
+if TYPE_CHECKING:
+    # Imported when this replica becomes the leader; followers never need them
+    from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+    from slack_sdk.socket_mode.aiohttp import SocketModeClient
+
+socket_mode_client: Optional["SocketModeClient"] = None
 
 
 class KnativeSlackBolt(AsyncApp):
@@ -29,6 +69,34 @@ class KnativeSlackBolt(AsyncApp):
         slack_app_token: str,
         postgres_url: str,
         channel_id: str,
+        db_pool_size: int = 5,
+        db_max_overflow: int = 10,
+        db_pool_timeout: float = 10.0,
+        db_query_timeout: float = 10.0,
+        search_trigram: bool = False,
+        view_state_backend: str = "memory",
+        view_state_ttl: float = 3600.0,
+        search_cache_size: int = 500,
+        catalog_replica: bool = False,
+        catalog_replica_check_interval: float = 300.0,
+        home_vendors: Optional[List[str]] = None,
+        notification_batch_size: int = 50,
+        notification_batch_wait: float = 0.05,
+        notification_concurrency: int = 5,
+        delivery_flush_interval: float = 1.0,
+        notification_coalesce_window: float = 300.0,
+        idempotency_cache_size: int = 10000,
+        cloudevent_async: bool = False,
+        cloudevent_queue_size: int = 1000,
+        cloudevent_workers: int = 50,
+        cloudevent_max_attempts: int = 3,
+        cloudevent_retry_delay: float = 1.0,
+        slack_max_in_flight: int = 10,
+        slack_max_retries: int = 3,
+        slack_api_url: Optional[str] = None,
+        leader_election: bool = True,
+        leader_retry_interval: float = 1.0,
+        change_broadcast: bool = True,
         **kwargs,
     ):
         """Custom extention of the Bolt App that provides functionalities to register middleware/listeners.
@@ -37,6 +105,35 @@ class KnativeSlackBolt(AsyncApp):
             slack_bot_token (str): The Slack bot token.
             slack_app_token (str): The Slack app token.
             postgres_url (str): The URL to the Postgres database.
+            channel_id (str): The channel notifications are posted to.
+            db_pool_size (int): Connections kept open in the database pool. (Default: 5)
+            db_max_overflow (int): Extra connections allowed above `db_pool_size`. (Default: 10)
+            db_pool_timeout (float): Seconds to wait for a free database connection. (Default: 10.0)
+            db_query_timeout (float): Seconds a single query may run before it is cancelled. (Default: 10.0)
+            search_trigram (bool): Match partial words and SKUs through the pg_trgm index. (Default: False)
+            view_state_backend (str): Where modal view state is kept, "memory" or "postgres". (Default: "memory")
+            view_state_ttl (float): Seconds a modal view's state is kept. (Default: 3600.0)
+            search_cache_size (int): Search result pages cached, 0 disables the cache. (Default: 500)
+            catalog_replica (bool): Serve App Home and featured image reads from an in-memory copy kept current by change events. (Default: False)
+            catalog_replica_check_interval (float): Seconds between checks of the catalog replica against the database. (Default: 300.0)
+            home_vendors (Optional[List[str]]): The vendors whose newest products are shown on the App Home.
+            notification_batch_size (int): Notifications resolved together at most. (Default: 50)
+            notification_batch_wait (float): Seconds a notification waits for others to batch with. (Default: 0.05)
+            notification_concurrency (int): Notifications posted to Slack at the same time. (Default: 5)
+            delivery_flush_interval (float): Seconds delivery outcomes are buffered before they are written. (Default: 1.0)
+            notification_coalesce_window (float): Seconds a posted notification absorbs later changes of its variant, 0 disables it. (Default: 300.0)
+            idempotency_cache_size (int): Handled CloudEvent and notification IDs remembered to answer redeliveries. (Default: 10000)
+            cloudevent_async (bool): Answer notification CloudEvents with 202 and deliver them in the background. (Default: False)
+            cloudevent_queue_size (int): Accepted CloudEvents waiting for a worker at most, when asynchronous. (Default: 1000)
+            cloudevent_workers (int): CloudEvents handled at the same time, when asynchronous. (Default: 50)
+            cloudevent_max_attempts (int): Attempts at delivering an accepted notification, when asynchronous. (Default: 3)
+            cloudevent_retry_delay (float): Seconds before the second attempt at an accepted notification, doubling after each. (Default: 1.0)
+            slack_max_in_flight (int): Slack API calls running at the same time. (Default: 10)
+            slack_max_retries (int): Retries of a rate limited Slack API call. (Default: 3)
+            slack_api_url (Optional[str]): The Web API base URL, e.g. of a local stand-in for Slack. (Default: Slack's)
+            leader_election (bool): Open Socket Mode only on the replica holding a Postgres advisory lock. (Default: True)
+            leader_retry_interval (float): Seconds between a follower's attempts to become the leader. (Default: 1.0)
+            change_broadcast (bool): Relay handled change events and notification messages to the other replicas and workers through Postgres NOTIFY. (Default: True)
             logger: The custom logger that can be used in this app.
             name: The application name that will be used in logging. If absent, the source file name will be used.
             process_before_response: True if this app runs on Function as a Service. (Default: False)
@@ -70,15 +167,125 @@ class KnativeSlackBolt(AsyncApp):
             oauth_flow: Instantiated `slack_bolt.oauth.AsyncOAuthFlow`. This is always prioritized over oauth_settings.
             verification_token: Deprecated verification mechanism. This can used only for ssl_check requests.
         """
+        self.startup = StartupTimer()
         self.slack_bot_token = slack_bot_token
         self.slack_app_token = slack_app_token
         self.channel_id = channel_id
 
-        super().__init__(token=self.slack_bot_token, **kwargs)
-
-        self.data_engine = DataEngine(postgres_url)
+        if slack_api_url and "client" not in kwargs:
+            # Socket Mode opens its connection through the same client
+            kwargs["client"] = AsyncWebClient(
+                token=self.slack_bot_token, base_url=slack_api_url
+            )
+            super().__init__(**kwargs)
+        else:
+            super().__init__(token=self.slack_bot_token, **kwargs)
+
+        self.slack_scheduler = SlackScheduler(
+            self.client,
+            max_in_flight=slack_max_in_flight,
+            max_retries=slack_max_retries,
+        )
+        self.data_engine = DataEngine(
+            postgres_url,
+            pool_size=db_pool_size,
+            max_overflow=db_max_overflow,
+            pool_timeout=db_pool_timeout,
+            query_timeout=db_query_timeout,
+            search_trigram=search_trigram,
+            view_state_backend=view_state_backend,
+            view_state_ttl=view_state_ttl,
+            search_cache_size=search_cache_size,
+            catalog_replica=catalog_replica,
+            catalog_replica_check_interval=catalog_replica_check_interval,
+        )
+        self.home_view = HomeViewCache(
+            self.data_engine,
+            home_vendors or DEFAULT_HOME_VENDORS,
+            product_vendor=self.product_vendor,
+        )
+        self.typeahead = TypeaheadIndex(self.data_engine)
+        self.notification_batcher = NotificationBatcher(
+            self.data_engine.get_notification_enrichments,
+            self.deliver_notification,
+            max_batch_size=notification_batch_size,
+            max_wait=notification_batch_wait,
+            max_concurrency=notification_concurrency,
+        )
+        self.notification_coalescer = NotificationCoalescer(
+            window=notification_coalesce_window,
+            on_message=self.share_coalesced_message,
+        )
+        self.idempotency = IdempotencyCache(max_entries=idempotency_cache_size)
+        # Only the newest search of each modal view is run and shown
+        self.search_supersession = Supersession()
+        self.event_pool: Optional[EventWorkerPool] = None
+        if cloudevent_async:
+            self.event_pool = EventWorkerPool(
+                max_queue_size=cloudevent_queue_size,
+                workers=cloudevent_workers,
+                max_attempts=cloudevent_max_attempts,
+                retry_delay=cloudevent_retry_delay,
+            )
+        self.delivery_recorder = DeliveryRecorder(
+            self.data_engine.mark_notifications_delivered,
+            flush_interval=delivery_flush_interval,
+        )
+        self.leader_elector: Optional[LeaderElector] = None
+        if leader_election:
+            self.leader_elector = LeaderElector(
+                postgres_url,
+                on_elected=self.connect_socket_mode,
+                on_deposed=self.disconnect_socket_mode,
+                retry_interval=leader_retry_interval,
+            )
+        self.change_broadcast: Optional[ChangeBroadcast] = None
+        if change_broadcast:
+            self.change_broadcast = ChangeBroadcast(
+                postgres_url,
+                on_change=self.apply_catalog_change,
+                on_message=self.notification_coalescer.remember,
+                on_resync=self.resync_caches,
+            )
         self.app = None
-        self.socket_mode_handler: AsyncSocketModeHandler = None
+        self.socket_mode_handler: Optional["AsyncSocketModeHandler"] = None
+        self.register_stats()
+        self.startup.record("init")
+
+    def product_vendor(self, product_id: int) -> Optional[str]:
+        """The vendor of a product as the catalog replica or the typeahead index knows it."""
+        replica = self.data_engine.catalog_replica
+        if replica is not None and replica.loaded and product_id in replica.products:
+            return replica.products[product_id].vendor
+        product = self.typeahead.get(product_id)
+        return product and product.vendor
+
+    def register_stats(self):
+        """Export the components' stats on the /metrics endpoint."""
+        COMPONENT_STATS.add("startup", self.startup.stats)
+        COMPONENT_STATS.add("db_pool", self.data_engine.pool_stats)
+        COMPONENT_STATS.add("view_state", self.data_engine.view_state.stats)
+        if self.data_engine.search_cache is not None:
+            COMPONENT_STATS.add("search_cache", self.data_engine.search_cache.stats)
+        if self.data_engine.catalog_replica is not None:
+            COMPONENT_STATS.add(
+                "catalog_replica", self.data_engine.catalog_replica.stats
+            )
+        COMPONENT_STATS.add("home_view", self.home_view.stats)
+        COMPONENT_STATS.add("typeahead", self.typeahead.stats)
+        COMPONENT_STATS.add("product_cards", product_cards.stats)
+        COMPONENT_STATS.add("search_supersession", self.search_supersession.stats)
+        COMPONENT_STATS.add("notification_batcher", self.notification_batcher.stats)
+        COMPONENT_STATS.add("notification_coalescer", self.notification_coalescer.stats)
+        COMPONENT_STATS.add("delivery_recorder", self.delivery_recorder.stats)
+        COMPONENT_STATS.add("idempotency", self.idempotency.stats)
+        if self.leader_elector is not None:
+            COMPONENT_STATS.add("leader_election", self.leader_elector.stats)
+        if self.event_pool is not None:
+            COMPONENT_STATS.add("event_pool", self.event_pool.stats)
+        if self.change_broadcast is not None:
+            COMPONENT_STATS.add("change_broadcast", self.change_broadcast.stats)
+        COMPONENT_STATS.add("slack_scheduler", self.slack_scheduler.stats)
 
     def register_handlers(self):
         """Register all of the handlers for the app."""
@@ -90,15 +297,20 @@ class KnativeSlackBolt(AsyncApp):
         self.action("track-product")((self.perform_search))
         self.action("untrack-product")(self.perform_search)
         self.action("search-query")(self.perform_search)
+        self.action("product-picker")(self.perform_search)
+        self.options("product-picker")(self.suggest_products)
+        self.action("search-next-page")(self.perform_search)
+        self.action("search-previous-page")(self.perform_search)
 
         self.event("app_home_opened")(self.push_home_view)
 
-    def run_app(self, port: int = 8080):
+    def run_app(self, port: int = 8080, reuse_port: bool = False):
         """
         Runs the application on the specified port.
 
         Args:
             port (int, optional): The port number to run the application on. Defaults to 8080.
+            reuse_port (bool, optional): Share the port with other worker processes through SO_REUSEPORT. Defaults to False.
 
         Returns:
             None
@@ -113,25 +325,148 @@ class KnativeSlackBolt(AsyncApp):
         self.app.add_routes(
             [
                 web.get("/healthz", healthcheck_handler),
+                web.get("/livez", liveness_handler),
                 web.post("/cloudevents", cloudevent_handler),
+                web.get("/metrics", metrics_handler),
             ]
         )
 
         async def start_socket_mode(web_app: web.Application):
-            self.socket_mode_handler = AsyncSocketModeHandler(
-                self, self.slack_app_token
-            )
-            await self.socket_mode_handler.connect_async()
-            global socket_mode_client
-            socket_mode_client = self.socket_mode_handler.client
+            # Every replica serves /cloudevents; only the leader connects to Slack
+            if self.leader_elector is not None:
+                self.leader_elector.start()
+            else:
+                await self.connect_socket_mode()
 
         async def shutdown_socket_mode(web_app: web.Application):
-            await self.socket_mode_handler.client.close()
+            if self.leader_elector is not None:
+                await self.leader_elector.close()
+            else:
+                await self.disconnect_socket_mode()
+
+        async def start_delivery_recorder(web_app: web.Application):
+            self.delivery_recorder.start()
+            if self.event_pool is not None:
+                self.event_pool.start()
+
+        async def drain_notifications(web_app: web.Application):
+            if self.event_pool is not None:
+                await self.event_pool.close()
+            await self.notification_batcher.close()
+            await self.delivery_recorder.close()
+
+        async def start_change_broadcast(web_app: web.Application):
+            if self.change_broadcast is not None:
+                self.change_broadcast.start()
+
+        async def stop_change_broadcast(web_app: web.Application):
+            if self.change_broadcast is not None:
+                await self.change_broadcast.close()
+
+        async def close_data_engine(web_app: web.Application):
+            await self.data_engine.close()
+
+        async def start_lag_monitor(web_app: web.Application):
+            web_app["lag_monitor"] = asyncio.ensure_future(monitor_event_loop_lag())
+            web_app["stats_exporter"] = None
+            if COMPONENT_STATS.multiprocess_dir is not None:
+                # The worker answering a scrape reports the other workers' gauges too
+                web_app["stats_exporter"] = asyncio.ensure_future(
+                    export_component_stats()
+                )
+
+        async def stop_lag_monitor(web_app: web.Application):
+            web_app["lag_monitor"].cancel()
+            if web_app["stats_exporter"] is not None:
+                web_app["stats_exporter"].cancel()
+
+        async def close_tracer(web_app: web.Application):
+            tracer.close()
+
+        async def start_warm_up(web_app: web.Application):
+            self.startup.record("app_setup")
+            # Reused by every Slack API call, so its connections are kept alive
+            self.client.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.client.timeout)
+            )
+            # /healthz reports ready once this is done; the server already listens
+            web_app["warm_up"] = asyncio.ensure_future(self.warm_up())
 
+        async def stop_warm_up(web_app: web.Application):
+            web_app["warm_up"].cancel()
+            await self.client.session.close()
+
+        self.app.on_startup.append(start_lag_monitor)
+        self.app.on_startup.append(start_delivery_recorder)
         self.app.on_startup.append(start_socket_mode)
+        self.app.on_startup.append(start_change_broadcast)
+        self.app.on_startup.append(start_warm_up)
+        self.app.on_shutdown.append(drain_notifications)
         self.app.on_shutdown.append(shutdown_socket_mode)
-        web.run_app(app=self.app, port=port)
-
+        self.app.on_shutdown.append(stop_change_broadcast)
+        self.app.on_cleanup.append(close_data_engine)
+        self.app.on_cleanup.append(stop_lag_monitor)
+        self.app.on_cleanup.append(close_tracer)
+        self.app.on_cleanup.append(stop_warm_up)
+        web.run_app(app=self.app, port=port, reuse_port=reuse_port or None)
+
+    async def warm_up(self):
+        """Open the database pool and the Slack connection, load the catalog replica and fill the caches.
+
+        The replica is not ready until the database and Slack can be reached; the
+        caches are optional and fill on first use if their step fails.
+        """
+        steps = [
+            self.startup.run("db_pool", self.data_engine.warm_up, critical=True),
+            self.startup.run("slack_client", self.client.auth_test, critical=True),
+            self.startup.run("home_view", self.home_view.get_blocks),
+            self.startup.run("typeahead", self.typeahead.load),
+        ]
+        replica = self.data_engine.catalog_replica
+        if replica is not None:
+            steps.append(self.startup.run("catalog_replica", replica.load))
+        await asyncio.gather(*steps)
+        if replica is not None:
+            replica.start()
+        self.startup.record("warm_up")
+        self.startup.finish()
+
+    @property
+    def role(self) -> str:
+        """The replica's role: "leader" if it holds the Socket Mode connection, else "follower"."""
+        if self.leader_elector is None:
+            return "leader"
+        return self.leader_elector.role
+
+    async def connect_socket_mode(self):
+        """Open the Socket Mode connection."""
+        from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+
+        self.socket_mode_handler = AsyncSocketModeHandler(self, self.slack_app_token)
+        await self.socket_mode_handler.connect_async()
+
+        # Every later connect() replaces a dropped or refreshed session
+        client = self.socket_mode_handler.client
+        connect = client.connect
+
+        async def reconnect():
+            SOCKET_MODE_RECONNECTS.inc()
+            await connect()
+
+        client.connect = reconnect
+        global socket_mode_client
+        socket_mode_client = self.socket_mode_handler.client
+
+    async def disconnect_socket_mode(self):
+        """Close the Socket Mode connection, if one is open."""
+        global socket_mode_client
+        handler, self.socket_mode_handler = self.socket_mode_handler, None
+        socket_mode_client = None
+        if handler is not None:
+            await handler.client.close()
+
+    @timed(LISTENER_LATENCY)
+    @traced
     async def open_search(
         self,
         body: dict,
@@ -148,31 +483,35 @@ class KnativeSlackBolt(AsyncApp):
             logger (Logger): The logger.
         """
         await ack()
-        res: AsyncSlackResponse = await client.views_open(
+        res: AsyncSlackResponse = await self.slack_scheduler.call(
+            "views_open",
+            Priority.INTERACTIVE,
+            client=client,
             trigger_id=body["trigger_id"],
-            view=View(
-                type="modal",
-                callback_id="view-id",
-                title=PlainTextObject(text="Inventory Search"),
-                submit=PlainTextObject(text="Done"),
-                blocks=[
-                    InputBlock(
-                        element=PlainTextInputElement(action_id="search-query"),
-                        label=PlainTextObject(text="Search items"),
-                        dispatch_action=True,
-                        others={"hint": "Hint"},
-                        block_id="search-query",
-                        action_id="search-query",
-                    )
+            view={
+                "type": "modal",
+                "callback_id": "view-id",
+                "title": {"type": "plain_text", "text": "Inventory Search"},
+                "submit": {"type": "plain_text", "text": "Done"},
+                "blocks": [
+                    {
+                        **SEARCH_QUERY_BLOCK,
+                        "label": {"type": "plain_text", "text": "Search items"},
+                    },
+                    PRODUCT_PICKER_BLOCK,
                 ],
-            ),
+            },
         )
         logger.debug("views.open: %s", res.data)
 
+    @timed(LISTENER_LATENCY)
+    @traced
     async def perform_search(
         self, ack: AsyncAck, body: dict, client: AsyncWebClient, logger: Logger
     ):
-        """Search for products and update the view with the results
+        """Search for products and update the view with the results.
+
+        A newer search in the same view cancels this one, along with its query.
 
         Args:
             ack (AsyncAck): The ack function.
@@ -186,45 +525,128 @@ class KnativeSlackBolt(AsyncApp):
         action_id = body_dict["actions", 0, "action_id"]
         action_value = body_dict["actions", 0, "value"]
 
+        # The query and the start key of every page visited so far
+        search_state = json.loads(body_dict["view", "private_metadata"] or "{}")
+        pages = search_state.get("pages", [None])
+
         if action_id in ["track-product", "untrack-product"]:
             product_id, variant_id = map(int, action_value.split("/"))
             track = action_id == "track-product"
-            self.data_engine.track_product(product_id, track)
-            logger.info(body_dict["actions", 0, "action_id"] + ": " + str(product_id))
+            await self.data_engine.track_product(product_id, track)
+            self.home_view.apply_change(
+                "shopify_store_products", None, {"id": product_id}
+            )
+            logger.info("%s: %s", action_id, product_id)
         elif action_id == "search-query":
-            logger.info(f"Searching for: {action_value}")
+            logger.info("Searching for: %s", action_value)
+            search_state.pop("query", None)
+            pages = [None]
+        elif action_id == "product-picker":
+            # Search for the title of the picked product
+            product = self.typeahead.get(
+                int(body_dict["actions", 0, "selected_option", "value"])
+            )
+            if product is not None and product.title:
+                search_state["query"] = product.title
+            pages = [None]
+        elif action_id == "search-next-page":
+            pages.append(json.loads(action_value))
+        elif action_id == "search-previous-page":
+            pages = pages[: max(int(action_value), 1)]
+
+        # Empty when a product is picked before anything was searched for
+        search_query = (
+            search_state.get("query")
+            or body_dict[
+                "view", "state", "values", "search-query", "search-query", "value"
+            ]
+            or ""
+        )
 
-        search_query = body_dict[
-            "view", "state", "values", "search-query", "search-query", "value"
-        ]
+        view_id = body_dict["view", "id"]
+        try:
+            await self.search_supersession.run(
+                view_id,
+                self.update_search_view(
+                    body_dict, client, search_query, pages, logger=logger
+                ),
+            )
+        except Superseded:
+            logger.info("Search in view %s superseded by a newer one", view_id)
 
-        results = self.data_engine.search_products(search_query)
-        self.data_engine.set_view_data(body_dict["view", "id"], results)
-        blocks = build_search_results(results)
-
-        await client.views_update(
-            trigger_id=body_dict["trigger_id"],
-            view_id=body_dict["view", "id"],
-            # String that represents view state to protect against race conditions
-            hash=body_dict["view", "hash"],
-            view=View(
-                type="modal",
-                callback_id="view-id",
-                title=PlainTextObject(text="Product Search"),
-                blocks=[
-                    InputBlock(
-                        element=PlainTextInputElement(action_id="search-query"),
-                        label=PlainTextObject(text="Search"),
-                        dispatch_action=True,
-                        others={"hint": "Hint"},
-                        block_id="search-query",
-                        action_id="search-query",
+    @traced
+    async def update_search_view(
+        self,
+        body_dict: PathDict,
+        client: AsyncWebClient,
+        search_query: str,
+        pages: List[Optional[list]],
+        logger: Logger,
+    ):
+        """Run a search and show its results in the modal view it was made in.
+
+        Args:
+            body_dict (PathDict): The body of the request.
+            client (AsyncWebClient): The Slack client.
+            search_query (str): The search query; a blank one finds nothing.
+            pages (List[Optional[list]]): The start key of every page visited so far, the shown page last.
+            logger (Logger): The logger.
+        """
+        results = []
+        if search_query.strip():
+            results = await self.data_engine.search_products(
+                search_query,
+                limit=MAX_SEARCH_RESULTS + 1,
+                after=pages[-1],
+            )
+        next_page = None
+        if len(results) > MAX_SEARCH_RESULTS:
+            results = results[:MAX_SEARCH_RESULTS]
+            next_page = json.dumps([results[-1].rank, results[-1][1].id])
+        await self.data_engine.set_view_data(body_dict["view", "id"], results)
+        blocks = build_search_results(results, page=len(pages), next_page=next_page)
+
+        try:
+            await self.slack_scheduler.call(
+                "views_update",
+                Priority.INTERACTIVE,
+                client=client,
+                trigger_id=body_dict["trigger_id"],
+                view_id=body_dict["view", "id"],
+                # String that represents view state to protect against race conditions
+                hash=body_dict["view", "hash"],
+                # Sent as a dict, so the rendered blocks are not parsed into models again
+                view={
+                    "type": "modal",
+                    "callback_id": "view-id",
+                    "title": {"type": "plain_text", "text": "Product Search"},
+                    "private_metadata": json.dumps(
+                        {"query": search_query, "pages": pages}
                     ),
-                    *blocks,
-                ],
-            ),
-        )
+                    "blocks": [SEARCH_QUERY_BLOCK, PRODUCT_PICKER_BLOCK, *blocks],
+                },
+            )
+        except SlackApiError as exc:
+            if exc.response.get("error") != "hash_conflict":
+                raise
+            # The view changed since the search was made, so its results are stale
+            self.search_supersession.record_wasted()
+            logger.info("Search results for a changed view were dropped")
+
+    @timed(LISTENER_LATENCY)
+    @traced
+    async def suggest_products(self, ack: AsyncAck, payload: dict):
+        """Suggest the products matching what was typed in the product picker so far.
+
+        Args:
+            ack (AsyncAck): The ack function, which sends the options.
+            payload (dict): The block suggestion payload.
+        """
+        products = self.typeahead.suggest(payload.get("value") or "")
+        await ack(options=build_product_options(products))
 
+    @timed(LISTENER_LATENCY)
+    @traced
     async def push_home_view(self, event: dict, client: AsyncWebClient, logger: Logger):
         """Push the updated home view to the user.
 
@@ -235,72 +657,175 @@ class KnativeSlackBolt(AsyncApp):
         """
 
         logger.info("Pushing home view")
-        new_items = self.data_engine.get_new_products()
-        blocks = build_most_recently_released(new_items)
+        blocks = await self.home_view.get_blocks()
         try:
-            await client.views_publish(
+            await self.slack_scheduler.call(
+                "views_publish",
+                Priority.INTERACTIVE,
+                client=client,
                 user_id=event["user"],
-                view=View(
-                    type="home",
-                    blocks=blocks,
-                ),
+                view={"type": "home", "blocks": blocks},
             )
         except Exception as exc:
             raise exc
 
-    async def handle_cloudevent_notifications(self, notification_id: str):
-        try:
-            self.logger.info(f"Received notification ID: {notification_id}")
+    def handle_catalog_change(
+        self,
+        table: str,
+        operation: Optional[str],
+        before: Optional[dict],
+        after: Optional[dict],
+        changed_at: Optional[float] = None,
+    ) -> None:
+        """Keep cached query results in line with a Debezium change event, in every process.
 
-            notification_related_objects = (
-                await self.data_engine.get_notification_related_objects(notification_id)
+        Args:
+            table (str): The changed table.
+            operation (Optional[str]): The Debezium operation, one of "c", "u", "d" or "r".
+            before (Optional[dict]): The row before the change.
+            after (Optional[dict]): The row after the change.
+            changed_at (Optional[float], optional): When the change was made, in milliseconds since the epoch.
+        """
+        self.apply_catalog_change(table, operation, before, after, changed_at)
+        if self.change_broadcast is not None:
+            self.change_broadcast.publish_change(
+                table, operation, before, after, changed_at
             )
-            variant_change, variant, product = notification_related_objects
 
-            featured_image = (
-                variant.featured_image.get("src", False)
-                if variant.featured_image and variant.featured_image.get("src", False)
-                else await self.data_engine.get_featured_image(product.id, variant.id)
+    def apply_catalog_change(
+        self,
+        table: str,
+        operation: Optional[str],
+        before: Optional[dict],
+        after: Optional[dict],
+        changed_at: Optional[float] = None,
+    ) -> None:
+        """Apply a Debezium change event to this process's caches."""
+        if self.data_engine.catalog_replica is not None:
+            self.data_engine.catalog_replica.apply_change(
+                table, operation, before, after, changed_at=changed_at
             )
+        if self.data_engine.search_cache is not None:
+            self.data_engine.search_cache.apply_change(table, operation, before, after)
+        self.home_view.apply_change(table, before, after)
+        self.typeahead.apply_change(table, operation, before, after)
+        if (
+            table == "shopify_store_product_notifications"
+            and after
+            and after.get("delivered")
+        ):
+            self.idempotency.add(200, ("notification", after["id"]))
+
+    async def resync_caches(self) -> None:
+        """Load the caches again, after change events may have been missed."""
+        if self.data_engine.search_cache is not None:
+            self.data_engine.search_cache.clear()
+        self.home_view.invalidate()
+        if self.typeahead.loaded:
+            await self.typeahead.load()
+        replica = self.data_engine.catalog_replica
+        if replica is not None and replica.loaded:
+            await replica.load()
+
+    def share_coalesced_message(
+        self, variant_id: int, message: CoalescedMessage
+    ) -> None:
+        """Tell the other processes of a notification message, so they edit it too."""
+        if self.change_broadcast is not None:
+            self.change_broadcast.publish_message(variant_id, message)
 
-            notable_changes = await self.data_engine.get_notable_changes(variant_change)
-            self.logger.error(
-                f"Change set: {' '.join([f'{k}: {v}' for k, v in notable_changes.items()])}"
-            )
+    @traced
+    async def handle_cloudevent_notifications(
+        self, notification_id: str, event_id: Optional[str] = None
+    ) -> int:
+        """Queue a notification for the next batch and wait for its delivery.
+
+        Redeliveries of a handled event or notification are answered from the idempotency cache.
+
+        Args:
+            notification_id (str): The ID of the notification to deliver.
+            event_id (Optional[str]): The ID of the CloudEvent that carried the notification.
+
+        Returns:
+            int: The status code of the Slack API call.
+        """
+        self.logger.info("Received notification ID: %s", notification_id)
+        keys = [("notification", notification_id)]
+        if event_id is not None:
+            keys.append(("event", event_id))
+        return await self.idempotency.run(
+            keys, lambda: self.notification_batcher.submit(notification_id)
+        )
+
+    @traced
+    async def deliver_notification(
+        self, notification_id: str, enrichment: NotificationEnrichment
+    ) -> int:
+        """Post a resolved notification, or fold it into its variant's recent message.
+
+        Args:
+            notification_id (str): The ID of the notification.
+            enrichment (NotificationEnrichment): The notification's change, variant, product and featured image.
 
-            message_title_components = [product.title]
-            message_title_components.append(
-                variant.title if variant.title != "Default Title" else None
+        Returns:
+            int: The status code of the Slack API call.
+        """
+        if enrichment.delivered:
+            self.logger.info("Notification %s was already delivered", notification_id)
+            return 200
+
+        try:
+            variant = enrichment.variant
+            product = enrichment.product
+            featured_image = enrichment.featured_image
+            notable_changes = enrichment.notable_changes
+            self.logger.debug(
+                "Change set of notification %s: %s",
+                notification_id,
+                LazyJson(notable_changes),
             )
 
-            message_title_updates = []
-            if "available" in notable_changes:
-                availability = "available" if variant.available else "unavailable"
-                message_title_updates.append(f"now {availability}!")
-            if "price" in notable_changes:
-                d_price = (
-                    "drop"
-                    if notable_changes["price"][0] > notable_changes["price"][1]
-                    else "increase"
+            def render(notable_changes: dict) -> dict:
+                with tracer.span("render_notification"):
+                    message_title = build_notification_title(
+                        product, variant, notable_changes
+                    )
+                    return {
+                        "text": message_title,
+                        "blocks": build_notification_block(
+                            product,
+                            variant,
+                            message_title,
+                            featured_image,
+                            notable_changes,
+                        ),
+                    }
+
+            async def post(notable_changes: dict) -> AsyncSlackResponse:
+                # Call the chat.postMessage method using the WebClient
+                return await self.slack_scheduler.call(
+                    "chat_postMessage",
+                    Priority.NOTIFICATION,
+                    channel=self.channel_id,
+                    **render(notable_changes),
+                )
+
+            async def update(
+                message: CoalescedMessage, notable_changes: dict
+            ) -> AsyncSlackResponse:
+                return await self.slack_scheduler.call(
+                    "chat_update",
+                    Priority.NOTIFICATION,
+                    channel=message.channel,
+                    ts=message.ts,
+                    **render(notable_changes),
                 )
-                message_title_updates.append(f"price {d_price}!")
-            message_title_components.append(
-                " with ".join(message_title_updates) if message_title_updates else None
-            )
-            message_title = " ".join(
-                list(filter(None.__ne__, message_title_components))
-            )
 
-            # Call the chat.postMessage method using the WebClient
-            result = await self.client.chat_postMessage(
-                channel=self.channel_id,
-                text=message_title,
-                blocks=build_notification_block(
-                    product, variant, message_title, featured_image, notable_changes
-                ),
+            result = await self.notification_coalescer.send(
+                variant.id, enrichment.change.changed_at, notable_changes, post, update
             )
 
-            await self.data_engine.mark_notification_delivered(
+            await self.delivery_recorder.record(
                 notification_id, result.status_code == 200
             )
 
@@ -0,0 +1,395 @@
+import asyncio
+import base64
+import binascii
+import dataclasses
+import datetime
+import logging
+import time
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from models.shopify_store import (
+    ShopifyStoreImage,
+    ShopifyStoreProduct,
+    ShopifyStoreVariant,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def decode_timestamp(value: Any) -> Optional[datetime.datetime]:
+    """Decode a Debezium timestamp, sent as an ISO 8601 string or microseconds since the epoch."""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.datetime.fromtimestamp(value / 1_000_000, datetime.timezone.utc)
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def decode_money(value: Any) -> Optional[str]:
+    """Decode a Debezium MONEY value into the text Postgres returns, such as "$1,234.50".
+
+    Depending on the connector's `decimal.handling.mode`, the value is a number, a
+    numeric string or the base64 encoded unscaled value with two fraction digits.
+    """
+    if value is None or (isinstance(value, str) and value.lstrip("-").startswith("$")):
+        return value
+    try:
+        amount = Decimal(str(value))
+    except InvalidOperation:
+        try:
+            unscaled = int.from_bytes(base64.b64decode(value), "big", signed=True)
+        except (binascii.Error, ValueError):
+            return value
+        amount = Decimal(unscaled).scaleb(-2)
+    return f"{'-' if amount < 0 else ''}${abs(amount):,.2f}"
+
+
+@dataclass(slots=True)
+class ProductRecord:
+    id: int
+    title: Optional[str] = None
+    handle: Optional[str] = None
+    vendor: Optional[str] = None
+    product_type: Optional[str] = None
+    tags: Optional[List[str]] = None
+    published_at: Optional[datetime.datetime] = None
+    updated_at: Optional[datetime.datetime] = None
+    track: bool = False
+
+
+@dataclass(slots=True)
+class VariantRecord:
+    id: int
+    product_id: Optional[int] = None
+    title: Optional[str] = None
+    sku: Optional[str] = None
+    available: Optional[bool] = None
+    price: Optional[str] = None
+    position: Optional[int] = None
+    updated_at: Optional[datetime.datetime] = None
+
+
+@dataclass(slots=True)
+class ImageRecord:
+    id: int
+    product_id: Optional[int] = None
+    position: Optional[int] = None
+    src: Optional[str] = None
+    variant_ids: Optional[List[int]] = None
+
+
+TABLES = {
+    "shopify_store_products": (ShopifyStoreProduct, ProductRecord),
+    "shopify_store_variants": (ShopifyStoreVariant, VariantRecord),
+    "shopify_store_images": (ShopifyStoreImage, ImageRecord),
+}
+DECODERS = {
+    "published_at": decode_timestamp,
+    "updated_at": decode_timestamp,
+    "price": decode_money,
+}
+
+
+class CatalogReplica:
+    def __init__(
+        self,
+        session: async_sessionmaker,
+        check_interval: float = 300.0,
+    ):
+        """An in-memory copy of the products, variants and images, kept current by Debezium change events.
+
+        Only the columns read by the App Home and product cards are kept.  Search
+        stays on Postgres, whose stemming, stop words and trigram matching the
+        replica does not reproduce.
+
+        Every `check_interval` seconds the replica's row counts are compared with the
+        database's.  A difference seen by two checks in a row is not explained by
+        events in flight, so the replica is loaded again.
+
+        Args:
+            session (async_sessionmaker): The session factory of the `DataEngine`.
+            check_interval (float, optional): Seconds between consistency checks. Defaults to 300.
+        """
+        self.session = session
+        self.check_interval = check_interval
+        self._rows: Dict[str, Dict[int, Any]] = {table: {} for table in TABLES}
+        self._product_variants: Dict[int, Set[int]] = {}
+        self._product_images: Dict[int, Set[int]] = {}
+        # Changes received while the catalog is loaded, applied once it is
+        self._pending: Optional[List[Tuple[Any, ...]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.loaded = False
+        self.loads = 0
+        self.changes = 0
+        self.lag_seconds: Optional[float] = None
+        self.drift = 0
+        self.local_reads = 0
+        self.fallback_reads = 0
+
+    @property
+    def products(self) -> Dict[int, ProductRecord]:
+        return self._rows["shopify_store_products"]
+
+    @property
+    def variants(self) -> Dict[int, VariantRecord]:
+        return self._rows["shopify_store_variants"]
+
+    @property
+    def images(self) -> Dict[int, ImageRecord]:
+        return self._rows["shopify_store_images"]
+
+    def serves_reads(self) -> bool:
+        """Whether reads can be served by the replica, counting those that cannot."""
+        if self.loaded:
+            self.local_reads += 1
+        else:
+            self.fallback_reads += 1
+        return self.loaded
+
+    async def load(self) -> None:
+        """Copy the catalog from the database, replacing what the replica holds.
+
+        The tables are read in one REPEATABLE READ transaction, so they are copied as
+        of the same moment.  Changes received meanwhile are applied after the copy,
+        or to the rows held before if the copy fails.
+        """
+        self._pending = []
+        try:
+            rows = {}
+            async with self.session() as session, session.begin():
+                await session.connection(
+                    execution_options={"isolation_level": "REPEATABLE READ"}
+                )
+                for table, (model, record) in TABLES.items():
+                    columns = [
+                        getattr(model, field.name)
+                        for field in dataclasses.fields(record)
+                    ]
+                    result = await session.execute(select(*columns))
+                    rows[table] = {row.id: record(*row) for row in result}
+        except BaseException:
+            self._apply_pending()
+            raise
+
+        self._rows = rows
+        self._product_variants = {}
+        self._product_images = {}
+        for variant in self.variants.values():
+            self._product_variants.setdefault(variant.product_id, set()).add(variant.id)
+        for image in self.images.values():
+            self._product_images.setdefault(image.product_id, set()).add(image.id)
+        self.loaded = True
+        self.loads += 1
+        logger.info(
+            "Loaded the catalog replica: %d products, %d variants, %d images",
+            len(self.products),
+            len(self.variants),
+            len(self.images),
+        )
+
+        self._apply_pending()
+
+    def _apply_pending(self) -> None:
+        pending, self._pending = self._pending, None
+        for change in pending:
+            self.apply_change(*change)
+
+    def _upsert(self, table: str, row: Dict[str, Any]) -> Any:
+        record_type = TABLES[table][1]
+        values = {
+            field.name: DECODERS.get(field.name, lambda value: value)(row[field.name])
+            for field in dataclasses.fields(record_type)
+            if field.name in row
+        }
+        record = self._rows[table].get(row["id"])
+        if record is None:
+            record = self._rows[table][row["id"]] = record_type(**values)
+        else:
+            for name, value in values.items():
+                setattr(record, name, value)
+        return record
+
+    def apply_change(
+        self,
+        table: str,
+        operation: Optional[str],
+        before: Optional[Dict[str, Any]],
+        after: Optional[Dict[str, Any]],
+        changed_at: Optional[float] = None,
+    ) -> None:
+        """Apply a Debezium change event to the replica.
+
+        Args:
+            table (str): The changed table.
+            operation (Optional[str]): The Debezium operation, one of "c", "u", "d" or "r".
+            before (Optional[Dict[str, Any]]): The row before the change.
+            after (Optional[Dict[str, Any]]): The row after the change.
+            changed_at (Optional[float], optional): When the change was made, in milliseconds since the epoch.
+        """
+        if table not in TABLES:
+            return
+        if self._pending is not None:
+            self._pending.append((table, operation, before, after, changed_at))
+            return
+
+        self.changes += 1
+        if changed_at is not None:
+            self.lag_seconds = max(time.time() - changed_at / 1000, 0.0)
+        if table == "shopify_store_products":
+            self._apply_product(before, after)
+        elif table == "shopify_store_variants":
+            self._apply_variant(before, after)
+        else:
+            self._apply_image(before, after)
+
+    def _apply_product(
+        self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]
+    ) -> None:
+        if after:
+            self._upsert("shopify_store_products", after)
+        elif before:
+            # Its variants and images are deleted along with it
+            for variant_id in self._product_variants.pop(before["id"], ()):
+                self.variants.pop(variant_id, None)
+            for image_id in self._product_images.pop(before["id"], ()):
+                self.images.pop(image_id, None)
+            self.products.pop(before["id"], None)
+
+    def _apply_variant(
+        self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]
+    ) -> None:
+        variant_id = (after or before or {}).get("id")
+        previous = self.variants.get(variant_id)
+        if previous is not None:
+            self._product_variants.get(previous.product_id, set()).discard(variant_id)
+        if after:
+            variant = self._upsert("shopify_store_variants", after)
+            self._product_variants.setdefault(variant.product_id, set()).add(variant.id)
+        else:
+            self.variants.pop(variant_id, None)
+
+    def _apply_image(
+        self, before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]
+    ) -> None:
+        image_id = (after or before or {}).get("id")
+        previous = self.images.get(image_id)
+        if previous is not None:
+            self._product_images.get(previous.product_id, set()).discard(image_id)
+        if after:
+            image = self._upsert("shopify_store_images", after)
+            self._product_images.setdefault(image.product_id, set()).add(image.id)
+        else:
+            self.images.pop(image_id, None)
+
+    def set_track(self, product_id: int, track: bool) -> None:
+        """Apply a tracking change made by this app before its change event arrives."""
+        product = self.products.get(product_id)
+        if product is not None:
+            product.track = track
+
+    def _first_image(self, product_id: int) -> Optional[ImageRecord]:
+        for image_id in self._product_images.get(product_id, ()):
+            image = self.images[image_id]
+            if image.position == 1:
+                return image
+        return None
+
+    def get_new_products(
+        self, vendors: Sequence[str], item_count: int = 15
+    ) -> List[Tuple[ProductRecord, VariantRecord, ImageRecord]]:
+        """Get the most recently published products of the given vendors, like `DataEngine.get_new_products`."""
+        vendors = set(vendors)
+        products = sorted(
+            (
+                product
+                for product in self.products.values()
+                if product.vendor in vendors
+            ),
+            key=lambda product: product.published_at,
+            reverse=True,
+        )
+        rows = []
+        for product in products:
+            image = self._first_image(product.id)
+            if image is None:
+                continue
+            for variant_id in sorted(self._product_variants.get(product.id, ())):
+                rows.append((product, self.variants[variant_id], image))
+                if len(rows) == item_count:
+                    return rows
+        return rows
+
+    def get_featured_image(self, product_id: int, variant_id: int) -> Optional[str]:
+        """Get the featured image for a product, like `DataEngine.get_featured_image`."""
+        images = [
+            self.images[image_id]
+            for image_id in self._product_images.get(product_id, ())
+            if not self.images[image_id].variant_ids
+            or variant_id in self.images[image_id].variant_ids
+        ]
+        if not images:
+            return None
+        # Ordered by position, with images without one last as in Postgres
+        return min(
+            images, key=lambda image: (image.position is None, image.position or 0)
+        ).src
+
+    async def check_consistency(self) -> int:
+        """Count the rows missing from or extra in the replica, by comparing row counts."""
+        drift = 0
+        async with self.session() as session:
+            for table, (model, _) in TABLES.items():
+                count = (
+                    await session.execute(select(func.count()).select_from(model))
+                ).scalar_one()
+                drift += abs(count - len(self._rows[table]))
+        return drift
+
+    def start(self) -> None:
+        """Start checking the replica against the database."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._check_periodically())
+
+    async def _check_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                drift = await self.check_consistency()
+                if drift and self.drift:
+                    logger.warning(
+                        "The catalog replica is %d rows off, loading it again", drift
+                    )
+                    await self.load()
+                    drift = await self.check_consistency()
+                self.drift = drift
+            except Exception:
+                logger.warning("Catalog replica check failed", exc_info=True)
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": int(self.loaded),
+            "loads": self.loads,
+            "products": len(self.products),
+            "variants": len(self.variants),
+            "images": len(self.images),
+            "changes": self.changes,
+            "lag_seconds": self.lag_seconds,
+            "drift_rows": self.drift,
+            "local_reads": self.local_reads,
+            "fallback_reads": self.fallback_reads,
+        }
@@ -0,0 +1,279 @@
+import asyncio
+import contextvars
+import dataclasses
+import datetime
+import json
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+
+from catalog_replica import TABLES
+from data_engine import asyncpg_dsn
+from leader import KEEPALIVE_SETTINGS
+from notifications import CoalescedMessage
+
+logger = logging.getLogger(__name__)
+
+# The Postgres channel every replica and worker listens on
+CHANGES_CHANNEL = "knative_slack_bolt_changes"
+# Postgres refuses NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD_BYTES = 7999
+# The columns read by the caches, the only ones relayed
+BROADCAST_COLUMNS = {
+    table: frozenset(field.name for field in dataclasses.fields(record))
+    for table, (_, record) in TABLES.items()
+}
+BROADCAST_COLUMNS["shopify_store_product_notifications"] = frozenset(
+    {"id", "delivered"}
+)
+RESYNC_PAYLOAD = json.dumps({"resync": True})
+
+ChangeHandler = Callable[
+    [str, Optional[str], Optional[dict], Optional[dict], Optional[float]], None
+]
+
+
+def trim_row(table: str, row: Optional[dict]) -> Optional[dict]:
+    """The columns of a changed row read by the caches."""
+    columns = BROADCAST_COLUMNS.get(table)
+    if not row or columns is None:
+        return row
+    return {column: value for column, value in row.items() if column in columns}
+
+
+def encode_message(variant_id: int, message: CoalescedMessage) -> List[Any]:
+    return [
+        variant_id,
+        message.channel,
+        message.ts,
+        # Seconds left in the window, since monotonic clocks differ between hosts
+        message.expires_at - time.monotonic(),
+        message.first_changed_at.isoformat(),
+        message.notable_changes,
+    ]
+
+
+def decode_message(values: List[Any]) -> Tuple[int, CoalescedMessage]:
+    variant_id, channel, ts, expires_in, first_changed_at, notable_changes = values
+    return variant_id, CoalescedMessage(
+        channel=channel,
+        ts=ts,
+        expires_at=time.monotonic() + expires_in,
+        first_changed_at=datetime.datetime.fromisoformat(first_changed_at),
+        notable_changes={
+            name: tuple(change) for name, change in notable_changes.items()
+        },
+    )
+
+
+class ChangeBroadcast:
+    def __init__(
+        self,
+        postgres_url: str,
+        on_change: ChangeHandler,
+        on_message: Callable[[int, CoalescedMessage], None],
+        on_resync: Callable[[], Awaitable[None]],
+        channel: str = CHANGES_CHANNEL,
+        retry_interval: float = 1.0,
+        check_interval: float = 2.0,
+        max_queue_size: int = 10000,
+    ):
+        """Relays the change events and Slack messages handled by this process to every other one.
+
+        The KafkaSource delivers each change event to one replica, and `SO_REUSEPORT`
+        hands it to one of its workers, but every process caches the catalog and
+        coalesces notifications.  Each process listens on a Postgres channel through a
+        connection of its own, and notifies the channel of every change event it
+        handles, trimmed to the columns the caches read, and of every notification
+        message it posts or edits.  Its own notifications are ignored.
+
+        Notifications sent while a process is not listening are lost to it, so it
+        loads its caches again (`on_resync`) each time it starts listening.  A change
+        that cannot be relayed, because the queue is full or the payload too large,
+        makes every other process load its caches again instead.
+
+        Args:
+            postgres_url (str): The URL to the Postgres database.
+            on_change (ChangeHandler): Applies a change event handled by another process.
+            on_message (Callable[[int, CoalescedMessage], None]): Adopts a message posted or edited by another process.
+            on_resync (Callable[[], Awaitable[None]]): Loads the caches again after changes may have been missed.
+            channel (str, optional): The Postgres channel. Defaults to CHANGES_CHANNEL.
+            retry_interval (float, optional): Seconds between attempts to connect. Defaults to 1.0.
+            check_interval (float, optional): Seconds between checks of an idle connection. Defaults to 2.0.
+            max_queue_size (int, optional): Changes waiting to be sent at most. Defaults to 10000.
+        """
+        self.postgres_url = postgres_url
+        self.on_change = on_change
+        self.on_message = on_message
+        self.on_resync = on_resync
+        self.channel = channel
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        # Taken from the queue, sent again if the connection fails meanwhile
+        self._unsent: Optional[str] = None
+        self._resync_others = False
+        self._resync_wanted = False
+        self._resync_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+        self.listening = False
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.resyncs = 0
+        self.connection_failures = 0
+
+    def publish_change(
+        self,
+        table: str,
+        operation: Optional[str],
+        before: Optional[dict],
+        after: Optional[dict],
+        changed_at: Optional[float] = None,
+    ) -> None:
+        """Relay a Debezium change event applied by this process."""
+        self._publish(
+            {
+                "change": [
+                    table,
+                    operation,
+                    trim_row(table, before),
+                    trim_row(table, after),
+                    changed_at,
+                ]
+            }
+        )
+
+    def publish_message(self, variant_id: int, message: CoalescedMessage) -> None:
+        """Relay a notification message posted or edited by this process."""
+        self._publish({"message": encode_message(variant_id, message)})
+
+    def _publish(self, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, default=str, separators=(",", ":"))
+        if len(data.encode()) > MAX_PAYLOAD_BYTES:
+            logger.warning("A change is too large to relay, resyncing the others")
+            self.dropped += 1
+            self._resync_others = True
+            return
+        try:
+            self._queue.put_nowait(data)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self._resync_others = True
+
+    def _receive(
+        self, conn: asyncpg.Connection, pid: int, channel: str, data: str
+    ) -> None:
+        if pid == conn.get_server_pid():
+            return
+        self.received += 1
+        try:
+            payload = json.loads(data)
+            if "change" in payload:
+                self.on_change(*payload["change"])
+            elif "message" in payload:
+                self.on_message(*decode_message(payload["message"]))
+            elif payload.get("resync"):
+                self._request_resync()
+        except Exception:
+            logger.exception("Failed to apply a relayed change")
+
+    def _request_resync(self) -> None:
+        self._resync_wanted = True
+        if self._resync_task is None or self._resync_task.done():
+            self._resync_task = asyncio.ensure_future(self._resync())
+
+    async def _resync(self) -> None:
+        # Requests made during a resync are served by one more
+        while self._resync_wanted:
+            self._resync_wanted = False
+            self.resyncs += 1
+            try:
+                await self.on_resync()
+            except Exception:
+                logger.warning("Failed to load the caches again", exc_info=True)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+    async def _run(self) -> None:
+        while True:
+            conn: Optional[asyncpg.Connection] = None
+            try:
+                conn = await asyncpg.connect(
+                    asyncpg_dsn(self.postgres_url),
+                    server_settings={
+                        "application_name": "knative-slack-bolt-change-broadcast",
+                        **KEEPALIVE_SETTINGS,
+                    },
+                )
+                await conn.add_listener(self.channel, self._receive)
+                self.listening = True
+                logger.info("Listening for changes handled by other processes")
+                self._request_resync()
+                await self._send(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.connection_failures += 1
+                logger.warning("Change broadcast connection failed", exc_info=True)
+            finally:
+                self.listening = False
+                if conn is not None:
+                    try:
+                        await conn.close(timeout=self.check_interval)
+                    except Exception:
+                        conn.terminate()
+            await asyncio.sleep(self.retry_interval)
+
+    async def _send(self, conn: asyncpg.Connection) -> None:
+        getter: Optional[asyncio.Future] = None
+        try:
+            while True:
+                if self._unsent is None and self._resync_others:
+                    self._resync_others = False
+                    self._unsent = RESYNC_PAYLOAD
+                if self._unsent is None:
+                    if getter is None:
+                        getter = asyncio.ensure_future(self._queue.get())
+                    done, _ = await asyncio.wait({getter}, timeout=self.check_interval)
+                    if not done:
+                        await conn.fetchval("SELECT 1", timeout=self.check_interval)
+                        continue
+                    self._unsent, getter = getter.result(), None
+                await conn.execute(
+                    "SELECT pg_notify($1, $2)", self.channel, self._unsent
+                )
+                self._unsent = None
+                self.published += 1
+        finally:
+            if getter is not None:
+                if getter.done() and not getter.cancelled():
+                    self._unsent = getter.result()
+                getter.cancel()
+
+    async def close(self) -> None:
+        """Stop relaying and listening for changes."""
+        for task in (self._task, self._resync_task):
+            if task is None:
+                continue
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._task = self._resync_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "listening": int(self.listening),
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "queued": self._queue.qsize(),
+            "resyncs": self.resyncs,
+            "connection_failures": self.connection_failures,
+        }
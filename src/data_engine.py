@@ -1,193 +1,525 @@
-from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import time
+from contextlib import AsyncExitStack
+from dataclasses import dataclass
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Tuple, TypeVar
 
-from sqlalchemy import and_, create_engine, desc, or_, select
-from sqlalchemy.orm import aliased, sessionmaker
-from sqlalchemy.sql.expression import text
+from sqlalchemy import and_, any_, bindparam, func, or_, select, true, update
+from sqlalchemy.dialects.postgresql import ARRAY, UUID, array
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import aliased
 
+from catalog_replica import CatalogReplica
+from metrics import QUERY_LATENCY, timed
 from models.shopify_store import (
     ShopifyStoreImage,
     ShopifyStoreProduct,
     ShopifyStoreProductNotification,
+    ShopifyStoreSearchDocument,
     ShopifyStoreVariant,
     ShopifyStoreVariantsChange,
 )
+from search_cache import SearchResultCache
+from tracing import instrument_engine, traced
+from view_state import (
+    DEFAULT_VIEW_STATE_TTL,
+    InMemoryViewStateStore,
+    PostgresViewStateStore,
+    ViewStateStore,
+    compact_search_row,
+)
+
+T = TypeVar("T")
+
+
+@dataclass
+class NotificationEnrichment:
+    change: ShopifyStoreVariantsChange
+    variant: ShopifyStoreVariant
+    product: ShopifyStoreProduct
+    featured_image: Optional[str]
+    # Maps "price" and "available" to their (previous, current) values when they changed
+    notable_changes: Dict[str, Tuple[Any, Any]]
+    delivered: bool = False
+
+
+def async_database_url(db_url: str) -> str:
+    """Rewrite a Postgres URL so that it uses the asyncpg driver."""
+    url = make_url(db_url)
+    if url.drivername in ("postgres", "postgresql", "postgresql+psycopg2"):
+        url = url.set(drivername="postgresql+asyncpg")
+    return url.render_as_string(hide_password=False)
+
+
+def asyncpg_dsn(db_url: str) -> str:
+    """Rewrite a Postgres URL, which may name a SQLAlchemy driver, into a DSN asyncpg accepts."""
+    url = make_url(db_url).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
 
 
 class DataEngine:
-    def __init__(self, db_url: str):
-        self.engine = create_engine(db_url)
-        self.session = sessionmaker(bind=self.engine)
-        self.view_data_storage = {}
+    def __init__(
+        self,
+        db_url: str,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        pool_timeout: float = 10.0,
+        query_timeout: float = 10.0,
+        search_trigram: bool = False,
+        view_state_backend: str = "memory",
+        view_state_ttl: float = DEFAULT_VIEW_STATE_TTL,
+        view_state_max_entries: int = 1000,
+        view_state_max_bytes: int = 16 * 1024 * 1024,
+        search_cache_size: int = 500,
+        catalog_replica: bool = False,
+        catalog_replica_check_interval: float = 300.0,
+    ):
+        """Async data access layer backed by a pooled asyncpg engine.
 
-    def set_view_data(self, view_id: str, data: Dict[str, Any]):
-        self.view_data_storage[view_id] = data
+        Args:
+            db_url (str): The URL to the Postgres database.
+            pool_size (int, optional): Connections kept open in the pool. Defaults to 5.
+            max_overflow (int, optional): Extra connections allowed above `pool_size`. Defaults to 10.
+            pool_timeout (float, optional): Seconds to wait for a free connection. Defaults to 10.0.
+            query_timeout (float, optional): Seconds a single query may run before it is cancelled. Defaults to 10.0.
+            search_trigram (bool, optional): Also match substrings through the pg_trgm index. Defaults to False.
+            view_state_backend (str, optional): Where modal view state is kept, "memory" or "postgres". Defaults to "memory".
+            view_state_ttl (float, optional): Seconds a view's state is kept. Defaults to 3600.
+            view_state_max_entries (int, optional): Views kept by the in-memory backend. Defaults to 1000.
+            view_state_max_bytes (int, optional): Serialized bytes kept by the in-memory backend. Defaults to 16 MiB.
+            search_cache_size (int, optional): Search result pages cached, 0 disables the cache. Defaults to 500.
+            catalog_replica (bool, optional): Serve App Home and featured image reads from an in-memory copy once it is loaded. Defaults to False.
+            catalog_replica_check_interval (float, optional): Seconds between checks of the copy against the database. Defaults to 300.
+        """
+        self.engine = create_async_engine(
+            async_database_url(db_url),
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=pool_timeout,
+            pool_pre_ping=True,
+        )
+        instrument_engine(self.engine.sync_engine)
+        self.session = async_sessionmaker(bind=self.engine, expire_on_commit=False)
+        self.max_overflow = max_overflow
+        self.query_timeout = query_timeout
+        self.search_trigram = search_trigram
+        self.query_timeouts = 0
+        self.pool_timeouts = 0
+        self.search_cache: Optional[SearchResultCache] = (
+            SearchResultCache(search_cache_size) if search_cache_size > 0 else None
+        )
+        self.catalog_replica: Optional[CatalogReplica] = (
+            CatalogReplica(self.session, check_interval=catalog_replica_check_interval)
+            if catalog_replica
+            else None
+        )
+        self.view_state: ViewStateStore = (
+            PostgresViewStateStore(self.session, ttl=view_state_ttl)
+            if view_state_backend == "postgres"
+            else InMemoryViewStateStore(
+                ttl=view_state_ttl,
+                max_entries=view_state_max_entries,
+                max_bytes=view_state_max_bytes,
+            )
+        )
 
-    def get_view_data(self, view_id: str) -> Dict[str, Any]:
-        return self.view_data_storage[view_id]
+    async def close(self) -> None:
+        """Stop checking the catalog replica and dispose of the connection pool."""
+        if self.catalog_replica is not None:
+            await self.catalog_replica.close()
+        await self.engine.dispose()
 
-    def search_products(
-        self, search_term: str
-    ) -> List[Tuple[ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage]]:
-        with self.session() as session:
-            fulltext_search_columns = [
-                "shopify_store_products.title",
-                "shopify_store_products.handle",
-                "shopify_store_products.vendor",
-                "shopify_store_products.product_type",
-                "array_to_string(shopify_store_products.tags, ' ')",
-                "shopify_store_variants.title",
-                "shopify_store_variants.sku",
-            ]
-            fulltext_column_join = " || ' ' || ".join(fulltext_search_columns)
-
-            # Create a join between the tables
-            q = (
-                session.query(
-                    ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage
-                )
-                .select_from(ShopifyStoreProduct)
-                .join(ShopifyStoreVariant)
-                .filter(
-                    text(
-                        f"to_tsvector('english', {fulltext_column_join}) @@ plainto_tsquery('english', :search_term)"
-                    )
+    async def warm_up(self) -> None:
+        """Open every pooled connection now instead of on the first requests."""
+        async with AsyncExitStack() as stack:
+            connections = await asyncio.gather(
+                *(
+                    stack.enter_async_context(self.engine.connect())
+                    for _ in range(self.engine.sync_engine.pool.size())
                 )
             )
-            q = q.params(search_term=search_term)
-            q = q.join(ShopifyStoreImage).where(
-                ShopifyStoreImage.product_id == ShopifyStoreProduct.id,
-                ShopifyStoreImage.position == 1,
+            await asyncio.gather(
+                *(conn.exec_driver_sql("SELECT 1") for conn in connections)
+            )
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Get a snapshot of the connection pool usage."""
+        pool = self.engine.sync_engine.pool
+        capacity = pool.size() + self.max_overflow
+        checked_out = pool.checkedout()
+        return {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": checked_out,
+            "overflow": max(pool.overflow(), 0),
+            "capacity": capacity,
+            "saturation": checked_out / capacity if capacity else 0.0,
+            "query_timeouts": self.query_timeouts,
+            "pool_timeouts": self.pool_timeouts,
+        }
+
+    async def _run(self, awaitable: Awaitable[T]) -> T:
+        """Await a database call, cancelling it once `query_timeout` elapses."""
+        try:
+            return await asyncio.wait_for(awaitable, timeout=self.query_timeout)
+        except asyncio.TimeoutError:
+            self.query_timeouts += 1
+            raise
+        except PoolTimeoutError:
+            self.pool_timeouts += 1
+            raise
+
+    async def _execute(self, session: AsyncSession, stmt, **params):
+        return await self._run(session.execute(stmt, params or None))
+
+    @timed(QUERY_LATENCY)
+    @traced
+    async def set_view_data(self, view_id: str, data: List[Sequence[Any]]) -> None:
+        """Remember the result rows rendered in a view, in their compact form."""
+        await self.view_state.set(view_id, [compact_search_row(row) for row in data])
+
+    @timed(QUERY_LATENCY)
+    @traced
+    async def get_view_data(self, view_id: str) -> Optional[List[Dict[str, Any]]]:
+        return await self.view_state.get(view_id)
+
+    @timed(QUERY_LATENCY)
+    @traced
+    async def search_products(
+        self,
+        search_term: str,
+        limit: int = 18,
+        after: Optional[Tuple[float, int]] = None,
+    ) -> List[
+        Tuple[ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage, float]
+    ]:
+        """Search the stored search documents, best matches first.
+
+        Results are paginated by seeking past the `(rank, variant id)` key of the
+        last row of the previous page, which is the last element of every row.
+
+        Args:
+            search_term (str): The user's search query.
+            limit (int, optional): The maximum number of rows to return. Defaults to 18.
+            after (Optional[Tuple[float, int]], optional): The key of the last row already shown. Defaults to None.
+        """
+        if self.search_cache is not None:
+            cache_key = SearchResultCache.key(search_term, limit, after)
+            cached = self.search_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            generation = self.search_cache.generation
+
+        query = func.plainto_tsquery("english", search_term)
+        rank = func.ts_rank(ShopifyStoreSearchDocument.document, query)
+        match = ShopifyStoreSearchDocument.document.bool_op("@@")(query)
+        if self.search_trigram:
+            # Substring matches on SKUs and partial words, served by the trigram index
+            rank = rank + func.similarity(
+                ShopifyStoreSearchDocument.search_text, search_term.lower()
+            )
+            match = or_(
+                match,
+                ShopifyStoreSearchDocument.search_text.contains(
+                    search_term.lower(), autoescape=True
+                ),
+            )
+
+        if after is not None:
+            after_rank, after_variant_id = after
+            match = and_(
+                match,
+                or_(
+                    rank < after_rank,
+                    and_(rank == after_rank, ShopifyStoreVariant.id > after_variant_id),
+                ),
+            )
+
+        stmt = (
+            select(
+                ShopifyStoreProduct,
+                ShopifyStoreVariant,
+                ShopifyStoreImage,
+                rank.label("rank"),
+            )
+            .select_from(ShopifyStoreSearchDocument)
+            .join(
+                ShopifyStoreVariant,
+                ShopifyStoreVariant.id == ShopifyStoreSearchDocument.variant_id,
+            )
+            .join(
+                ShopifyStoreProduct,
+                ShopifyStoreProduct.id == ShopifyStoreSearchDocument.product_id,
+            )
+            .join(
+                ShopifyStoreImage,
+                and_(
+                    ShopifyStoreImage.product_id == ShopifyStoreProduct.id,
+                    ShopifyStoreImage.position == 1,
+                ),
             )
-            return q.all()
+            .where(match)
+            .order_by(rank.desc(), ShopifyStoreVariant.id)
+            .limit(limit)
+        )
+        started = time.perf_counter()
+        async with self.session() as session:
+            rows = (await self._execute(session, stmt)).all()
 
-    def get_new_products(
-        self, item_count: int = 15
+        if self.search_cache is not None:
+            self.search_cache.set(
+                cache_key, rows, time.perf_counter() - started, generation
+            )
+        return rows
+
+    @timed(QUERY_LATENCY)
+    @traced
+    async def get_new_products(
+        self, vendors: Sequence[str], item_count: int = 15
     ) -> List[Tuple[ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage]]:
-        with self.session() as session, session.begin():
-            q = (
-                session.query(
-                    ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage
-                )
-                .select_from(ShopifyStoreProduct)
-                .join(ShopifyStoreVariant)
-                .join(ShopifyStoreImage)
-                .where(
+        """Get the most recently published products of the given vendors."""
+        if self.catalog_replica is not None and self.catalog_replica.serves_reads():
+            return self.catalog_replica.get_new_products(vendors, item_count=item_count)
+        stmt = (
+            select(ShopifyStoreProduct, ShopifyStoreVariant, ShopifyStoreImage)
+            .select_from(ShopifyStoreProduct)
+            .join(ShopifyStoreVariant)
+            .join(
+                ShopifyStoreImage,
+                and_(
                     ShopifyStoreImage.product_id == ShopifyStoreProduct.id,
                     ShopifyStoreImage.position == 1,
-                )
-                .filter(
-                    ShopifyStoreProduct.vendor.in_(
-                        ["UniFi", "Rove Concepts - New York/New Jersey - CL"]
-                    )
-                )
-                .order_by(ShopifyStoreProduct.published_at.desc())
-                .limit(item_count)
-            )
-        return q.all()
-
-    def track_product(self, product_id: str, track: bool) -> None:
-        with self.session() as session:
-            session.query(ShopifyStoreProduct).filter(
-                ShopifyStoreProduct.id == product_id
-            ).update({"track": track})
-            session.commit()
-
-    async def get_notable_changes(
-        self, variant_change: ShopifyStoreVariantsChange
-    ) -> Dict[str, Any]:
-        """Get the notable changes between the previous and current change."""
-        with self.session() as sess:
-            query = (
-                sess.query(ShopifyStoreVariantsChange)
-                .filter(
-                    and_(
-                        ShopifyStoreVariantsChange.id == variant_change.id,
-                        ShopifyStoreVariantsChange.changed_at
-                        <= variant_change.changed_at,
-                    )
-                )
-                .order_by(desc(ShopifyStoreVariantsChange.changed_at))
-                .limit(2)
-            )
-            changes = query.all()
-            print([c.change_id for c in changes])
-
-            change_set = {}
-            notable_change_types = {"price", "available"}
-            if len(changes) >= 2:
-                # Compare the attribute values between the two records
-                prev_change, curr_change = changes[1], changes[0]
-                # if getattr(prev_change, 'operation')
-                for attr in ShopifyStoreVariantsChange.__table__.columns:
-                    if (
-                        getattr(prev_change, attr.name)
-                        != getattr(curr_change, attr.name)
-                        and attr.name in notable_change_types
-                    ):
-                        change_set.update(
-                            {
-                                attr.name: (
-                                    getattr(prev_change, attr.name),
-                                    getattr(curr_change, attr.name),
-                                )
-                            }
-                        )
-            return change_set
+                ),
+            )
+            .where(ShopifyStoreProduct.vendor.in_(vendors))
+            .order_by(ShopifyStoreProduct.published_at.desc())
+            .limit(item_count)
+        )
+        async with self.session() as session:
+            result = await self._execute(session, stmt)
+            return result.all()
+
+    @timed(QUERY_LATENCY)
+    @traced
+    async def get_typeahead_rows(self) -> Tuple[List[Any], List[Any]]:
+        """Get the ID, title and vendor of every product and the ID, product ID and SKU of every variant."""
+        async with self.session() as session:
+            products = await self._execute(
+                session,
+                select(
+                    ShopifyStoreProduct.id,
+                    ShopifyStoreProduct.title,
+                    ShopifyStoreProduct.vendor,
+                ),
+            )
+            variants = await self._execute(
+                session,
+                select(
+                    ShopifyStoreVariant.id,
+                    ShopifyStoreVariant.product_id,
+                    ShopifyStoreVariant.sku,
+                ),
+            )
+            return products.all(), variants.all()
+
+    @timed(QUERY_LATENCY)
+    @traced
+    async def track_product(self, product_id: int, track: bool) -> None:
+        stmt = (
+            update(ShopifyStoreProduct)
+            .where(ShopifyStoreProduct.id == product_id)
+            .values(track=track)
+        )
+        async with self.session() as session, session.begin():
+            await self._execute(session, stmt)
+        if self.search_cache is not None:
+            self.search_cache.invalidate(product_ids=[product_id])
+        if self.catalog_replica is not None:
+            self.catalog_replica.set_track(product_id, track)
 
+    @timed(QUERY_LATENCY)
+    @traced
     async def get_featured_image(
         self, product_id: int, variant_id: int
     ) -> Optional[str]:
         """Get the featured image for a product."""
-        with self.session() as sess:
-            image: Optional[ShopifyStoreImage] = (
-                sess.query(ShopifyStoreImage)
-                .filter(
-                    or_(
-                        and_(
-                            ShopifyStoreImage.product_id == product_id,
-                            ShopifyStoreImage.variant_ids.contains([variant_id]),
-                        ),
-                        and_(
-                            ShopifyStoreImage.product_id == product_id,
-                            ShopifyStoreImage.variant_ids == "{}",
-                        ),
+        if self.catalog_replica is not None and self.catalog_replica.serves_reads():
+            return self.catalog_replica.get_featured_image(product_id, variant_id)
+        stmt = (
+            select(ShopifyStoreImage)
+            .where(
+                or_(
+                    and_(
+                        ShopifyStoreImage.product_id == product_id,
+                        ShopifyStoreImage.variant_ids.contains([variant_id]),
                     ),
-                )
-                .order_by(
-                    ShopifyStoreImage.position.asc(),
-                )
-                .first()
-            )
-            return image.src if image else None
-
-    async def get_notification_related_objects(
-        self, notification_id: str
-    ) -> Tuple[ShopifyStoreVariantsChange, ShopifyStoreVariant, ShopifyStoreProduct]:
-        with self.session() as sess:
-            variants_change = aliased(ShopifyStoreVariantsChange)
-            variant = aliased(ShopifyStoreVariant)
-            product = aliased(ShopifyStoreProduct)
-
-            stmt = (
-                select(variants_change, variant, product)
-                .select_from(variants_change)
-                .join(product, product.id == variants_change.product_id)
-                .join(variant, variant.id == variants_change.id)
-                .where(
-                    variants_change.change_id
-                    == select(ShopifyStoreProductNotification.change_id)
-                    .where(ShopifyStoreProductNotification.id == notification_id)
-                    .scalar_subquery()
+                    and_(
+                        ShopifyStoreImage.product_id == product_id,
+                        ShopifyStoreImage.variant_ids == [],
+                    ),
+                ),
+            )
+            .order_by(
+                ShopifyStoreImage.position.asc(),
+            )
+            .limit(1)
+        )
+        async with self.session() as sess:
+            image: Optional[ShopifyStoreImage] = (
+                await self._execute(sess, stmt)
+            ).scalar_one_or_none()
+        return image.src if image else None
+
+    @timed(QUERY_LATENCY)
+    @traced
+    async def get_notification_enrichments(
+        self, notification_ids: Sequence[str]
+    ) -> Dict[str, NotificationEnrichment]:
+        """Get everything needed to deliver many notifications in one query.
+
+        For every notification this resolves the change, variant and product, the
+        featured image of the variant, and the price and availability of the
+        previous change of the same variant.
+        """
+        variants_change = aliased(ShopifyStoreVariantsChange)
+        variant = aliased(ShopifyStoreVariant)
+        product = aliased(ShopifyStoreProduct)
+        history_change = aliased(ShopifyStoreVariantsChange)
+
+        # The notification's change and the one before it, compared with lag()
+        recent_changes = (
+            select(
+                history_change.change_id,
+                history_change.price,
+                history_change.available,
+                history_change.changed_at,
+            )
+            .where(
+                history_change.id == variants_change.id,
+                history_change.changed_at <= variants_change.changed_at,
+            )
+            .order_by(history_change.changed_at.desc())
+            .limit(2)
+            .correlate(variants_change)
+            .subquery("recent_changes")
+        )
+        history = (
+            select(
+                recent_changes.c.change_id,
+                func.lag(recent_changes.c.price)
+                .over(order_by=recent_changes.c.changed_at)
+                .label("previous_price"),
+                func.lag(recent_changes.c.available)
+                .over(order_by=recent_changes.c.changed_at)
+                .label("previous_available"),
+                func.count().over().label("history_length"),
+            )
+            .subquery("history")
+            .lateral()
+        )
+        image = (
+            select(ShopifyStoreImage.src)
+            .where(
+                ShopifyStoreImage.product_id == product.id,
+                or_(
+                    ShopifyStoreImage.variant_ids.contains(array([variant.id])),
+                    ShopifyStoreImage.variant_ids == [],
+                ),
+            )
+            .order_by(ShopifyStoreImage.position.asc())
+            .limit(1)
+            .subquery("image")
+            .lateral()
+        )
+
+        stmt = (
+            select(
+                ShopifyStoreProductNotification.id,
+                variants_change,
+                variant,
+                product,
+                func.coalesce(
+                    func.nullif(variant.featured_image["src"].astext, ""), image.c.src
+                ).label("featured_image"),
+                history.c.previous_price,
+                history.c.previous_available,
+                history.c.history_length,
+                ShopifyStoreProductNotification.delivered,
+            )
+            .select_from(ShopifyStoreProductNotification)
+            .join(
+                variants_change,
+                variants_change.change_id == ShopifyStoreProductNotification.change_id,
+            )
+            .join(product, product.id == variants_change.product_id)
+            .join(variant, variant.id == variants_change.id)
+            .outerjoin(image, true())
+            .outerjoin(history, history.c.change_id == variants_change.change_id)
+            .where(
+                ShopifyStoreProductNotification.id
+                == any_(
+                    bindparam(
+                        "notification_ids",
+                        [str(notification_id) for notification_id in notification_ids],
+                        type_=ARRAY(UUID),
+                    )
                 )
             )
+        )
+        async with self.session() as sess:
+            rows = (await self._execute(sess, stmt)).all()
 
-            return sess.execute(stmt).one()
+        enrichments = {}
+        for row in rows:
+            change: ShopifyStoreVariantsChange = row[1]
+            notable_changes = {}
+            if row.history_length and row.history_length >= 2:
+                for name, previous in (
+                    ("price", row.previous_price),
+                    ("available", row.previous_available),
+                ):
+                    if previous != getattr(change, name):
+                        notable_changes[name] = (previous, getattr(change, name))
+            enrichments[str(row[0])] = NotificationEnrichment(
+                change=change,
+                variant=row[2],
+                product=row[3],
+                featured_image=row.featured_image,
+                notable_changes=notable_changes,
+                delivered=row.delivered,
+            )
+        return enrichments
 
-    async def mark_notification_delivered(
-        self, notification_id: str, delivered: bool = True
-    ) -> None:
-        with self.session() as sess:
-            sess.query(ShopifyStoreProductNotification).filter(
-                ShopifyStoreProductNotification.id == notification_id,
-            ).update({"delivered": delivered})
-            sess.commit()
+    @timed(QUERY_LATENCY)
+    @traced
+    async def mark_notifications_delivered(self, outcomes: Dict[str, bool]) -> None:
+        """Record the delivery outcome of many notifications in one transaction.
+
+        Args:
+            outcomes (Dict[str, bool]): Whether each notification, keyed by ID, was delivered.
+        """
+        async with self.session() as sess, sess.begin():
+            for delivered in set(outcomes.values()):
+                notification_ids = [
+                    str(notification_id)
+                    for notification_id, outcome in outcomes.items()
+                    if outcome == delivered
+                ]
+                stmt = (
+                    update(ShopifyStoreProductNotification)
+                    .where(
+                        ShopifyStoreProductNotification.id
+                        == any_(
+                            bindparam(
+                                "notification_ids",
+                                notification_ids,
+                                type_=ARRAY(UUID),
+                            )
+                        )
+                    )
+                    .values(delivered=delivered)
+                    .execution_options(synchronize_session=False)
+                )
+                await self._execute(sess, stmt)
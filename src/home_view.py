@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from blocks_machine import build_most_recently_released
+from data_engine import DataEngine
+
+DEFAULT_HOME_VENDORS = ["UniFi", "Rove Concepts - New York/New Jersey - CL"]
+
+
+class HomeViewCache:
+    def __init__(
+        self,
+        data_engine: DataEngine,
+        vendors: Sequence[str],
+        item_count: int = 15,
+        render_interval: float = 60.0,
+        product_vendor: Optional[Callable[[int], Optional[str]]] = None,
+    ):
+        """The App Home blocks, shared by every user and rebuilt only when the catalog changes.
+
+        Concurrent requests for a stale view wait on a single query.  The cached rows are
+        re-rendered at most every `render_interval` seconds to keep the relative times current.
+
+        Args:
+            data_engine (DataEngine): The data engine used to load the newest products.
+            vendors (Sequence[str]): The vendors whose products are shown.
+            item_count (int, optional): The number of rows shown. Defaults to 15.
+            render_interval (float, optional): Seconds between re-renders of the cached rows. Defaults to 60.
+            product_vendor (Optional[Callable[[int], Optional[str]]], optional): Looks up the vendor of a product, or None if it is not known. Defaults to None.
+        """
+        self.data_engine = data_engine
+        self.vendors = list(vendors)
+        self.item_count = item_count
+        self.render_interval = render_interval
+        self.product_vendor = product_vendor
+        self.key: Tuple[Any, ...] = (tuple(sorted(self.vendors)), item_count)
+
+        self._rows: Optional[List[Any]] = None
+        self._rows_key: Optional[Tuple[Any, ...]] = None
+        self._product_ids: Set[int] = set()
+        self._blocks: List[Dict[str, Any]] = []
+        self._rendered_at = 0.0
+        self._refresh: Optional[asyncio.Future] = None
+        self._generation = 0
+        self.hits = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    async def get_blocks(self) -> List[Dict[str, Any]]:
+        if self._rows is None or self._rows_key != self.key:
+            await self._load_rows()
+        else:
+            self.hits += 1
+
+        if time.monotonic() - self._rendered_at > self.render_interval:
+            self._blocks = build_most_recently_released(self._rows)
+            self._rendered_at = time.monotonic()
+        return self._blocks
+
+    async def _load_rows(self) -> None:
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._query())
+        await asyncio.shield(self._refresh)
+
+    async def _query(self) -> None:
+        generation = self._generation
+        try:
+            rows = await self.data_engine.get_new_products(
+                self.vendors, item_count=self.item_count
+            )
+        finally:
+            self._refresh = None
+        self.refreshes += 1
+
+        self._rows = rows
+        self._product_ids = {row[0].id for row in rows}
+        self._rendered_at = 0.0
+        # Rows loaded while a change arrived are shown, but loaded again next time
+        self._rows_key = self.key if generation == self._generation else None
+
+    def invalidate(self) -> None:
+        self._generation += 1
+        self._rows_key = None
+        self.invalidations += 1
+
+    def apply_change(
+        self,
+        table: str,
+        before: Optional[Dict[str, Any]],
+        after: Optional[Dict[str, Any]],
+    ) -> None:
+        """Invalidate the view if a Debezium change event can alter it.
+
+        A new variant or image can complete a product of one of the vendors that was
+        not shown for lack of it, so a change to the variants or images of a product
+        not shown invalidates the view unless the product's vendor is known to be
+        another one.
+
+        Args:
+            table (str): The changed table.
+            before (Optional[Dict[str, Any]]): The row before the change.
+            after (Optional[Dict[str, Any]]): The row after the change.
+        """
+        rows = [row for row in (before, after) if row]
+        if table == "shopify_store_products":
+            relevant = any(
+                row.get("id") in self._product_ids or row.get("vendor") in self.vendors
+                for row in rows
+            )
+        elif table in ("shopify_store_variants", "shopify_store_images"):
+            relevant = any(
+                row.get("product_id") in self._product_ids for row in rows
+            ) or bool(after and self._may_be_shown(after.get("product_id")))
+        elif table == "shopify_store_product_notifications":
+            relevant = any(row.get("product_id") in self._product_ids for row in rows)
+        else:
+            relevant = False
+
+        if relevant:
+            self.invalidate()
+
+    def _may_be_shown(self, product_id: Optional[int]) -> bool:
+        vendor = self.product_vendor(product_id) if self.product_vendor else None
+        return vendor is None or vendor in self.vendors
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+            "invalidations": self.invalidations,
+        }
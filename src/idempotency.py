@@ -0,0 +1,101 @@
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Sequence
+
+
+class IdempotencyCache:
+    def __init__(self, max_entries: int = 10000):
+        """Remembers the outcome of handled events so redeliveries are answered at once.
+
+        An event is known by several keys, such as its CloudEvent ID and its notification
+        ID, and a hit on any of them answers the event.  Redeliveries that arrive while
+        the first delivery is still running wait for its outcome instead of repeating it.
+        Only successful outcomes are kept, so failed events are retried.
+
+        Args:
+            max_entries (int, optional): The maximum number of keys remembered. Defaults to 10000.
+        """
+        self.max_entries = max_entries
+        self._outcomes: "OrderedDict[Hashable, int]" = OrderedDict()
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+
+    def get(self, *keys: Hashable) -> Optional[int]:
+        """Return the remembered status code of any of the keys."""
+        for key in keys:
+            status = self._outcomes.get(key)
+            if status is not None:
+                self._outcomes.move_to_end(key)
+                self.hits += 1
+                return status
+        return None
+
+    def add(self, status: int, *keys: Hashable) -> None:
+        for key in keys:
+            self._outcomes[key] = status
+            self._outcomes.move_to_end(key)
+        while len(self._outcomes) > self.max_entries:
+            self._outcomes.popitem(last=False)
+
+    async def run(
+        self, keys: Sequence[Hashable], work: Callable[[], Awaitable[int]]
+    ) -> int:
+        """Run `work` unless one of the keys was handled or is being handled already.
+
+        Args:
+            keys (Sequence[Hashable]): The keys the event is known by.
+            work (Callable[[], Awaitable[int]]): Handles the event and returns its status code.
+
+        Returns:
+            int: The status code of the event.
+        """
+        while True:
+            status = self.get(*keys)
+            if status is not None:
+                return status
+            running = next(
+                (self._in_flight[key] for key in keys if key in self._in_flight), None
+            )
+            if running is None:
+                break
+            self.joined += 1
+            try:
+                return await asyncio.shield(running)
+            except asyncio.CancelledError:
+                # Take over the work if the first delivery was cancelled
+                if not running.cancelled():
+                    raise
+
+        self.misses += 1
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        for key in keys:
+            self._in_flight[key] = future
+        try:
+            status = await work()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            # Retrieved here so that an error nobody joined is not reported again
+            future.exception()
+            raise
+        else:
+            future.set_result(status)
+            if 200 <= status < 300:
+                self.add(status, *keys)
+            return status
+        finally:
+            for key in keys:
+                self._in_flight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._outcomes),
+            "in_flight": len(self._in_flight),
+            "hits": self.hits,
+            "joined": self.joined,
+            "misses": self.misses,
+        }
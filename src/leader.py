@@ -0,0 +1,131 @@
+import asyncio
+import contextvars
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import asyncpg
+
+from data_engine import asyncpg_dsn
+
+logger = logging.getLogger(__name__)
+
+# pg_advisory_lock key of the replica holding the Socket Mode connection
+SOCKET_MODE_LOCK_KEY = 0x6B6E5F736F636B  # "kn_sock"
+
+# Postgres notices a vanished leader within idle + interval * count seconds
+KEEPALIVE_SETTINGS = {
+    "tcp_keepalives_idle": "5",
+    "tcp_keepalives_interval": "2",
+    "tcp_keepalives_count": "3",
+}
+
+
+class LeaderElector:
+    def __init__(
+        self,
+        postgres_url: str,
+        on_elected: Callable[[], Awaitable[None]],
+        on_deposed: Callable[[], Awaitable[None]],
+        lock_key: int = SOCKET_MODE_LOCK_KEY,
+        retry_interval: float = 1.0,
+        check_interval: float = 2.0,
+    ):
+        """Elects a single replica through a Postgres advisory lock.
+
+        The lock is held by a connection of its own, so Postgres releases it as soon as
+        the leader's session ends, whether the replica shut down, crashed or lost its
+        network.  Followers try to take the lock every `retry_interval` seconds.  The
+        leader checks its connection every `check_interval` seconds and steps down once
+        the check fails, since another replica may then take over.
+
+        Args:
+            postgres_url (str): The URL to the Postgres database.
+            on_elected (Callable[[], Awaitable[None]]): Called once this replica becomes the leader; if it raises, the lock is given up.
+            on_deposed (Callable[[], Awaitable[None]]): Called once this replica stops being the leader.
+            lock_key (int, optional): The advisory lock key. Defaults to SOCKET_MODE_LOCK_KEY.
+            retry_interval (float, optional): Seconds between attempts to take the lock. Defaults to 1.0.
+            check_interval (float, optional): Seconds between checks of the leader's connection. Defaults to 2.0.
+        """
+        self.postgres_url = postgres_url
+        self.on_elected = on_elected
+        self.on_deposed = on_deposed
+        self.lock_key = lock_key
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+        self.elections = 0
+        self.connection_failures = 0
+
+    @property
+    def role(self) -> str:
+        return "leader" if self.is_leader else "follower"
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+    async def _run(self) -> None:
+        while True:
+            conn: Optional[asyncpg.Connection] = None
+            try:
+                conn = await asyncpg.connect(
+                    asyncpg_dsn(self.postgres_url),
+                    server_settings={
+                        "application_name": "knative-slack-bolt-leader-election",
+                        **KEEPALIVE_SETTINGS,
+                    },
+                )
+                while not await conn.fetchval(
+                    "SELECT pg_try_advisory_lock($1)", self.lock_key
+                ):
+                    await asyncio.sleep(self.retry_interval)
+
+                logger.info("Elected leader")
+                self.is_leader = True
+                self.elections += 1
+                await self.on_elected()
+                while True:
+                    await asyncio.sleep(self.check_interval)
+                    await conn.fetchval("SELECT 1", timeout=self.check_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.connection_failures += 1
+                logger.warning("Leader election failed as %s", self.role, exc_info=True)
+            finally:
+                await self._step_down(conn)
+            await asyncio.sleep(self.retry_interval)
+
+    async def _step_down(self, conn: Optional[asyncpg.Connection]) -> None:
+        if self.is_leader:
+            self.is_leader = False
+            logger.info("Stepping down as leader")
+            try:
+                await self.on_deposed()
+            except Exception:
+                logger.exception("Failed to step down as leader")
+        if conn is not None:
+            # Ending the session releases the lock
+            try:
+                await conn.close(timeout=self.check_interval)
+            except Exception:
+                conn.terminate()
+
+    async def close(self) -> None:
+        """Step down and stop taking part in the election."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "leader": int(self.is_leader),
+            "elections": self.elections,
+            "connection_failures": self.connection_failures,
+        }
@@ -0,0 +1,207 @@
+import asyncio
+import functools
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+
+from aiohttp import web
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily, Metric
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+# Set when several worker processes share the port; prometheus_client reads it on import
+MULTIPROCESS_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+LISTENER_LATENCY = Histogram(
+    "slack_listener_duration_seconds",
+    "Time spent in a Bolt listener.",
+    ["listener"],
+)
+CLOUDEVENT_LATENCY = Histogram(
+    "cloudevent_handler_duration_seconds",
+    "Time spent handling a CloudEvent, by response status.",
+    ["status"],
+)
+QUERY_LATENCY = Histogram(
+    "data_engine_query_duration_seconds",
+    "Time spent in a DataEngine method.",
+    ["method"],
+)
+SLACK_API_LATENCY = Histogram(
+    "slack_api_request_duration_seconds",
+    "Time spent in a Slack Web API call, by method and HTTP status.",
+    ["method", "status"],
+)
+SOCKET_MODE_RECONNECTS = Counter(
+    "slack_socket_mode_reconnects_total",
+    "Socket Mode connections opened after the first one.",
+)
+EVENT_LOOP_LAG = Histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a timer.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+def timed(histogram: Histogram) -> Callable[[F], F]:
+    """Observe the duration of an async function, labelled with the function's name."""
+
+    def decorator(func: F) -> F:
+        observer = histogram.labels(func.__name__)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                observer.observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_handler(histogram: Histogram) -> Callable[[F], F]:
+    """Observe the duration of an aiohttp handler, labelled with the response status."""
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        async def wrapper(req: web.Request) -> web.StreamResponse:
+            started = time.perf_counter()
+            status = 500
+            try:
+                response = await func(req)
+                status = response.status
+                return response
+            except web.HTTPException as exc:
+                status = exc.status
+                raise
+            finally:
+                histogram.labels(status).observe(time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """Record how much later than requested a sleep wakes up, until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - started - interval, 0.0))
+
+
+class ComponentStatsCollector:
+    def __init__(self, multiprocess_dir: Optional[str] = None):
+        """Exports the numbers in the components' `stats()` as gauges.
+
+        With several worker processes every worker writes its numbers to a snapshot
+        file in `multiprocess_dir`, and the gauges of all workers are exported,
+        labelled with the worker's index.
+
+        Args:
+            multiprocess_dir (Optional[str], optional): The directory shared by the worker processes. Defaults to None.
+        """
+        self.sources: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self.multiprocess_dir = Path(multiprocess_dir) if multiprocess_dir else None
+        self.worker = "0"
+
+    def add(self, component: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        self.sources[component] = stats
+
+    def describe(self) -> Iterator[Metric]:
+        return iter(())
+
+    def values(self) -> Dict[str, Tuple[str, float]]:
+        """The documentation and the value of every gauge, by name."""
+        values = {}
+        for component, stats in list(self.sources.items()):
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                values[f"knative_slack_bolt_{component}_{key}"] = (
+                    f"The {key} reported by the {component}.",
+                    value,
+                )
+        return values
+
+    def write_snapshot(self) -> None:
+        """Write this worker's gauges where the other workers can read them."""
+        path = self.multiprocess_dir / f"component_stats_{self.worker}.json"
+        partial = path.with_suffix(f".{os.getpid()}.tmp")
+        partial.write_text(json.dumps(self.values()))
+        os.replace(partial, path)
+
+    def collect(self) -> Iterator[Metric]:
+        if self.multiprocess_dir is None:
+            for name, (documentation, value) in self.values().items():
+                yield GaugeMetricFamily(name, documentation, value=value)
+            return
+
+        # This worker's numbers are read live, the others' from their last snapshot
+        workers = {
+            path.stem.rpartition("_")[2]: path
+            for path in self.multiprocess_dir.glob("component_stats_*.json")
+        }
+        families: Dict[str, GaugeMetricFamily] = {}
+        for worker in sorted(workers.keys() | {self.worker}):
+            if worker == self.worker:
+                values = self.values()
+            else:
+                try:
+                    values = json.loads(workers[worker].read_text())
+                except (OSError, ValueError):
+                    continue
+            for name, (documentation, value) in values.items():
+                if name not in families:
+                    families[name] = GaugeMetricFamily(
+                        name, documentation, labels=["worker"]
+                    )
+                families[name].add_metric([worker], value)
+        yield from families.values()
+
+
+COMPONENT_STATS = ComponentStatsCollector(MULTIPROCESS_DIR)
+REGISTRY.register(COMPONENT_STATS)
+
+
+def configure_metrics(worker: int = 0) -> None:
+    """Name the worker process whose metrics this process records."""
+    COMPONENT_STATS.worker = str(worker)
+
+
+async def export_component_stats(interval: float = 5.0) -> None:
+    """Write a snapshot of the gauges every `interval` seconds, until cancelled."""
+    while True:
+        COMPONENT_STATS.write_snapshot()
+        await asyncio.sleep(interval)
+
+
+def clear_multiprocess_dir() -> None:
+    """Remove the metrics left behind by the worker processes of a previous run."""
+    for path in Path(MULTIPROCESS_DIR).iterdir():
+        if path.suffix in (".db", ".json"):
+            path.unlink()
+
+
+def generate_metrics() -> bytes:
+    """Render the metrics of every worker process in the Prometheus text format."""
+    if MULTIPROCESS_DIR is None:
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROCESS_DIR)
+    registry.register(COMPONENT_STATS)
+    return generate_latest(registry)
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+from pathlib import Path
+from typing import Collection, List
+
+import asyncpg
+
+from data_engine import asyncpg_dsn
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("migrate")
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# Migrations only needed by an optional feature, by the feature that needs them.
+# The trigram index needs the pg_trgm extension, which not every role may create.
+OPTIONAL_MIGRATIONS = {"0002_search_trigram": "search_trigram"}
+
+
+def pending_migrations(
+    applied: Collection[str], features: Collection[str] = ()
+) -> List[Path]:
+    """List the migration scripts that have not been applied yet, in order.
+
+    Args:
+        applied (Collection[str]): The names of the applied migrations.
+        features (Collection[str], optional): The enabled optional features, such as "search_trigram". Defaults to ().
+    """
+    return [
+        path
+        for path in sorted(MIGRATIONS_DIR.glob("*.sql"))
+        if path.stem not in applied
+        and (
+            path.stem not in OPTIONAL_MIGRATIONS
+            or OPTIONAL_MIGRATIONS[path.stem] in features
+        )
+    ]
+
+
+async def migrate(postgres_url: str, features: Collection[str] = ()) -> None:
+    """Apply every pending migration, each one in its own transaction.
+
+    The migrations of optional features that are not enabled are left pending, so
+    they are applied by a later run that enables the feature.
+
+    Args:
+        postgres_url (str): The URL to the Postgres database.
+        features (Collection[str], optional): The enabled optional features, such as "search_trigram". Defaults to ().
+    """
+    conn: asyncpg.Connection = await asyncpg.connect(asyncpg_dsn(postgres_url))
+    try:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+            """
+        )
+        applied = [
+            row["version"]
+            for row in await conn.fetch("SELECT version FROM schema_migrations")
+        ]
+        for path in pending_migrations(applied, features):
+            logger.info("Applying migration %s", path.stem)
+            async with conn.transaction():
+                await conn.execute(path.read_text())
+                await conn.execute(
+                    "INSERT INTO schema_migrations (version) VALUES ($1)", path.stem
+                )
+    finally:
+        await conn.close()
+
+
+def main():
+    features = []
+    if os.environ.get("SEARCH_TRIGRAM", "false").lower() == "true":
+        features.append("search_trigram")
+    asyncio.run(migrate(os.environ["POSTGRES_URL"], features))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+-- Stored full-text search document for every product variant.
+CREATE TABLE IF NOT EXISTS shopify_store_search_documents (
+    variant_id BIGINT PRIMARY KEY REFERENCES shopify_store_variants (id) ON DELETE CASCADE,
+    product_id BIGINT NOT NULL REFERENCES shopify_store_products (id) ON DELETE CASCADE,
+    search_text TEXT NOT NULL,
+    document TSVECTOR NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS shopify_store_search_documents_document_idx
+    ON shopify_store_search_documents USING GIN (document);
+
+CREATE INDEX IF NOT EXISTS shopify_store_search_documents_product_id_idx
+    ON shopify_store_search_documents (product_id);
+
+CREATE OR REPLACE FUNCTION refresh_shopify_store_search_documents(product_ids BIGINT[])
+RETURNS VOID
+LANGUAGE SQL
+AS $$
+    INSERT INTO shopify_store_search_documents (variant_id, product_id, search_text, document)
+    SELECT
+        v.id,
+        p.id,
+        lower(concat_ws(' ', p.title, p.vendor, v.title, v.sku)),
+        setweight(to_tsvector('english', concat_ws(' ', p.title, v.sku)), 'A')
+            || setweight(to_tsvector('english', concat_ws(' ', p.vendor, p.product_type, v.title)), 'B')
+            || setweight(to_tsvector('english', concat_ws(' ', p.handle, array_to_string(p.tags, ' '))), 'C')
+    FROM shopify_store_variants v
+    JOIN shopify_store_products p ON p.id = v.product_id
+    WHERE p.id = ANY(product_ids)
+    ON CONFLICT (variant_id) DO UPDATE SET
+        product_id = EXCLUDED.product_id,
+        search_text = EXCLUDED.search_text,
+        document = EXCLUDED.document;
+$$;
+
+CREATE OR REPLACE FUNCTION shopify_store_search_documents_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'shopify_store_products' THEN
+        PERFORM refresh_shopify_store_search_documents(ARRAY[NEW.id]);
+    ELSE
+        PERFORM refresh_shopify_store_search_documents(ARRAY[NEW.product_id]);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS shopify_store_products_search_documents_insert ON shopify_store_products;
+CREATE TRIGGER shopify_store_products_search_documents_insert
+    AFTER INSERT ON shopify_store_products
+    FOR EACH ROW
+    EXECUTE FUNCTION shopify_store_search_documents_trigger();
+
+DROP TRIGGER IF EXISTS shopify_store_products_search_documents_update ON shopify_store_products;
+CREATE TRIGGER shopify_store_products_search_documents_update
+    AFTER UPDATE OF title, handle, vendor, product_type, tags ON shopify_store_products
+    FOR EACH ROW
+    WHEN ((OLD.title, OLD.handle, OLD.vendor, OLD.product_type, OLD.tags)
+        IS DISTINCT FROM (NEW.title, NEW.handle, NEW.vendor, NEW.product_type, NEW.tags))
+    EXECUTE FUNCTION shopify_store_search_documents_trigger();
+
+DROP TRIGGER IF EXISTS shopify_store_variants_search_documents_insert ON shopify_store_variants;
+CREATE TRIGGER shopify_store_variants_search_documents_insert
+    AFTER INSERT ON shopify_store_variants
+    FOR EACH ROW
+    EXECUTE FUNCTION shopify_store_search_documents_trigger();
+
+DROP TRIGGER IF EXISTS shopify_store_variants_search_documents_update ON shopify_store_variants;
+CREATE TRIGGER shopify_store_variants_search_documents_update
+    AFTER UPDATE OF title, sku, product_id ON shopify_store_variants
+    FOR EACH ROW
+    WHEN ((OLD.title, OLD.sku, OLD.product_id) IS DISTINCT FROM (NEW.title, NEW.sku, NEW.product_id))
+    EXECUTE FUNCTION shopify_store_search_documents_trigger();
+
+-- Backfill the documents for the existing catalog.
+SELECT refresh_shopify_store_search_documents(array_agg(id)) FROM shopify_store_products;
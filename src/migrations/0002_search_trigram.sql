@@ -0,0 +1,5 @@
+-- Trigram index used for partial word and SKU matching (SEARCH_TRIGRAM=true).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS shopify_store_search_documents_search_text_trgm_idx
+    ON shopify_store_search_documents USING GIN (search_text gin_trgm_ops);
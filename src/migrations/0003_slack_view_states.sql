@@ -0,0 +1,10 @@
+-- Shared modal view state (VIEW_STATE_BACKEND=postgres).  Losing it on a crash
+-- only costs a re-search, so the table skips the WAL.
+CREATE UNLOGGED TABLE IF NOT EXISTS slack_view_states (
+    view_id TEXT PRIMARY KEY,
+    data BYTEA NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS slack_view_states_expires_at_idx
+    ON slack_view_states (expires_at);
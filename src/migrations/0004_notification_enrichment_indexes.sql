@@ -0,0 +1,8 @@
+-- Serves the per-variant change history read when a notification is enriched.
+CREATE INDEX IF NOT EXISTS shopify_store_variants_changes_id_changed_at_idx
+    ON shopify_store_variants_changes (id, changed_at DESC)
+    INCLUDE (price, available);
+
+-- Serves the featured image lookup of a product.
+CREATE INDEX IF NOT EXISTS shopify_store_images_product_id_position_idx
+    ON shopify_store_images (product_id, position);
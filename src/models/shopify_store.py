@@ -8,7 +8,7 @@ from sqlalchemy import (
     Text,
     text,
 )
-from sqlalchemy.dialects.postgresql import ARRAY, JSONB, MONEY, UUID
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, MONEY, TSVECTOR, UUID
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -83,6 +83,22 @@ class ShopifyStoreVariant(ShopifyStoreBase):
     product = relationship("ShopifyStoreProduct")
 
 
+class ShopifyStoreSearchDocument(UtilsBase):
+    __tablename__ = "shopify_store_search_documents"
+
+    variant_id = Column(
+        ForeignKey("shopify_store_variants.id", ondelete="CASCADE"), primary_key=True
+    )
+    product_id = Column(
+        ForeignKey("shopify_store_products.id", ondelete="CASCADE"), nullable=False
+    )
+    search_text = Column(Text, nullable=False)
+    document = Column(TSVECTOR, nullable=False)
+
+    product = relationship("ShopifyStoreProduct")
+    variant = relationship("ShopifyStoreVariant")
+
+
 class ShopifyStoreVariantsChange(ShopifyStoreBase):
     __tablename__ = "shopify_store_variants_changes"
     __table_args__ = {"schema": "public"}
@@ -0,0 +1,11 @@
+from sqlalchemy import Column, DateTime, LargeBinary, Text
+
+from models.shopify_store import UtilsBase
+
+
+class SlackViewState(UtilsBase):
+    __tablename__ = "slack_view_states"
+
+    view_id = Column(Text, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+    expires_at = Column(DateTime(True), nullable=False)
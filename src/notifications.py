@@ -0,0 +1,496 @@
+import asyncio
+import contextvars
+import datetime
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+logger = logging.getLogger(__name__)
+
+Resolver = Callable[[Sequence[str]], Awaitable[Dict[str, Any]]]
+Deliverer = Callable[[str, Any], Awaitable[int]]
+NotableChanges = Dict[str, Tuple[Any, Any]]
+
+
+def merge_notable_changes(
+    earlier: NotableChanges, later: NotableChanges
+) -> NotableChanges:
+    """Combine two consecutive change sets into one from the first to the last state.
+
+    Values that end where they started, such as a variant going out of stock and back,
+    are left out.
+    """
+    merged = {}
+    for name in {**earlier, **later}:
+        start = (earlier.get(name) or later[name])[0]
+        end = (later.get(name) or earlier[name])[1]
+        if start != end:
+            merged[name] = (start, end)
+    return merged
+
+
+class NotificationBatcher:
+    def __init__(
+        self,
+        resolve: Resolver,
+        deliver: Deliverer,
+        max_batch_size: int = 50,
+        max_wait: float = 0.05,
+        max_concurrency: int = 5,
+    ):
+        """Gathers notification IDs for a short window and processes them together.
+
+        Every batch is resolved with one call to `resolve`, then each notification is
+        handed to `deliver` with at most `max_concurrency` deliveries in flight.
+        `submit` returns the status of the caller's own notification.
+
+        Args:
+            resolve (Resolver): Loads the data of many notifications, keyed by notification ID.
+            deliver (Deliverer): Delivers one resolved notification and returns its status code.
+            max_batch_size (int, optional): A batch is processed once it holds this many IDs. Defaults to 50.
+            max_wait (float, optional): Seconds the first ID of a batch waits for more. Defaults to 0.05.
+            max_concurrency (int, optional): Deliveries running at the same time. Defaults to 5.
+        """
+        self.resolve = resolve
+        self.deliver = deliver
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._delivery_slots = asyncio.Semaphore(max_concurrency)
+        self._pending: List[Tuple[str, asyncio.Future, contextvars.Context]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.batched_notifications = 0
+
+    async def submit(self, notification_id: str) -> int:
+        future = asyncio.get_running_loop().create_future()
+        # Each delivery runs in the context of its caller, e.g. its trace
+        self._pending.append((notification_id, future, contextvars.copy_context()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(
+                self.max_wait, self._flush
+            )
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch, self._pending = self._pending, []
+        task = asyncio.ensure_future(self._process(batch))
+        self._batches.add(task)
+        task.add_done_callback(self._batches.discard)
+
+    async def _process(
+        self, batch: List[Tuple[str, asyncio.Future, contextvars.Context]]
+    ) -> None:
+        self.batches += 1
+        self.batched_notifications += len(batch)
+        try:
+            resolved = await self.resolve(list({key for key, _, _ in batch}))
+        except Exception as exc:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        async def deliver_one(
+            notification_id: str, future: asyncio.Future, context: contextvars.Context
+        ):
+            try:
+                if notification_id not in resolved:
+                    raise LookupError(f"Notification {notification_id} was not found")
+                async with self._delivery_slots:
+                    status = await context.run(
+                        asyncio.ensure_future,
+                        self.deliver(notification_id, resolved[notification_id]),
+                    )
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+            else:
+                if not future.done():
+                    future.set_result(status)
+
+        await asyncio.gather(*(deliver_one(*pending) for pending in batch))
+
+    async def close(self) -> None:
+        """Process the pending IDs and wait for every batch in flight."""
+        self._flush()
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "batched_notifications": self.batched_notifications,
+        }
+
+
+class DeliveryRecorder:
+    def __init__(
+        self,
+        write: Callable[[Dict[str, bool]], Awaitable[None]],
+        max_batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_queue_size: int = 10000,
+    ):
+        """Write-behind buffer for notification delivery outcomes.
+
+        Outcomes are written in batches by a background task.  The queue is bounded,
+        so `record` waits for room instead of growing without limit when the
+        database falls behind.
+
+        Args:
+            write (Callable[[Dict[str, bool]], Awaitable[None]]): Persists outcomes keyed by notification ID.
+            max_batch_size (int, optional): Outcomes written together at most. Defaults to 100.
+            flush_interval (float, optional): Seconds the first queued outcome waits for more. Defaults to 1.0.
+            max_queue_size (int, optional): Outcomes buffered at most. Defaults to 10000.
+        """
+        self.write = write
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self._queue: "asyncio.Queue[Tuple[str, bool]]" = asyncio.Queue(max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._wakeup = asyncio.Event()
+        self.written = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            # Run apart from the context of whichever caller starts it
+            self._task = contextvars.Context().run(asyncio.ensure_future, self._run())
+
+    async def record(self, notification_id: str, delivered: bool) -> None:
+        self.start()
+        await self._queue.put((notification_id, delivered))
+        if self._queue.qsize() >= self.max_batch_size:
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            if self._queue.qsize() < self.max_batch_size - 1 and not self._closing:
+                # Give more outcomes a chance to join the batch
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._write(batch)
+
+    async def _write(self, batch: List[Tuple[str, bool]]) -> None:
+        try:
+            await self.write(dict(batch))
+            self.written += len(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to record %d notification deliveries", len(batch))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        """Write every outcome still queued and stop the background task."""
+        self.start()
+        self._closing = True
+        self._wakeup.set()
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+
+@dataclass
+class CoalescedMessage:
+    channel: str
+    ts: str
+    expires_at: float
+    first_changed_at: datetime.datetime
+    notable_changes: NotableChanges
+
+
+class NotificationCoalescer:
+    def __init__(
+        self,
+        window: float = 300.0,
+        max_messages: int = 10000,
+        on_message: Optional[Callable[[int, CoalescedMessage], None]] = None,
+    ):
+        """Folds the changes of a variant made within `window` seconds into one Slack message.
+
+        The first change is posted right away.  Later changes inside the window edit
+        that message in place, showing every value from its first to its last state.
+
+        Messages are remembered per process.  `on_message` is told of every message
+        posted or edited, so that other processes can `remember` it and edit it too.
+
+        Args:
+            window (float, optional): Seconds after the first post that changes are merged into it. Defaults to 300.
+            max_messages (int, optional): Posted messages remembered at most. Defaults to 10000.
+            on_message (Optional[Callable[[int, CoalescedMessage], None]], optional): Called with the variant ID and message after each post or edit. Defaults to None.
+        """
+        self.window = window
+        self.max_messages = max_messages
+        self.on_message = on_message
+        self._messages: "OrderedDict[int, CoalescedMessage]" = OrderedDict()
+        self._locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        self.posted = 0
+        self.coalesced = 0
+
+    @asynccontextmanager
+    async def _variant_lock(self, variant_id: int) -> AsyncIterator[None]:
+        lock, users = self._locks.get(variant_id, (asyncio.Lock(), 0))
+        self._locks[variant_id] = (lock, users + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, users = self._locks[variant_id]
+            if users == 1:
+                del self._locks[variant_id]
+            else:
+                self._locks[variant_id] = (lock, users - 1)
+
+    def _expire(self) -> None:
+        now = time.monotonic()
+        while self._messages and (
+            len(self._messages) > self.max_messages
+            or next(iter(self._messages.values())).expires_at < now
+        ):
+            self._messages.popitem(last=False)
+
+    async def send(
+        self,
+        variant_id: int,
+        changed_at: datetime.datetime,
+        notable_changes: NotableChanges,
+        post: Callable[[NotableChanges], Awaitable[Any]],
+        update: Callable[[CoalescedMessage, NotableChanges], Awaitable[Any]],
+    ) -> Any:
+        """Post a variant's changes, or merge them into its message from the last `window` seconds.
+
+        Args:
+            variant_id (int): The ID of the changed variant.
+            changed_at (datetime.datetime): When the change was made.
+            notable_changes (NotableChanges): The (previous, current) values that changed.
+            post (Callable[[NotableChanges], Awaitable[Any]]): Posts a new message and returns the Slack response.
+            update (Callable[[CoalescedMessage, NotableChanges], Awaitable[Any]]): Edits a posted message.
+
+        Returns:
+            Any: The Slack response of the post or the update.
+        """
+        async with self._variant_lock(variant_id):
+            self._expire()
+            message = self._messages.get(variant_id)
+            if message is None:
+                response = await post(notable_changes)
+                self.posted += 1
+                if self.window > 0:
+                    message = self._messages[variant_id] = CoalescedMessage(
+                        channel=response["channel"],
+                        ts=response["ts"],
+                        expires_at=time.monotonic() + self.window,
+                        first_changed_at=changed_at,
+                        notable_changes=notable_changes,
+                    )
+                    self._expire()
+                    self._share(variant_id, message)
+                return response
+
+            # Redeliveries can bring an older change after a newer one
+            if changed_at < message.first_changed_at:
+                merged = merge_notable_changes(notable_changes, message.notable_changes)
+                message.first_changed_at = changed_at
+            else:
+                merged = merge_notable_changes(message.notable_changes, notable_changes)
+            try:
+                response = await update(message, merged)
+            except Exception:
+                # The message may be gone; the next change starts a new one
+                del self._messages[variant_id]
+                raise
+            message.notable_changes = merged
+            self.coalesced += 1
+            self._share(variant_id, message)
+            return response
+
+    def _share(self, variant_id: int, message: CoalescedMessage) -> None:
+        if self.on_message is not None:
+            try:
+                self.on_message(variant_id, message)
+            except Exception:
+                logger.warning("Failed to share a coalesced message", exc_info=True)
+
+    def remember(self, variant_id: int, message: CoalescedMessage) -> None:
+        """Adopt a message posted or edited by another process, so later changes edit it."""
+        if self.window <= 0 or message.expires_at < time.monotonic():
+            return
+        self._messages[variant_id] = message
+        self._messages.move_to_end(variant_id)
+        self._expire()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "messages": len(self._messages),
+            "posted": self.posted,
+            "coalesced": self.coalesced,
+        }
+
+
+class EventWorkerPool:
+    def __init__(
+        self,
+        max_queue_size: int = 1000,
+        workers: int = 50,
+        max_attempts: int = 3,
+        retry_delay: float = 1.0,
+    ):
+        """A bounded queue of accepted events, handled in the background by a pool of workers.
+
+        `submit` never waits: it refuses the event when the queue is full or the pool is
+        closing, so that the sender can back off and retry later.
+
+        The sender is not told when an accepted event fails, so it will not send it again.
+        A job that raises or returns a status code outside 2xx is tried again, up to
+        `max_attempts` times with the delay doubling after each attempt, and is then
+        given up on and counted as failed.
+
+        Args:
+            max_queue_size (int, optional): Events waiting to be handled at most. Defaults to 1000.
+            workers (int, optional): Events handled at the same time. Defaults to 50.
+            max_attempts (int, optional): Attempts at a job before it is given up on. Defaults to 3.
+            retry_delay (float, optional): Seconds before the second attempt at a job. Defaults to 1.0.
+        """
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._queue: "asyncio.Queue[Tuple[Callable[[], Awaitable[Any]], contextvars.Context]]" = asyncio.Queue(
+            max_queue_size
+        )
+        self._tasks: List[asyncio.Task] = []
+        self.accepting = True
+        self.accepted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        # Moving average of the seconds an event takes, used to suggest a retry delay
+        self.average_seconds = 0.0
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [
+                asyncio.ensure_future(self._work()) for _ in range(self.workers)
+            ]
+
+    def submit(self, job: Callable[[], Awaitable[Any]]) -> bool:
+        """Queue a job, or return False if there is no room for it."""
+        if not self.accepting or self._queue.full():
+            self.rejected += 1
+            return False
+
+        self.start()
+        self._queue.put_nowait((job, contextvars.copy_context()))
+        self.accepted += 1
+        return True
+
+    def retry_after(self) -> int:
+        """Estimate the seconds until the queue has room again, between 1 and 60."""
+        backlog = self._queue.qsize() * self.average_seconds / self.workers
+        return min(max(int(backlog) + 1, 1), 60)
+
+    async def _attempt(
+        self, job: Callable[[], Awaitable[Any]], context: contextvars.Context
+    ) -> None:
+        # Run the job in the context it was submitted from
+        result = await context.run(asyncio.ensure_future, job())
+        if (
+            isinstance(result, int)
+            and not isinstance(result, bool)
+            and not 200 <= result < 300
+        ):
+            raise RuntimeError(f"The event was handled with status {result}")
+
+    async def _work(self) -> None:
+        while True:
+            job, context = await self._queue.get()
+            started = time.monotonic()
+            try:
+                for attempt in range(1, self.max_attempts + 1):
+                    try:
+                        await self._attempt(job, context)
+                        self.completed += 1
+                        break
+                    except Exception:
+                        if attempt == self.max_attempts:
+                            self.failed += 1
+                            logger.exception(
+                                "Gave up on an accepted event after %d attempts",
+                                attempt,
+                            )
+                            break
+                        self.retried += 1
+                        logger.warning(
+                            "Failed to handle an accepted event, attempt %d of %d",
+                            attempt,
+                            self.max_attempts,
+                            exc_info=True,
+                        )
+                        await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+            finally:
+                elapsed = time.monotonic() - started
+                self.average_seconds += (elapsed - self.average_seconds) * 0.1
+                self._queue.task_done()
+
+    async def close(self) -> None:
+        """Stop accepting events, handle every queued one and stop the workers."""
+        self.accepting = False
+        await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
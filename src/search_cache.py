@@ -0,0 +1,236 @@
+import re
+from collections import OrderedDict, defaultdict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+# Columns that feed the search documents; changing them can change which rows match a query.
+SEARCHABLE_COLUMNS = {
+    "shopify_store_products": {"title", "handle", "vendor", "product_type", "tags"},
+    "shopify_store_variants": {"title", "sku", "product_id"},
+}
+
+
+def normalize_query(search_term: str) -> str:
+    return re.sub(r"\s+", " ", search_term).strip().lower()
+
+
+class SearchResultCache:
+    def __init__(self, max_entries: int = 500):
+        """LRU cache of search result pages, invalidated by catalog change events.
+
+        Every entry remembers the products and variants it contains, so a change
+        only drops the pages that show the changed rows.
+
+        Args:
+            max_entries (int, optional): The maximum number of result pages kept. Defaults to 500.
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[List[Any], float]]" = OrderedDict()
+        self._keys_by_product: Dict[int, Set[Hashable]] = defaultdict(set)
+        self._keys_by_variant: Dict[int, Set[Hashable]] = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+        # Bumped by every invalidation so queries racing a change are not cached
+        self.generation = 0
+
+    @staticmethod
+    def key(search_term: str, limit: int, after: Optional[Iterable[Any]]) -> Hashable:
+        return (
+            normalize_query(search_term),
+            limit,
+            tuple(after) if after is not None else None,
+        )
+
+    def get(self, key: Hashable) -> Optional[List[Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += entry[1]
+        return entry[0]
+
+    def set(
+        self, key: Hashable, rows: List[Any], query_seconds: float, generation: int
+    ) -> None:
+        """Cache a result page.
+
+        Args:
+            key (Hashable): The key built by `SearchResultCache.key`.
+            rows (List[Any]): The `(product, variant, ...)` result rows.
+            query_seconds (float): How long the query took, credited on every hit.
+            generation (int): The cache generation read before the query started.
+        """
+        if generation != self.generation:
+            return
+
+        self._discard(key)
+        self._entries[key] = (rows, query_seconds)
+        for row in rows:
+            self._keys_by_product[row[0].id].add(key)
+            self._keys_by_variant[row[1].id].add(key)
+        while len(self._entries) > self.max_entries:
+            self._discard(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for row in entry[0]:
+            for index, row_id in (
+                (self._keys_by_product, row[0].id),
+                (self._keys_by_variant, row[1].id),
+            ):
+                keys = index.get(row_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[row_id]
+
+    def invalidate(
+        self, product_ids: Iterable[int] = (), variant_ids: Iterable[int] = ()
+    ) -> None:
+        """Drop every cached page that contains one of the products or variants."""
+        self.generation += 1
+        keys = set()
+        for product_id in product_ids:
+            keys.update(self._keys_by_product.get(product_id, ()))
+        for variant_id in variant_ids:
+            keys.update(self._keys_by_variant.get(variant_id, ()))
+        for key in keys:
+            self._discard(key)
+        self.invalidations += len(keys)
+
+    def clear(self) -> None:
+        self.generation += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._keys_by_product.clear()
+        self._keys_by_variant.clear()
+
+    def _cached_row(self, table: str, row_id: Any) -> Optional[Any]:
+        """The product or variant with the ID as it is in a cached page, if any page shows it."""
+        column, index = (
+            (0, self._keys_by_product)
+            if table == "shopify_store_products"
+            else (1, self._keys_by_variant)
+        )
+        for key in index.get(row_id, ()):
+            for row in self._entries[key][0]:
+                if row[column].id == row_id:
+                    return row[column]
+        return None
+
+    def _searchable_changed(
+        self,
+        table: str,
+        before: Optional[Dict[str, Any]],
+        after: Dict[str, Any],
+    ) -> Optional[bool]:
+        """Whether an update changed searchable columns, or None when the old values are unknown."""
+        searchable = SEARCHABLE_COLUMNS[table] & after.keys()
+        if before:
+            return any(before.get(column) != after[column] for column in searchable)
+        cached = self._cached_row(table, after["id"])
+        if cached is None:
+            return None
+        return any(getattr(cached, column) != after[column] for column in searchable)
+
+    def _invalidate_matching(self, table: str, row: Dict[str, Any]) -> None:
+        """Drop the pages whose query shares a word with the row's searchable columns.
+
+        Only such queries can start or stop matching the row.  Words are compared by
+        their first four letters, which is enough to cover stemmed forms.
+        """
+        self.generation += 1
+        values = []
+        for column in SEARCHABLE_COLUMNS[table]:
+            value = row.get(column)
+            values.extend(value if isinstance(value, list) else [value])
+        text = normalize_query(" ".join(str(value) for value in values if value))
+        keys = [
+            key
+            for key in self._entries
+            if any(word[:4] in text for word in key[0].split())
+        ]
+        for key in keys:
+            self._discard(key)
+        self.invalidations += len(keys)
+
+    @staticmethod
+    def _becomes_first_image(
+        operation: str,
+        before: Optional[Dict[str, Any]],
+        after: Optional[Dict[str, Any]],
+    ) -> bool:
+        if not after or after.get("position") != 1:
+            return False
+        return operation == "c" or bool(before and before.get("position") != 1)
+
+    def apply_change(
+        self,
+        table: str,
+        operation: str,
+        before: Optional[Dict[str, Any]],
+        after: Optional[Dict[str, Any]],
+    ) -> None:
+        """Invalidate the pages affected by a Debezium change event.
+
+        Inserts into the searchable tables can add rows to any query, so they clear
+        the whole cache, as do edits of searchable columns.  So does a product's new
+        first image, since search only finds products that have one.  Debezium sends updates
+        without a before image by default; those are compared with the row as cached,
+        and for rows no page shows only the pages whose query can match the row are
+        dropped.  Every other change only drops the pages showing the row.
+
+        Args:
+            table (str): The changed table.
+            operation (str): The Debezium operation, one of "c", "u", "d" or "r".
+            before (Optional[Dict[str, Any]]): The row before the change.
+            after (Optional[Dict[str, Any]]): The row after the change.
+        """
+        rows = [row for row in (before, after) if row]
+        if table in SEARCHABLE_COLUMNS:
+            if operation == "c":
+                self.clear()
+                return
+            if after:
+                changed = self._searchable_changed(table, before, after)
+                if changed is None:
+                    self._invalidate_matching(table, after)
+                    return
+                if changed:
+                    self.clear()
+                    return
+        elif table == "shopify_store_images" and self._becomes_first_image(
+            operation, before, after
+        ):
+            self.clear()
+            return
+
+        if table == "shopify_store_products":
+            self.invalidate(product_ids={row["id"] for row in rows})
+        elif table == "shopify_store_variants":
+            self.invalidate(variant_ids={row["id"] for row in rows})
+        elif table == "shopify_store_images":
+            self.invalidate(
+                product_ids={row["product_id"] for row in rows},
+                variant_ids=set(),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "saved_seconds": self.saved_seconds,
+        }
@@ -0,0 +1,209 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from slack_sdk.errors import SlackApiError
+from slack_sdk.web.async_client import AsyncSlackResponse, AsyncWebClient
+
+from metrics import SLACK_API_LATENCY
+from tracing import tracer
+
+# (calls per second, burst) by Web API method, following Slack's rate limit tiers.
+# chat.postMessage is limited to about one message per second per channel.
+DEFAULT_RATE_LIMITS: Dict[str, Tuple[float, int]] = {
+    "chat_postMessage": (1.0, 3),
+    "chat_update": (50 / 60, 5),
+    "views_open": (100 / 60, 10),
+    "views_update": (100 / 60, 10),
+    "views_publish": (100 / 60, 10),
+}
+DEFAULT_RATE_LIMIT: Tuple[float, int] = (50 / 60, 5)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    NOTIFICATION = 1
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def block_for(self, seconds: float) -> None:
+        """Hold every call back for `seconds`, as requested by a Retry-After header."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    async def acquire(self) -> None:
+        # The lock keeps waiters of the same bucket in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PrioritySlots:
+    def __init__(self, slots: int):
+        """A semaphore that hands free slots to the highest priority waiter first."""
+        self.free = slots
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    def waiting(self, priority: Priority) -> int:
+        return sum(1 for waiter in self._waiters if waiter[0] == priority)
+
+    @asynccontextmanager
+    async def acquire(self, priority: Priority) -> AsyncIterator[None]:
+        if self.free > 0 and not self._waiters:
+            self.free -= 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            waiter = (int(priority), next(self._sequence), future)
+            heapq.heappush(self._waiters, waiter)
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()
+                else:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+
+class SlackScheduler:
+    def __init__(
+        self,
+        client: AsyncWebClient,
+        max_in_flight: int = 10,
+        max_retries: int = 3,
+        rate_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+    ):
+        """Sends Slack Web API calls within Slack's rate limits.
+
+        Every method and channel pair gets its own token bucket, and a 429 response
+        pauses its bucket for the Retry-After period before the call is retried.
+        At most `max_in_flight` calls run at once, and interactive calls are given
+        free slots ahead of notification posts.
+
+        Args:
+            client (AsyncWebClient): The client used when a call does not bring its own.
+            max_in_flight (int, optional): Calls running at the same time. Defaults to 10.
+            max_retries (int, optional): Retries of a rate limited call. Defaults to 3.
+            rate_limits (Optional[Dict[str, Tuple[float, int]]], optional): (calls per second, burst) by method.
+        """
+        self.client = client
+        self.max_retries = max_retries
+        self.rate_limits = {**DEFAULT_RATE_LIMITS, **(rate_limits or {})}
+        self._buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+        self._slots = PrioritySlots(max_in_flight)
+        self.calls = 0
+        self.rate_limited = 0
+        self.wait_seconds = {priority: 0.0 for priority in Priority}
+
+    def _bucket(self, method: str, channel: Optional[str]) -> TokenBucket:
+        key = (method, channel)
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(
+                *self.rate_limits.get(method, DEFAULT_RATE_LIMIT)
+            )
+        return self._buckets[key]
+
+    async def call(
+        self,
+        method: str,
+        priority: Priority = Priority.NOTIFICATION,
+        client: Optional[AsyncWebClient] = None,
+        **kwargs: Any,
+    ) -> AsyncSlackResponse:
+        """Call a Web API method once its rate limit and priority allow it.
+
+        Args:
+            method (str): The `AsyncWebClient` method name, e.g. "chat_postMessage".
+            priority (Priority, optional): The lane of the call. Defaults to Priority.NOTIFICATION.
+            client (Optional[AsyncWebClient], optional): The client to call, such as the one given to a listener.
+
+        Returns:
+            AsyncSlackResponse: The API response.
+        """
+        with tracer.span(f"slack.{method}", priority=priority.name) as span:
+            bucket = self._bucket(method, kwargs.get("channel"))
+            api_method = getattr(client or self.client, method)
+            for attempt in range(self.max_retries + 1):
+                queued_at = time.monotonic()
+                await bucket.acquire()
+                async with self._slots.acquire(priority):
+                    self.wait_seconds[priority] += time.monotonic() - queued_at
+                    self.calls += 1
+                    started = time.perf_counter()
+                    status = "error"
+                    try:
+                        response = await api_method(**kwargs)
+                        status = response.status_code
+                        if span is not None:
+                            span.attributes.update(status=status, attempts=attempt + 1)
+                        return response
+                    except SlackApiError as exc:
+                        status = exc.response.status_code
+                        if (
+                            exc.response.status_code != 429
+                            or attempt == self.max_retries
+                        ):
+                            raise
+                        self.rate_limited += 1
+                        headers = {
+                            key.lower(): value
+                            for key, value in (exc.response.headers or {}).items()
+                        }
+                        bucket.block_for(float(headers.get("retry-after", 1)))
+                    finally:
+                        SLACK_API_LATENCY.labels(method, status).observe(
+                            time.perf_counter() - started
+                        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "rate_limited": self.rate_limited,
+            "in_flight_slots_free": self._slots.free,
+            **{
+                f"queued_{priority.name.lower()}": self._slots.waiting(priority)
+                for priority in Priority
+            },
+            **{
+                f"wait_seconds_{priority.name.lower()}": seconds
+                for priority, seconds in self.wait_seconds.items()
+            },
+        }
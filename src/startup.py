@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    def __init__(self, retry_delay: float = 5.0):
+        """Times the steps of starting up and tells when the app is warm.
+
+        `imports` is the CPU time the process spent before the app was created,
+        which is mostly spent starting the interpreter and importing modules.
+
+        Args:
+            retry_delay (float, optional): Seconds between attempts of a failed critical step. Defaults to 5.0.
+        """
+        self.retry_delay = retry_delay
+        self.started = self._mark = time.perf_counter()
+        self.steps: Dict[str, float] = {"imports": time.process_time()}
+        self.failures: Counter = Counter()
+        self.ready = False
+
+    def record(self, name: str) -> None:
+        """Record a step that ends now and started when the previously recorded one ended."""
+        now = time.perf_counter()
+        self.steps[name] = now - self._mark
+        self._mark = now
+
+    async def run(
+        self, name: str, step: Callable[[], Awaitable[Any]], critical: bool = False
+    ) -> None:
+        """Run and time a warm-up step.
+
+        A failed optional step is logged and skipped.  A failed critical step is tried
+        again every `retry_delay` seconds, since the app cannot serve without it.
+
+        Args:
+            name (str): The name of the step.
+            step (Callable[[], Awaitable[Any]]): Runs the step.
+            critical (bool, optional): Whether the app is not ready until the step succeeds. Defaults to False.
+        """
+        started = time.perf_counter()
+        while True:
+            try:
+                await step()
+                break
+            except Exception:
+                self.failures[name] += 1
+                if not critical:
+                    logger.warning("Startup step %s failed", name, exc_info=True)
+                    break
+                logger.error(
+                    "Startup step %s failed, retrying in %.0fs",
+                    name,
+                    self.retry_delay,
+                    exc_info=True,
+                )
+                await asyncio.sleep(self.retry_delay)
+        self.steps[name] = time.perf_counter() - started
+
+    def finish(self) -> None:
+        self.ready = True
+        total = self.steps["imports"] + time.perf_counter() - self.started
+        logger.info(
+            "Ready after %.3fs: %s",
+            total,
+            ", ".join(f"{name} {seconds:.3f}s" for name, seconds in self.steps.items()),
+            extra={
+                "startup_seconds": total,
+                "startup_steps": self.steps,
+                "startup_failures": dict(self.failures),
+            },
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": int(self.ready),
+            **{f"{name}_seconds": seconds for name, seconds in self.steps.items()},
+            **{f"{name}_failures": count for name, count in self.failures.items()},
+        }
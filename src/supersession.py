@@ -0,0 +1,64 @@
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class Superseded(Exception):
+    """Raised when a newer task for the same key cancelled this one."""
+
+
+class Supersession:
+    def __init__(self):
+        """Runs only the newest task for each key, cancelling the one it supersedes.
+
+        Cancelling the task also cancels its database query: asyncpg sends Postgres
+        a cancel request when a query's coroutine is cancelled.
+        """
+        self._running: Dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.cancelled = 0
+        self.wasted = 0
+
+    async def run(self, key: Hashable, awaitable: Awaitable[T]) -> T:
+        """Run `awaitable` as the newest task for `key`.
+
+        Args:
+            key (Hashable): What the task works on, such as a view ID.
+            awaitable (Awaitable[T]): The work to run.
+
+        Raises:
+            Superseded: A newer task for `key` started before this one finished.
+
+        Returns:
+            T: The result of `awaitable`.
+        """
+        previous = self._running.get(key)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.ensure_future(awaitable)
+        self._running[key] = task
+        self.started += 1
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if self._running.get(key) is task:
+                # The caller was cancelled, not superseded
+                raise
+            self.cancelled += 1
+            raise Superseded(key) from None
+        finally:
+            if self._running.get(key) is task:
+                del self._running[key]
+
+    def record_wasted(self) -> None:
+        """Count a task that finished, but whose result could not be used."""
+        self.wasted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._running),
+            "started": self.started,
+            "cancelled": self.cancelled,
+            "wasted": self.wasted,
+        }
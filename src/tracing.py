@@ -0,0 +1,325 @@
+import contextvars
+import functools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+# W3C Trace Context: version-trace_id-parent_id-flags
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str]]:
+    """Return the trace ID and parent span ID of a `traceparent` header, if it is valid."""
+    match = TRACEPARENT_PATTERN.match(value.strip().lower()) if value else None
+    if match is None or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+        return None
+    return match.group(1), match.group(2)
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "ok"
+    # The first span of the trace in this process; it collects the finished spans
+    local_root: Optional["Span"] = field(default=None, repr=False)
+    finished: List["Span"] = field(default_factory=list, repr=False)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+_current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class FileSpanExporter:
+    def __init__(self, path: str):
+        """Appends every finished trace to a file, one JSON span per line."""
+        self.path = path
+        self._file = open(path, "a", buffering=64 * 1024)
+
+    def export(self, spans: List[Span]) -> None:
+        for span in spans:
+            self._file.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class SlowRequestProfiler:
+    def __init__(self, threshold: float, path: str, interval: float = 0.005):
+        """Samples the event loop's stack while requests run and keeps the profile of slow ones.
+
+        Requests share the event loop, so a profile holds every stack seen while its
+        request was running, including those of concurrent requests.
+
+        Args:
+            threshold (float): Requests taking at least this many seconds are written out.
+            path (str): The file profiles are appended to, one JSON object per line.
+            interval (float, optional): Seconds between stack samples. Defaults to 0.005.
+        """
+        self.threshold = threshold
+        self.path = path
+        self.interval = interval
+        self._samples: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread_id = threading.get_ident()
+        self.profiled = 0
+
+    def begin(self, root: Span) -> None:
+        with self._lock:
+            self._samples[root.span_id] = Counter()
+            self._active.set()
+        if self._thread is None:
+            self._loop_thread_id = threading.get_ident()
+            self._thread = threading.Thread(
+                target=self._sample, name="slow-request-profiler", daemon=True
+            )
+            self._thread.start()
+
+    def end(self, root: Span, spans: List[Span]) -> None:
+        with self._lock:
+            samples = self._samples.pop(root.span_id, Counter())
+            if not self._samples:
+                self._active.clear()
+        if root.duration < self.threshold:
+            return
+
+        self.profiled += 1
+        profile = {
+            "trace_id": root.trace_id,
+            "name": root.name,
+            "duration": root.duration,
+            "sql": [
+                {
+                    "statement": span.attributes["db.statement"],
+                    "duration": span.duration,
+                }
+                for span in spans
+                if "db.statement" in span.attributes
+            ],
+            "stacks": dict(samples.most_common(50)),
+        }
+        with open(self.path, "a") as file:
+            file.write(json.dumps(profile, default=str) + "\n")
+
+    def _sample(self) -> None:
+        while True:
+            self._active.wait()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            collapsed = ";".join(reversed(stack))
+            with self._lock:
+                for samples in self._samples.values():
+                    samples[collapsed] += 1
+            time.sleep(self.interval)
+
+
+class Tracer:
+    def __init__(self):
+        """Records spans of the work done for each request, in the W3C trace context model.
+
+        Tracing is off until an exporter or a profiler is configured; spans are then
+        collected per request and handed over together once the request's first span ends.
+        """
+        self.exporters: List[FileSpanExporter] = []
+        self.profiler: Optional[SlowRequestProfiler] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters) or self.profiler is not None
+
+    def start(
+        self,
+        name: str,
+        parent: Optional[Span] = None,
+        traceparent: Optional[str] = None,
+        **attributes: Any,
+    ) -> Span:
+        """Start a span under `parent`, the current span or the remote `traceparent`."""
+        parent = parent or current_span()
+        remote = parse_traceparent(traceparent) if parent is None else None
+        if parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        elif remote is not None:
+            trace_id, parent_id = remote
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+
+        span = Span(
+            name=name,
+            trace_id=trace_id,
+            span_id=os.urandom(8).hex(),
+            parent_id=parent_id,
+            start=time.time(),
+            attributes=attributes,
+        )
+        # Work that outlives its parent, like a queued event, starts a new local root
+        if parent is not None and parent.end is None and parent.local_root is not None:
+            span.local_root = parent.local_root
+        else:
+            span.local_root = span
+            if self.profiler is not None:
+                self.profiler.begin(span)
+        return span
+
+    def finish(self, span: Span) -> None:
+        span.end = time.time()
+        root = span.local_root
+        root.finished.append(span)
+        if span is root:
+            spans, root.finished = root.finished, []
+            for exporter in self.exporters:
+                exporter.export(spans)
+            if self.profiler is not None:
+                self.profiler.end(root, spans)
+        elif root.end is not None:
+            # The request already ended; export the late span by itself
+            root.finished.remove(span)
+            for exporter in self.exporters:
+                exporter.export([span])
+
+    @contextmanager
+    def span(
+        self,
+        name: str,
+        parent: Optional[Span] = None,
+        traceparent: Optional[str] = None,
+        **attributes: Any,
+    ) -> Iterator[Optional[Span]]:
+        """Run the enclosed code in a new span, made the current one."""
+        if not self.enabled:
+            yield None
+            return
+
+        span = self.start(name, parent=parent, traceparent=traceparent, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.status = "error"
+            span.attributes["error"] = repr(exc)
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    def close(self) -> None:
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+
+
+tracer = Tracer()
+
+
+def traced(func: F) -> F:
+    """Run an async function in a span named after it."""
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        with tracer.span(func.__name__):
+            return await func(*args, **kwargs)
+
+    return wrapper
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Record a span with the SQL text of every statement the engine runs."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement(conn, cursor, statement, parameters, context, executemany):
+        if tracer.enabled and current_span() is not None:
+            context._trace_span = tracer.start("sql", **{"db.statement": statement})
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def end_statement(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            tracer.finish(span)
+
+    @event.listens_for(engine, "handle_error")
+    def fail_statement(exception_context):
+        context = exception_context.execution_context
+        span = getattr(context, "_trace_span", None)
+        if span is not None:
+            span.status = "error"
+            tracer.finish(span)
+
+
+def configure_tracing(
+    export_path: Optional[str] = None,
+    slow_request_threshold: float = 0.0,
+    profile_path: str = "slow_requests.jsonl",
+) -> None:
+    """Enable tracing.
+
+    Args:
+        export_path (Optional[str], optional): The file finished spans are appended to.
+        slow_request_threshold (float, optional): Seconds after which a request's profile is kept, 0 disables profiling.
+        profile_path (str, optional): The file slow request profiles are appended to. Defaults to "slow_requests.jsonl".
+    """
+    tracer.close()
+    if export_path:
+        tracer.exporters.append(FileSpanExporter(export_path))
+    tracer.profiler = (
+        SlowRequestProfiler(slow_request_threshold, profile_path)
+        if slow_request_threshold > 0
+        else None
+    )
@@ -0,0 +1,231 @@
+import bisect
+import heapq
+import itertools
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from data_engine import DataEngine
+
+# Words of titles and vendors, and the segments of SKUs such as "UDM-PRO-SE"
+TERM_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TERM_PATTERN.findall(text.lower()) if text else []
+
+
+@dataclass
+class TypeaheadProduct:
+    id: int
+    title: Optional[str] = None
+    vendor: Optional[str] = None
+    # SKUs by variant ID
+    skus: Dict[int, Optional[str]] = field(default_factory=dict)
+    terms: FrozenSet[str] = frozenset()
+
+    def index_terms(self) -> FrozenSet[str]:
+        return frozenset(
+            itertools.chain(
+                tokenize(self.title),
+                tokenize(self.vendor),
+                *(tokenize(sku) for sku in self.skus.values()),
+            )
+        )
+
+
+class TypeaheadIndex:
+    def __init__(self, data_engine: DataEngine, max_candidates: int = 1000):
+        """Product suggestions for what a user has typed so far, from an in-memory prefix index.
+
+        Every word of a product's title and vendor and every segment of its variants'
+        SKUs is a term.  The terms are kept sorted, so the terms starting with a typed
+        word are found by binary search.  A suggestion starts with a term matching
+        each typed word.  At most `max_candidates` products are ranked per lookup,
+        which bounds its time whatever the size of the catalog.
+
+        The index is loaded once and then kept current by Debezium change events.
+
+        Args:
+            data_engine (DataEngine): The data engine the catalog is loaded from.
+            max_candidates (int, optional): Products ranked per lookup. Defaults to 1000.
+        """
+        self.data_engine = data_engine
+        self.max_candidates = max_candidates
+        self._products: Dict[int, TypeaheadProduct] = {}
+        self._variant_products: Dict[int, int] = {}
+        self._postings: Dict[str, Set[int]] = {}
+        self._terms: List[str] = []
+        # Changes received while the catalog is loaded, applied once it is
+        self._pending: Optional[List[Tuple[Any, ...]]] = None
+        self.loaded = False
+        self.lookups = 0
+        self.changes = 0
+
+    async def load(self) -> None:
+        """Build the index from the whole catalog."""
+        self._pending = []
+        try:
+            products, variants = await self.data_engine.get_typeahead_rows()
+        except BaseException:
+            self._pending = None
+            raise
+
+        self._products = {
+            row.id: TypeaheadProduct(row.id, row.title, row.vendor) for row in products
+        }
+        self._variant_products = {}
+        for row in variants:
+            self._product(row.product_id).skus[row.id] = row.sku
+            self._variant_products[row.id] = row.product_id
+
+        self._postings = {}
+        for product in self._products.values():
+            product.terms = product.index_terms()
+            for term in product.terms:
+                self._postings.setdefault(term, set()).add(product.id)
+        self._terms = sorted(self._postings)
+        self.loaded = True
+
+        pending, self._pending = self._pending, None
+        for change in pending:
+            self.apply_change(*change)
+
+    def _product(self, product_id: int) -> TypeaheadProduct:
+        # A variant's change can arrive before its product's
+        product = self._products.get(product_id)
+        if product is None:
+            product = self._products[product_id] = TypeaheadProduct(product_id)
+        return product
+
+    def _reindex(self, product: TypeaheadProduct, terms: FrozenSet[str]) -> None:
+        for term in product.terms - terms:
+            posting = self._postings[term]
+            posting.discard(product.id)
+            if not posting:
+                del self._postings[term]
+                del self._terms[bisect.bisect_left(self._terms, term)]
+        for term in terms - product.terms:
+            if term not in self._postings:
+                self._postings[term] = set()
+                bisect.insort(self._terms, term)
+            self._postings[term].add(product.id)
+        product.terms = terms
+
+    def _remove_variant(self, variant_id: int) -> None:
+        product_id = self._variant_products.pop(variant_id, None)
+        product = self._products.get(product_id)
+        if product is not None:
+            product.skus.pop(variant_id, None)
+            self._reindex(product, product.index_terms())
+
+    def apply_change(
+        self,
+        table: str,
+        operation: Optional[str],
+        before: Optional[Dict[str, Any]],
+        after: Optional[Dict[str, Any]],
+    ) -> None:
+        """Update the index with a Debezium change event.
+
+        Args:
+            table (str): The changed table.
+            operation (Optional[str]): The Debezium operation, one of "c", "u", "d" or "r".
+            before (Optional[Dict[str, Any]]): The row before the change.
+            after (Optional[Dict[str, Any]]): The row after the change.
+        """
+        if table not in ("shopify_store_products", "shopify_store_variants"):
+            return
+        if self._pending is not None:
+            self._pending.append((table, operation, before, after))
+            return
+
+        self.changes += 1
+        if table == "shopify_store_products":
+            if after:
+                product = self._product(after["id"])
+                product.title = after.get("title")
+                product.vendor = after.get("vendor")
+                self._reindex(product, product.index_terms())
+            elif before and before.get("id") in self._products:
+                product = self._products.pop(before["id"])
+                self._reindex(product, frozenset())
+                for variant_id in product.skus:
+                    self._variant_products.pop(variant_id, None)
+        elif after:
+            if self._variant_products.get(after["id"]) != after.get("product_id"):
+                self._remove_variant(after["id"])
+            product = self._product(after["product_id"])
+            product.skus[after["id"]] = after.get("sku")
+            self._variant_products[after["id"]] = product.id
+            self._reindex(product, product.index_terms())
+        elif before:
+            self._remove_variant(before.get("id"))
+
+    def get(self, product_id: int) -> Optional[TypeaheadProduct]:
+        return self._products.get(product_id)
+
+    def _matching_terms(self, word: str) -> Tuple[int, int]:
+        """The range of the sorted terms that start with `word`."""
+        start = bisect.bisect_left(self._terms, word)
+        end = bisect.bisect_left(
+            self._terms, word[:-1] + chr(ord(word[-1]) + 1), lo=start
+        )
+        return start, end
+
+    def suggest(self, query: str, limit: int = 20) -> List[TypeaheadProduct]:
+        """Find the products with a term starting with every word of `query`.
+
+        Products with more exactly matching words come first, then those whose title
+        starts with the query, then the shorter titles.
+
+        Args:
+            query (str): What the user typed so far.
+            limit (int, optional): The maximum number of products returned. Defaults to 20.
+        """
+        self.lookups += 1
+        words = set(tokenize(query))
+        if not words:
+            return []
+
+        # Gather candidates through the word matching the fewest terms
+        ranges = {word: self._matching_terms(word) for word in words}
+        rarest = min(words, key=lambda word: ranges[word][1] - ranges[word][0])
+        start, end = ranges[rarest]
+        candidates: Set[int] = set()
+        for index in range(start, end):
+            posting = self._postings[self._terms[index]]
+            candidates.update(
+                itertools.islice(posting, self.max_candidates - len(candidates))
+            )
+            if len(candidates) >= self.max_candidates:
+                break
+
+        prefix = " ".join(tokenize(query))
+        matches = []
+        for product_id in candidates:
+            product = self._products[product_id]
+            if not product.title or not all(
+                any(term.startswith(word) for term in product.terms) for word in words
+            ):
+                continue
+            exact = len(words & product.terms)
+            matches.append(
+                (
+                    -exact,
+                    not " ".join(tokenize(product.title)).startswith(prefix),
+                    len(product.title),
+                    product.title,
+                    product_id,
+                )
+            )
+        return [self._products[match[-1]] for match in heapq.nsmallest(limit, matches)]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": int(self.loaded),
+            "products": len(self._products),
+            "terms": len(self._terms),
+            "lookups": self.lookups,
+            "changes": self.changes,
+        }
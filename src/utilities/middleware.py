@@ -3,26 +3,52 @@ import logging
 from typing import TYPE_CHECKING, Any, Awaitable
 
 from aiohttp import web
-from cloudevents.http import from_http
+from cloudevents.http import CloudEvent, from_http
 from path_dict import PathDict
+from prometheus_client import CONTENT_TYPE_LATEST
 from slack_bolt import BoltResponse
-from slack_bolt.adapter.socket_mode.async_handler import AsyncSocketModeHandler
+
+from metrics import CLOUDEVENT_LATENCY, generate_metrics, timed_handler
+from tracing import tracer
+from utilities.structured_logging import LazyJson, request_sampler, request_type
 
 if TYPE_CHECKING:
     from bolt_app import KnativeSlackBolt
 
+NOTIFICATIONS_TABLE = "shopify_store_product_notifications"
+
 
 async def log_request(
     logger: logging.Logger, body: dict, next: Awaitable[BoltResponse]
 ) -> BoltResponse:
-    """Log the incoming request."""
+    """Log a sample of the incoming requests, serialized only when debug logging is enabled."""
 
-    logger.debug(json.dumps(body, indent=4, default=str))
+    if logger.isEnabledFor(logging.DEBUG):
+        event_type = request_type(body)
+        if request_sampler.sample(event_type):
+            logger.debug(
+                "Slack request %s: %s",
+                event_type,
+                LazyJson(body),
+                extra={"event_type": event_type},
+            )
     return await next()
 
 
+async def liveness_handler(req: web.Request) -> web.Response:
+    """Report that the process is up, whether or not it is ready for traffic.
+
+    Args:
+        req (web.Request): The incoming request.
+
+    Returns:
+        web.Response: The response.
+    """
+    return web.json_response({"status": "alive"})
+
+
 async def healthcheck_handler(req: web.Request) -> web.Response:
-    """Returns OK if app is ready with the socket mode client connected.
+    """Report the replica's role; it is ready once warmed up, and the leader only with Socket Mode connected.
 
     Args:
         req (web.Request): The incoming request.
@@ -31,14 +57,40 @@ async def healthcheck_handler(req: web.Request) -> web.Response:
         web.Response: The response.
     """
     app: KnativeSlackBolt = req.app["slack_app"]
-    client = app.socket_mode_handler.client
-    if client is not None and await client.is_connected():
-        return web.Response(status=200, text="OK")
-    return web.Response(status=503, text="The Socket Mode client is inactive")
+    role = app.role
+    handler = app.socket_mode_handler
+    connected = handler is not None and await handler.client.is_connected()
+    body = {
+        "role": role,
+        "socket_mode": "connected" if connected else "disconnected",
+        "ready": app.startup.ready,
+    }
+    if not app.startup.ready or (role == "leader" and not connected):
+        return web.json_response(body, status=503)
+    return web.json_response(body, status=200)
+
+
+async def metrics_handler(req: web.Request) -> web.Response:
+    """Expose the Prometheus metrics of the app.
+
+    Args:
+        req (web.Request): The incoming request.
+
+    Returns:
+        web.Response: The response.
+    """
+    return web.Response(
+        body=generate_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST}
+    )
 
 
+@timed_handler(CLOUDEVENT_LATENCY)
 async def cloudevent_handler(req: web.Request) -> web.Response:
-    """Handle incoming CloudEvents.  This is expecting a Cloud Event produced by the Knative Source for Apache Kafka."""
+    """Handle incoming CloudEvents.  This is expecting a Cloud Event produced by the Knative Source for Apache Kafka.
+
+    Every event is a Debezium change event.  Changes to the catalog tables keep the app's caches current,
+    and new rows in the notifications table are delivered to Slack.
+    """
 
     def unmarshaller(value: Any) -> str:
         if isinstance(value, bytes):
@@ -48,11 +100,64 @@ async def cloudevent_handler(req: web.Request) -> web.Response:
     # Process request body
     bytestr_data = await req.read()
     event = from_http(req.headers, bytestr_data, data_unmarshaller=unmarshaller)
+
+    # Continue the trace of the producer, sent as a header or a CloudEvent extension
+    with tracer.span(
+        "cloudevent_handler",
+        traceparent=req.headers.get("traceparent") or event.get("traceparent"),
+        event_id=event["id"],
+    ):
+        return await handle_cloudevent(req.app["slack_app"], event)
+
+
+async def handle_cloudevent(app: "KnativeSlackBolt", event: CloudEvent) -> web.Response:
+    """Apply a Debezium change event and deliver it if it is a new notification.
+
+    Args:
+        app (KnativeSlackBolt): The app.
+        event (CloudEvent): The parsed CloudEvent.
+
+    Returns:
+        web.Response: The response.
+    """
+    # Kafka redelivers events; answer the ones already handled without parsing them
+    status_code = app.idempotency.get(("event", event["id"]))
+    if status_code is not None:
+        return web.Response(status=status_code)
+
     event_data = PathDict(json.loads(event.data))
+    table = event_data["payload", "source", "table"] or NOTIFICATIONS_TABLE
+    app.handle_catalog_change(
+        table,
+        event_data["payload", "op"],
+        event_data["payload", "before"],
+        event_data["payload", "after"],
+        # The commit time in the source database, or when Debezium read the change
+        changed_at=event_data["payload", "source", "ts_ms"]
+        or event_data["payload", "ts_ms"],
+    )
+    # Only new notifications are delivered; updates include marking them delivered
+    if table != NOTIFICATIONS_TABLE or event_data["payload", "op"] in ("u", "d"):
+        return web.Response(status=200)
+
     notification_id = event_data["payload", "after", "id"]
+    if app.event_pool is not None:
+        # Acknowledge now and deliver in the background, or ask the source to back off
+        accepted = app.event_pool.submit(
+            lambda: app.handle_cloudevent_notifications(
+                notification_id, event_id=event["id"]
+            )
+        )
+        if not accepted:
+            return web.Response(
+                status=429 if app.event_pool.accepting else 503,
+                headers={"Retry-After": str(app.event_pool.retry_after())},
+            )
+        return web.Response(status=202)
 
-    app: KnativeSlackBolt = req.app["slack_app"]
-    status_code = await app.handle_cloudevent_notifications(notification_id)
+    status_code = await app.handle_cloudevent_notifications(
+        notification_id, event_id=event["id"]
+    )
 
     return web.Response(
         status=status_code, text=json.dumps(event, indent=4, default=str)
@@ -0,0 +1,123 @@
+import json
+import logging
+import random
+import re
+from typing import Any, Dict, Iterable, Optional
+
+# Keys whose values never reach the logs: credentials and the IDs of Slack users.
+DEFAULT_REDACTED_FIELDS = frozenset(
+    {"token", "user", "user_id", "username", "authorization", "trigger_id"}
+)
+SECRET_FIELD_PATTERN = re.compile(r"token|secret|password", re.IGNORECASE)
+REDACTED = "[REDACTED]"
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message"}
+
+
+def redact(value: Any, fields: Iterable[str] = DEFAULT_REDACTED_FIELDS) -> Any:
+    """Copy `value`, replacing the values of sensitive keys at any depth."""
+    fields = frozenset(fields)
+    if isinstance(value, dict):
+        return {
+            key: REDACTED
+            if key in fields or SECRET_FIELD_PATTERN.search(str(key))
+            else redact(item, fields)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item, fields) for item in value]
+    return value
+
+
+class LazyJson:
+    def __init__(self, value: Any):
+        """A log argument that is redacted and serialized only if the record is emitted."""
+        self.value = value
+
+    def __str__(self) -> str:
+        return json.dumps(
+            redact(self.value, _redacted_fields), separators=(",", ":"), default=str
+        )
+
+
+class EventSampler:
+    def __init__(self, rates: Optional[Dict[str, float]] = None, default: float = 1.0):
+        """Decides which events are logged, with a sampling rate per event type.
+
+        Args:
+            rates (Optional[Dict[str, float]], optional): The share of each event type that is logged.
+            default (float, optional): The share of other event types that is logged. Defaults to 1.0.
+        """
+        self.rates = rates or {}
+        self.default = default
+
+    def sample(self, event_type: str) -> bool:
+        rate = self.rates.get(event_type, self.default)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats every record as a single line of JSON."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(
+            redact(entry, _redacted_fields), separators=(",", ":"), default=str
+        )
+
+
+_redacted_fields = DEFAULT_REDACTED_FIELDS
+request_sampler = EventSampler()
+
+
+def parse_sample_rates(value: str) -> Dict[str, float]:
+    """Parse "block_actions=0.1,view_submission=1" into a rate per event type."""
+    rates = {}
+    for item in value.split(","):
+        if "=" in item:
+            event_type, rate = item.split("=", 1)
+            rates[event_type.strip()] = float(rate)
+    return rates
+
+
+def request_type(body: Dict[str, Any]) -> str:
+    """The event type of a Slack request body, e.g. "block_actions" or "app_home_opened"."""
+    event = body.get("event")
+    if isinstance(event, dict) and "type" in event:
+        return event["type"]
+    return body.get("type") or body.get("command") or "unknown"
+
+
+def configure_logging(
+    level: str = "INFO",
+    json_output: bool = False,
+    sample_rates: Optional[Dict[str, float]] = None,
+    redacted_fields: Iterable[str] = (),
+) -> None:
+    """Set up the root logger.
+
+    Args:
+        level (str, optional): The minimum level logged. Defaults to "INFO".
+        json_output (bool, optional): Write single-line JSON instead of plain text. Defaults to False.
+        sample_rates (Optional[Dict[str, float]], optional): The share of Slack requests logged by event type.
+        redacted_fields (Iterable[str], optional): Keys redacted in addition to the default ones.
+    """
+    global _redacted_fields
+    _redacted_fields = DEFAULT_REDACTED_FIELDS | frozenset(redacted_fields)
+    request_sampler.rates = sample_rates or {}
+
+    handler = logging.StreamHandler()
+    if json_output:
+        handler.setFormatter(JsonFormatter())
+    logging.basicConfig(level=level.upper(), handlers=[handler], force=True)
@@ -0,0 +1,179 @@
+import datetime
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from models.slack_view_state import SlackViewState
+
+# Slack modals are closed long before this, so older state is never read again.
+DEFAULT_VIEW_STATE_TTL = 3600.0
+
+
+def compact_search_row(row: Sequence[Any]) -> Dict[str, Any]:
+    """Reduce a `(product, variant, image, ...)` result row to plain values."""
+    product, variant, image = row[0], row[1], row[2]
+    return {
+        "product_id": product.id,
+        "variant_id": variant.id,
+        "title": product.title,
+        "variant_title": variant.title,
+        "vendor": product.vendor,
+        "handle": product.handle,
+        "price": variant.price,
+        "available": variant.available,
+        "track": product.track,
+        "image": image.src,
+        "updated_at": variant.updated_at,
+    }
+
+
+def encode_rows(rows: List[Dict[str, Any]]) -> bytes:
+    return json.dumps(rows, separators=(",", ":"), default=str).encode("utf-8")
+
+
+def decode_rows(data: bytes) -> List[Dict[str, Any]]:
+    return json.loads(data)
+
+
+class ViewStateStore(ABC):
+    """Keeps the rows rendered in a modal view, keyed by the view ID."""
+
+    def __init__(self, ttl: float = DEFAULT_VIEW_STATE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @abstractmethod
+    async def set(self, view_id: str, rows: List[Dict[str, Any]]) -> None:
+        ...
+
+    @abstractmethod
+    async def get(self, view_id: str) -> Optional[List[Dict[str, Any]]]:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class InMemoryViewStateStore(ViewStateStore):
+    def __init__(
+        self,
+        ttl: float = DEFAULT_VIEW_STATE_TTL,
+        max_entries: int = 1000,
+        max_bytes: int = 16 * 1024 * 1024,
+    ):
+        """Per-process view state with TTL expiry and LRU eviction.
+
+        Args:
+            ttl (float, optional): Seconds a view's state is kept. Defaults to 3600.
+            max_entries (int, optional): The maximum number of views kept. Defaults to 1000.
+            max_bytes (int, optional): The maximum size of the serialized rows kept. Defaults to 16 MiB.
+        """
+        super().__init__(ttl)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+
+    def _discard(self, view_id: str) -> None:
+        entry = self._entries.pop(view_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    async def set(self, view_id: str, rows: List[Dict[str, Any]]) -> None:
+        data = encode_rows(rows)
+        self._discard(view_id)
+        if len(data) > self.max_bytes:
+            self.evictions += 1
+            return
+
+        self._entries[view_id] = (time.monotonic() + self.ttl, data)
+        self._bytes += len(data)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    async def get(self, view_id: str) -> Optional[List[Dict[str, Any]]]:
+        entry = self._entries.get(view_id)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._discard(view_id)
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(view_id)
+        self.hits += 1
+        return decode_rows(entry[1])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+        }
+
+
+class PostgresViewStateStore(ViewStateStore):
+    def __init__(
+        self,
+        session: async_sessionmaker,
+        ttl: float = DEFAULT_VIEW_STATE_TTL,
+        purge_interval: float = 60.0,
+    ):
+        """View state shared by every replica through the `slack_view_states` table.
+
+        Args:
+            session (async_sessionmaker): The session factory of the `DataEngine`.
+            ttl (float, optional): Seconds a view's state is kept. Defaults to 3600.
+            purge_interval (float, optional): Minimum seconds between deletions of expired rows. Defaults to 60.
+        """
+        super().__init__(ttl)
+        self.session = session
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+
+    async def set(self, view_id: str, rows: List[Dict[str, Any]]) -> None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires_at = now + datetime.timedelta(seconds=self.ttl)
+        stmt = insert(SlackViewState).values(
+            view_id=view_id, data=encode_rows(rows), expires_at=expires_at
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SlackViewState.view_id],
+            set_={"data": stmt.excluded.data, "expires_at": stmt.excluded.expires_at},
+        )
+        async with self.session() as sess, sess.begin():
+            await sess.execute(stmt)
+            if time.monotonic() - self._last_purge > self.purge_interval:
+                self._last_purge = time.monotonic()
+                purged = await sess.execute(
+                    delete(SlackViewState).where(SlackViewState.expires_at < now)
+                )
+                self.evictions += purged.rowcount
+
+    async def get(self, view_id: str) -> Optional[List[Dict[str, Any]]]:
+        stmt = select(SlackViewState.data).where(
+            SlackViewState.view_id == view_id,
+            SlackViewState.expires_at > datetime.datetime.now(datetime.timezone.utc),
+        )
+        async with self.session() as sess:
+            data = (await sess.execute(stmt)).scalar_one_or_none()
+        if data is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return decode_rows(data)
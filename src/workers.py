@@ -0,0 +1,72 @@
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def _run_worker(target: Callable[[int], None], index: int) -> None:
+    # The worker handles its own signals, e.g. aiohttp's graceful shutdown
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    target(index)
+
+
+def run_workers(
+    target: Callable[[int], None],
+    workers: int,
+    shutdown_timeout: float = 25.0,
+    restart_delay: float = 1.0,
+) -> None:
+    """Run `target(index)` in forked worker processes until SIGTERM or SIGINT.
+
+    A worker that exits is started again.  On shutdown every worker is sent SIGTERM
+    and given `shutdown_timeout` seconds in total to finish before it is killed.
+
+    Args:
+        target (Callable[[int], None]): Runs one worker, given its index.
+        workers (int): The number of worker processes.
+        shutdown_timeout (float, optional): Seconds the workers get to shut down. Defaults to 25.0.
+        restart_delay (float, optional): Seconds between checks for exited workers. Defaults to 1.0.
+    """
+    context = multiprocessing.get_context("fork")
+
+    def start(index: int) -> multiprocessing.Process:
+        process = context.Process(
+            target=_run_worker, args=(target, index), name=f"worker-{index}"
+        )
+        process.start()
+        logger.info("Started worker %d (pid %d)", index, process.pid)
+        return process
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    processes: Dict[int, multiprocessing.Process] = {
+        index: start(index) for index in range(workers)
+    }
+    while not stopping.wait(restart_delay):
+        for index, process in processes.items():
+            if not process.is_alive():
+                logger.warning("Worker %d exited with code %s", index, process.exitcode)
+                processes[index] = start(index)
+
+    logger.info("Stopping %d workers", workers)
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    deadline = time.monotonic() + shutdown_timeout
+    for index, process in processes.items():
+        process.join(max(deadline - time.monotonic(), 0.0))
+        if process.is_alive():
+            logger.warning("Killing worker %d, which did not shut down", index)
+            process.kill()
+            process.join()
@@ -0,0 +1,181 @@
+import asyncio
+import dataclasses
+import datetime
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from catalog_replica import TABLES, CatalogReplica, decode_money
+
+PRODUCTS = "shopify_store_products"
+VARIANTS = "shopify_store_variants"
+IMAGES = "shopify_store_images"
+PUBLISHED = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeSession:
+    """Answers each SELECT of `CatalogReplica.load` with the rows of its table."""
+
+    def __init__(self, database):
+        self.database = database
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def begin(self):
+        return self
+
+    async def connection(self, execution_options=None):
+        return None
+
+    async def execute(self, statement):
+        await self.database.release.wait()
+        if self.database.error is not None:
+            raise self.database.error
+        table = statement.selected_columns[0].table.name
+        record = TABLES[table][1]
+        row = namedtuple("Row", [field.name for field in dataclasses.fields(record)])
+        return [
+            row(
+                **{
+                    field.name: values.get(field.name)
+                    for field in dataclasses.fields(record)
+                }
+            )
+            for values in self.database.tables[table]
+        ]
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.release.set()
+        self.error = None
+        self.tables = {
+            PRODUCTS: [
+                {
+                    "id": 1,
+                    "title": "Switch",
+                    "vendor": "UniFi",
+                    "published_at": PUBLISHED,
+                }
+            ],
+            VARIANTS: [{"id": 10, "product_id": 1, "price": "$99.00"}],
+            IMAGES: [{"id": 100, "product_id": 1, "position": 1, "src": "a.png"}],
+        }
+
+    def session(self):
+        return FakeSession(self)
+
+
+class CatalogReplicaLoadTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.database = FakeDatabase()
+        self.replica = CatalogReplica(self.database.session)
+
+    async def test_load_copies_every_table(self):
+        await self.replica.load()
+
+        self.assertTrue(self.replica.loaded)
+        self.assertEqual(self.replica.products[1].title, "Switch")
+        self.assertEqual(self.replica.get_featured_image(1, 10), "a.png")
+        self.assertEqual(
+            [row[1].id for row in self.replica.get_new_products(["UniFi"])], [10]
+        )
+
+    async def test_changes_received_during_a_load_are_applied_after_it(self):
+        self.database.release.clear()
+        load = asyncio.ensure_future(self.replica.load())
+        await asyncio.sleep(0)
+
+        self.replica.apply_change(
+            VARIANTS, "u", None, {"id": 10, "product_id": 1, "price": "120.5"}
+        )
+        self.replica.apply_change(
+            IMAGES,
+            "c",
+            None,
+            {"id": 101, "product_id": 1, "position": 0, "src": "b.png"},
+        )
+        self.assertEqual(self.replica.changes, 0)
+        self.database.release.set()
+        await load
+
+        self.assertEqual(self.replica.changes, 2)
+        self.assertEqual(self.replica.variants[10].price, "$120.50")
+        self.assertEqual(self.replica.get_featured_image(1, 10), "b.png")
+
+    async def test_changes_received_during_a_failed_load_are_kept(self):
+        await self.replica.load()
+        self.database.release.clear()
+        self.database.error = ConnectionResetError("connection lost")
+        load = asyncio.ensure_future(self.replica.load())
+        await asyncio.sleep(0)
+
+        self.replica.apply_change(
+            PRODUCTS, "u", None, {"id": 1, "title": "Router", "vendor": "UniFi"}
+        )
+        self.database.release.set()
+        with self.assertRaises(ConnectionResetError):
+            await load
+
+        self.assertEqual(self.replica.products[1].title, "Router")
+        self.assertEqual(self.replica.loads, 1)
+
+    async def test_deleting_a_product_deletes_its_variants_and_images(self):
+        await self.replica.load()
+
+        self.replica.apply_change(PRODUCTS, "d", {"id": 1}, None)
+
+        self.assertEqual(self.replica.variants, {})
+        self.assertEqual(self.replica.images, {})
+        self.assertIsNone(self.replica.get_featured_image(1, 10))
+
+
+class CatalogReplicaCheckTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.replica = CatalogReplica(FakeDatabase().session, check_interval=0.01)
+        self.replica.load = mock.AsyncMock()
+        self.addAsyncCleanup(self.replica.close)
+
+    async def run_checks(self, drifts):
+        checks = iter(drifts)
+        done = asyncio.Event()
+
+        async def check_consistency():
+            try:
+                return next(checks)
+            except StopIteration:
+                done.set()
+                return 0
+
+        self.replica.check_consistency = check_consistency
+        self.replica.start()
+        await asyncio.wait_for(done.wait(), 2.0)
+
+    async def test_a_single_difference_is_left_to_events_in_flight(self):
+        await self.run_checks([3, 0, 2, 0])
+
+        self.replica.load.assert_not_awaited()
+
+    async def test_two_differences_in_a_row_load_the_replica_again(self):
+        await self.run_checks([3, 2, 0])
+
+        self.replica.load.assert_awaited_once()
+        self.assertEqual(self.replica.drift, 0)
+
+
+class DecodeMoneyTest(unittest.TestCase):
+    def test_debezium_encodings_decode_to_postgres_text(self):
+        self.assertEqual(decode_money("1234.5"), "$1,234.50")
+        self.assertEqual(decode_money(-3), "-$3.00")
+        # 12345 cents as a big-endian two's complement integer
+        self.assertEqual(decode_money("MDk="), "$123.45")
+        self.assertEqual(decode_money("$5.00"), "$5.00")
+
+
+if __name__ == "__main__":
+    unittest.main()
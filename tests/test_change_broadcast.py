@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import json
+import unittest
+from unittest import mock
+
+from change_broadcast import (
+    MAX_PAYLOAD_BYTES,
+    ChangeBroadcast,
+    decode_message,
+    encode_message,
+)
+from notifications import CoalescedMessage
+
+PRODUCTS = "shopify_store_products"
+
+
+class FakePostgres:
+    """Delivers NOTIFY payloads to every listening session, the sender's included."""
+
+    def __init__(self):
+        self.connections = []
+
+    async def connect(self, dsn, server_settings=None):
+        conn = FakeConnection(self, pid=len(self.connections) + 1)
+        self.connections.append(conn)
+        return conn
+
+
+class FakeConnection:
+    def __init__(self, postgres: FakePostgres, pid: int):
+        self.postgres = postgres
+        self.pid = pid
+        self.listeners = []
+        self.lost = False
+        self.closed = False
+
+    def get_server_pid(self):
+        return self.pid
+
+    async def add_listener(self, channel, callback):
+        self.listeners.append((channel, callback))
+
+    def _check(self):
+        if self.lost or self.closed:
+            raise ConnectionResetError("connection lost")
+
+    async def fetchval(self, query, *args, timeout=None):
+        self._check()
+        return 1
+
+    async def execute(self, query, channel, payload):
+        self._check()
+        for conn in self.postgres.connections:
+            if conn.closed:
+                continue
+            for listened, callback in conn.listeners:
+                if listened == channel:
+                    callback(conn, self.pid, channel, payload)
+
+    async def close(self, timeout=None):
+        self.closed = True
+
+    def terminate(self):
+        self.closed = True
+
+
+async def wait_for(condition, timeout: float = 2.0) -> None:
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.005)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+class ChangeBroadcastTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.postgres = FakePostgres()
+        patcher = mock.patch("change_broadcast.asyncpg.connect", self.postgres.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.broadcasts = []
+
+    async def asyncTearDown(self):
+        for broadcast in self.broadcasts:
+            await broadcast.close()
+
+    def broadcast(self) -> ChangeBroadcast:
+        broadcast = ChangeBroadcast(
+            "postgresql://localhost/inventory",
+            on_change=lambda *change: broadcast.changes.append(change),
+            on_message=lambda *message: broadcast.messages.append(message),
+            on_resync=mock.AsyncMock(),
+            retry_interval=0.01,
+            check_interval=0.01,
+        )
+        broadcast.changes, broadcast.messages = [], []
+        self.broadcasts.append(broadcast)
+        return broadcast
+
+    async def start(self, *broadcasts):
+        for broadcast in broadcasts:
+            broadcast.start()
+        await wait_for(lambda: all(broadcast.listening for broadcast in broadcasts))
+
+    async def test_changes_are_applied_by_the_other_processes_only(self):
+        first, second = self.broadcast(), self.broadcast()
+        await self.start(first, second)
+
+        first.publish_change(
+            PRODUCTS,
+            "u",
+            None,
+            {"id": 1, "title": "Switch", "body_html": "<p>Long</p>"},
+            1700000000000,
+        )
+        await wait_for(lambda: second.changes)
+
+        # Only the columns the caches read are relayed
+        self.assertEqual(
+            second.changes,
+            [(PRODUCTS, "u", None, {"id": 1, "title": "Switch"}, 1700000000000)],
+        )
+        self.assertEqual(first.changes, [])
+        self.assertEqual(first.stats()["published"], 1)
+
+    async def test_a_process_resyncs_each_time_it_starts_listening(self):
+        broadcast = self.broadcast()
+        await self.start(broadcast)
+        await wait_for(lambda: broadcast.on_resync.await_count == 1)
+
+        self.postgres.connections[0].lost = True
+        await wait_for(lambda: broadcast.on_resync.await_count == 2)
+
+        self.assertEqual(broadcast.stats()["connection_failures"], 1)
+        self.assertTrue(self.postgres.connections[0].closed)
+
+    async def test_a_change_too_large_to_relay_resyncs_the_others(self):
+        first, second = self.broadcast(), self.broadcast()
+        await self.start(first, second)
+        await wait_for(lambda: second.on_resync.await_count == 1)
+
+        first.publish_change(
+            PRODUCTS, "u", None, {"id": 1, "title": "x" * MAX_PAYLOAD_BYTES}
+        )
+        await wait_for(lambda: second.on_resync.await_count == 2)
+
+        self.assertEqual(second.changes, [])
+        self.assertEqual(first.stats()["dropped"], 1)
+        self.assertEqual(first.on_resync.await_count, 1)
+
+    async def test_a_change_that_failed_to_send_is_sent_on_reconnecting(self):
+        first, second = self.broadcast(), self.broadcast()
+        await self.start(first, second)
+
+        self.postgres.connections[0].lost = True
+        first.publish_change(PRODUCTS, "d", {"id": 1}, None)
+        await wait_for(lambda: second.changes)
+
+        self.assertEqual(second.changes, [(PRODUCTS, "d", {"id": 1}, None, None)])
+        self.assertEqual(first.stats()["connection_failures"], 1)
+
+
+class MessageEncodingTest(unittest.TestCase):
+    def test_a_message_survives_the_round_trip(self):
+        message = CoalescedMessage(
+            channel="C1",
+            ts="1.0",
+            expires_at=1000.0,
+            first_changed_at=datetime.datetime(
+                2023, 5, 1, tzinfo=datetime.timezone.utc
+            ),
+            notable_changes={"price": ("$10.00", "$8.00"), "available": (False, True)},
+        )
+
+        with mock.patch("change_broadcast.time.monotonic", return_value=900.0):
+            values = json.loads(json.dumps(encode_message(7, message)))
+        with mock.patch("change_broadcast.time.monotonic", return_value=50.0):
+            variant_id, decoded = decode_message(values)
+
+        self.assertEqual(variant_id, 7)
+        self.assertEqual(decoded.expires_at, 150.0)
+        self.assertEqual(
+            (decoded.channel, decoded.ts, decoded.first_changed_at),
+            (message.channel, message.ts, message.first_changed_at),
+        )
+        self.assertEqual(decoded.notable_changes, message.notable_changes)
+
+
+if __name__ == "__main__":
+    unittest.main()
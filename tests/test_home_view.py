@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from home_view import HomeViewCache
+
+PRODUCTS = "shopify_store_products"
+VARIANTS = "shopify_store_variants"
+IMAGES = "shopify_store_images"
+
+
+def home_row(product_id: int):
+    return (SimpleNamespace(id=product_id), SimpleNamespace(id=product_id * 10), None)
+
+
+class FakeDataEngine:
+    def __init__(self):
+        self.queries = 0
+        self.release = asyncio.Event()
+        self.release.set()
+        self.started = asyncio.Event()
+        self.product_ids = [1, 2]
+
+    async def get_new_products(self, vendors, item_count=15):
+        self.queries += 1
+        self.started.set()
+        await self.release.wait()
+        return [home_row(product_id) for product_id in self.product_ids]
+
+
+@mock.patch("home_view.build_most_recently_released", lambda rows: list(rows))
+class HomeViewCacheTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.data_engine = FakeDataEngine()
+        self.vendors = {1: "UniFi", 2: "UniFi", 3: "UniFi", 4: "Other"}
+        self.home_view = HomeViewCache(
+            self.data_engine, ["UniFi"], product_vendor=self.vendors.get
+        )
+
+    async def test_concurrent_opens_share_one_query(self):
+        self.data_engine.release.clear()
+        opens = [asyncio.ensure_future(self.home_view.get_blocks()) for _ in range(5)]
+        await self.data_engine.started.wait()
+        self.data_engine.release.set()
+
+        views = await asyncio.gather(*opens)
+
+        self.assertEqual(self.data_engine.queries, 1)
+        self.assertTrue(all(len(blocks) == 2 for blocks in views))
+
+    async def test_the_cached_view_is_reused(self):
+        await self.home_view.get_blocks()
+        await self.home_view.get_blocks()
+
+        self.assertEqual(self.data_engine.queries, 1)
+        self.assertEqual(self.home_view.stats()["hits"], 1)
+
+    async def test_a_change_during_a_refresh_has_the_view_loaded_again(self):
+        self.data_engine.release.clear()
+        opening = asyncio.ensure_future(self.home_view.get_blocks())
+        await self.data_engine.started.wait()
+        self.home_view.apply_change(PRODUCTS, None, {"id": 3, "vendor": "UniFi"})
+        self.data_engine.release.set()
+        await opening
+
+        self.data_engine.product_ids = [3, 1]
+        blocks = await self.home_view.get_blocks()
+
+        self.assertEqual(self.data_engine.queries, 2)
+        self.assertEqual(blocks[0][0].id, 3)
+
+    async def test_a_change_to_a_shown_product_invalidates_the_view(self):
+        await self.home_view.get_blocks()
+        self.home_view.apply_change(VARIANTS, {"id": 20, "product_id": 2}, None)
+        await self.home_view.get_blocks()
+
+        self.assertEqual(self.data_engine.queries, 2)
+
+    async def test_a_new_image_of_a_home_vendor_product_invalidates_the_view(self):
+        await self.home_view.get_blocks()
+        self.home_view.apply_change(IMAGES, None, {"id": 300, "product_id": 3})
+        await self.home_view.get_blocks()
+
+        self.assertEqual(self.data_engine.queries, 2)
+
+    async def test_changes_to_other_vendors_keep_the_view(self):
+        await self.home_view.get_blocks()
+        self.home_view.apply_change(PRODUCTS, None, {"id": 4, "vendor": "Other"})
+        self.home_view.apply_change(VARIANTS, None, {"id": 40, "product_id": 4})
+        self.home_view.apply_change(IMAGES, None, {"id": 400, "product_id": 4})
+        self.home_view.apply_change(
+            "shopify_store_product_notifications", None, {"product_id": 3}
+        )
+        await self.home_view.get_blocks()
+
+        self.assertEqual(self.data_engine.queries, 1)
+        self.assertEqual(self.home_view.stats()["invalidations"], 0)
+
+    async def test_changes_to_products_of_unknown_vendor_invalidate_the_view(self):
+        await self.home_view.get_blocks()
+        self.home_view.apply_change(VARIANTS, None, {"id": 50, "product_id": 5})
+
+        self.assertEqual(self.home_view.stats()["invalidations"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
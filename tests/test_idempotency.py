@@ -0,0 +1,110 @@
+import asyncio
+import unittest
+
+from idempotency import IdempotencyCache
+
+
+class IdempotencyCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_duplicates_join_one_run(self):
+        cache = IdempotencyCache()
+        release = asyncio.Event()
+        runs = 0
+
+        async def work():
+            nonlocal runs
+            runs += 1
+            await release.wait()
+            return 200
+
+        first = asyncio.ensure_future(
+            cache.run([("event", "a"), ("notification", 1)], work)
+        )
+        await asyncio.sleep(0)
+        # A redelivery under a new event ID is still known by its notification ID
+        second = asyncio.ensure_future(
+            cache.run([("event", "b"), ("notification", 1)], work)
+        )
+        await asyncio.sleep(0)
+        release.set()
+
+        self.assertEqual(await asyncio.gather(first, second), [200, 200])
+        self.assertEqual(runs, 1)
+        self.assertEqual(cache.stats()["joined"], 1)
+        self.assertEqual(cache.stats()["in_flight"], 0)
+
+    async def test_successful_outcomes_are_remembered(self):
+        cache = IdempotencyCache()
+
+        async def work():
+            return 200
+
+        await cache.run([("event", "a"), ("notification", 1)], work)
+
+        self.assertEqual(cache.get(("notification", 1)), 200)
+        self.assertEqual(await cache.run([("event", "b")], work), 200)
+        self.assertEqual(cache.stats()["misses"], 2)
+        self.assertEqual(await cache.run([("event", "a")], work), 200)
+        self.assertEqual(cache.stats()["misses"], 2)
+
+    async def test_failed_outcomes_are_not_cached(self):
+        cache = IdempotencyCache()
+        statuses = [500, 200]
+
+        async def work():
+            return statuses.pop(0)
+
+        self.assertEqual(await cache.run([("event", "a")], work), 500)
+        self.assertIsNone(cache.get(("event", "a")))
+        self.assertEqual(await cache.run([("event", "a")], work), 200)
+        self.assertEqual(cache.get(("event", "a")), 200)
+
+    async def test_errors_reach_joined_callers_and_are_not_cached(self):
+        cache = IdempotencyCache()
+        release = asyncio.Event()
+
+        async def failing_work():
+            await release.wait()
+            raise RuntimeError("Slack is down")
+
+        first = asyncio.ensure_future(cache.run([("event", "a")], failing_work))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.run([("event", "a")], failing_work))
+        await asyncio.sleep(0)
+        release.set()
+
+        results = await asyncio.gather(first, second, return_exceptions=True)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertIsNone(cache.get(("event", "a")))
+
+    async def test_a_duplicate_takes_over_a_cancelled_run(self):
+        cache = IdempotencyCache()
+
+        async def stalled_work():
+            await asyncio.Event().wait()
+
+        async def work():
+            return 200
+
+        first = asyncio.ensure_future(cache.run([("event", "a")], stalled_work))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.run([("event", "a")], work))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        self.assertEqual(await second, 200)
+        self.assertEqual(cache.get(("event", "a")), 200)
+
+    def test_least_recently_used_keys_are_dropped(self):
+        cache = IdempotencyCache(max_entries=2)
+        cache.add(200, "a")
+        cache.add(200, "b")
+        cache.get("a")
+        cache.add(200, "c")
+
+        self.assertEqual(cache.get("a"), 200)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+from unittest import mock
+
+from leader import LeaderElector
+
+
+class FakePostgres:
+    """Advisory locks held by session, as Postgres keeps them."""
+
+    def __init__(self):
+        self.holders = {}
+        self.connections = []
+
+    async def connect(self, dsn, server_settings=None):
+        conn = FakeConnection(self)
+        self.connections.append(conn)
+        return conn
+
+
+class FakeConnection:
+    def __init__(self, postgres: FakePostgres):
+        self.postgres = postgres
+        self.lost = False
+        self.closed = False
+
+    async def fetchval(self, query, *args, timeout=None):
+        if self.lost or self.closed:
+            raise ConnectionResetError("connection lost")
+        if query.startswith("SELECT pg_try_advisory_lock"):
+            holder = self.postgres.holders.setdefault(args[0], self)
+            return holder is self
+        return 1
+
+    def _end_session(self):
+        self.closed = True
+        for key, holder in list(self.postgres.holders.items()):
+            if holder is self:
+                del self.postgres.holders[key]
+
+    async def close(self, timeout=None):
+        self._end_session()
+
+    def terminate(self):
+        self._end_session()
+
+
+async def wait_for(condition, timeout: float = 2.0) -> None:
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.005)
+
+    await asyncio.wait_for(poll(), timeout)
+
+
+class LeaderElectorTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.postgres = FakePostgres()
+        patcher = mock.patch("leader.asyncpg.connect", self.postgres.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.events = []
+        self.electors = []
+
+    async def asyncTearDown(self):
+        for elector in self.electors:
+            await elector.close()
+
+    def elector(self, name: str, on_elected=None) -> LeaderElector:
+        async def elected():
+            self.events.append(("elected", name))
+            if on_elected is not None:
+                await on_elected()
+
+        async def deposed():
+            self.events.append(("deposed", name))
+
+        elector = LeaderElector(
+            "postgresql+asyncpg://localhost/inventory",
+            on_elected=elected,
+            on_deposed=deposed,
+            retry_interval=0.01,
+            check_interval=0.01,
+        )
+        self.electors.append(elector)
+        return elector
+
+    async def test_one_replica_takes_the_lock(self):
+        first, second = self.elector("first"), self.elector("second")
+        first.start()
+        await wait_for(lambda: first.is_leader)
+        second.start()
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(first.role, "leader")
+        self.assertEqual(second.role, "follower")
+        self.assertEqual(self.events, [("elected", "first")])
+
+    async def test_a_leader_that_loses_its_connection_steps_down(self):
+        first, second = self.elector("first"), self.elector("second")
+        first.start()
+        await wait_for(lambda: first.is_leader)
+        second.start()
+        await asyncio.sleep(0.02)
+
+        self.postgres.connections[0].lost = True
+        await wait_for(lambda: second.is_leader)
+
+        self.assertFalse(first.is_leader)
+        self.assertEqual(
+            self.events[:3],
+            [("elected", "first"), ("deposed", "first"), ("elected", "second")],
+        )
+        self.assertGreaterEqual(first.stats()["connection_failures"], 1)
+
+    async def test_a_closed_leader_hands_over(self):
+        first, second = self.elector("first"), self.elector("second")
+        first.start()
+        await wait_for(lambda: first.is_leader)
+        second.start()
+
+        await first.close()
+        await wait_for(lambda: second.is_leader)
+
+        self.assertEqual(
+            self.events,
+            [("elected", "first"), ("deposed", "first"), ("elected", "second")],
+        )
+        self.assertTrue(self.postgres.connections[0].closed)
+
+    async def test_a_leader_that_fails_to_take_over_gives_up_the_lock(self):
+        async def fail():
+            raise RuntimeError("Socket Mode is unreachable")
+
+        first = self.elector("first", on_elected=fail)
+        first.start()
+        await wait_for(lambda: len(self.events) >= 2)
+
+        self.assertEqual(self.events[:2], [("elected", "first"), ("deposed", "first")])
+        self.assertTrue(self.postgres.connections[0].closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
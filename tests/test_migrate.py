@@ -0,0 +1,26 @@
+import unittest
+
+from migrate import pending_migrations
+
+
+def names(paths):
+    return [path.stem for path in paths]
+
+
+class PendingMigrationsTest(unittest.TestCase):
+    def test_migrations_are_listed_in_order_without_the_applied_ones(self):
+        pending = names(pending_migrations(["0001_search_documents"]))
+
+        self.assertNotIn("0001_search_documents", pending)
+        self.assertEqual(pending, sorted(pending))
+
+    def test_the_trigram_index_waits_until_trigram_search_is_enabled(self):
+        self.assertNotIn("0002_search_trigram", names(pending_migrations([])))
+        self.assertIn(
+            "0002_search_trigram",
+            names(pending_migrations([], features=["search_trigram"])),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,310 @@
+import asyncio
+import datetime
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from cloudevents.http import CloudEvent
+
+from notifications import (
+    EventWorkerPool,
+    NotificationBatcher,
+    NotificationCoalescer,
+    merge_notable_changes,
+)
+from utilities.middleware import handle_cloudevent
+
+CHANGED_AT = datetime.datetime(2023, 5, 1, tzinfo=datetime.timezone.utc)
+
+
+class NotificationBatcherTest(unittest.IsolatedAsyncioTestCase):
+    async def test_notifications_submitted_together_are_resolved_once(self):
+        resolved = []
+
+        async def resolve(notification_ids):
+            resolved.append(sorted(notification_ids))
+            return {notification_id: None for notification_id in notification_ids}
+
+        async def deliver(notification_id, enrichment):
+            return 200
+
+        batcher = NotificationBatcher(resolve, deliver, max_wait=0.01)
+        statuses = await asyncio.gather(*(batcher.submit(str(i)) for i in range(3)))
+
+        self.assertEqual(statuses, [200, 200, 200])
+        self.assertEqual(resolved, [["0", "1", "2"]])
+
+    async def test_a_missing_notification_fails_alone(self):
+        async def resolve(notification_ids):
+            return {"found": None}
+
+        async def deliver(notification_id, enrichment):
+            return 200
+
+        batcher = NotificationBatcher(resolve, deliver, max_wait=0.01)
+        results = await asyncio.gather(
+            batcher.submit("found"), batcher.submit("missing"), return_exceptions=True
+        )
+
+        self.assertEqual(results[0], 200)
+        self.assertIsInstance(results[1], LookupError)
+
+
+class MergeNotableChangesTest(unittest.TestCase):
+    def test_values_span_the_first_to_the_last_state(self):
+        merged = merge_notable_changes(
+            {"price": ("$10.00", "$8.00"), "available": (True, False)},
+            {"price": ("$8.00", "$7.00"), "available": (False, True)},
+        )
+
+        # Back in stock, so availability did not change overall
+        self.assertEqual(merged, {"price": ("$10.00", "$7.00")})
+
+
+class NotificationCoalescerTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.posts = []
+        self.updates = []
+
+    async def post(self, changes):
+        self.posts.append(changes)
+        return {"channel": "C1", "ts": f"{len(self.posts)}.0"}
+
+    async def update(self, message, changes):
+        self.updates.append((message.ts, changes))
+        return {"channel": message.channel, "ts": message.ts}
+
+    async def test_changes_within_the_window_edit_the_first_message(self):
+        coalescer = NotificationCoalescer(window=300.0)
+
+        await coalescer.send(
+            1, CHANGED_AT, {"price": ("$10.00", "$8.00")}, self.post, self.update
+        )
+        response = await coalescer.send(
+            1,
+            CHANGED_AT + datetime.timedelta(minutes=1),
+            {"price": ("$8.00", "$7.00")},
+            self.post,
+            self.update,
+        )
+
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(self.updates, [("1.0", {"price": ("$10.00", "$7.00")})])
+        self.assertEqual(response["ts"], "1.0")
+        self.assertEqual(coalescer.stats()["coalesced"], 1)
+
+    async def test_an_older_redelivered_change_is_merged_before_the_newer(self):
+        coalescer = NotificationCoalescer(window=300.0)
+
+        await coalescer.send(
+            1, CHANGED_AT, {"price": ("$8.00", "$7.00")}, self.post, self.update
+        )
+        await coalescer.send(
+            1,
+            CHANGED_AT - datetime.timedelta(minutes=1),
+            {"price": ("$10.00", "$8.00")},
+            self.post,
+            self.update,
+        )
+
+        self.assertEqual(self.updates[-1][1], {"price": ("$10.00", "$7.00")})
+
+    async def test_changes_after_the_window_post_a_new_message(self):
+        coalescer = NotificationCoalescer(window=300.0)
+
+        with mock.patch("notifications.time.monotonic", return_value=1000.0):
+            await coalescer.send(
+                1, CHANGED_AT, {"price": ("$10.00", "$8.00")}, self.post, self.update
+            )
+        with mock.patch("notifications.time.monotonic", return_value=1301.0):
+            await coalescer.send(
+                1, CHANGED_AT, {"price": ("$8.00", "$7.00")}, self.post, self.update
+            )
+
+        self.assertEqual(len(self.posts), 2)
+        self.assertEqual(self.updates, [])
+
+    async def test_other_variants_are_posted_separately(self):
+        coalescer = NotificationCoalescer(window=300.0)
+
+        await coalescer.send(
+            1, CHANGED_AT, {"price": ("$10.00", "$8.00")}, self.post, self.update
+        )
+        await coalescer.send(
+            2, CHANGED_AT, {"price": ("$10.00", "$8.00")}, self.post, self.update
+        )
+
+        self.assertEqual(len(self.posts), 2)
+
+    async def test_a_failed_edit_starts_a_new_message_next_time(self):
+        coalescer = NotificationCoalescer(window=300.0)
+
+        async def failing_update(message, changes):
+            raise RuntimeError("message_not_found")
+
+        await coalescer.send(
+            1, CHANGED_AT, {"price": ("$10.00", "$8.00")}, self.post, self.update
+        )
+        with self.assertRaises(RuntimeError):
+            await coalescer.send(
+                1, CHANGED_AT, {"price": ("$8.00", "$7.00")}, self.post, failing_update
+            )
+        await coalescer.send(
+            1, CHANGED_AT, {"price": ("$7.00", "$6.00")}, self.post, self.update
+        )
+
+        self.assertEqual(len(self.posts), 2)
+
+    async def test_a_message_posted_by_another_process_is_edited(self):
+        shared = []
+        poster = NotificationCoalescer(
+            window=300.0, on_message=lambda *message: shared.append(message)
+        )
+        editor = NotificationCoalescer(window=300.0)
+
+        await poster.send(
+            1, CHANGED_AT, {"price": ("$10.00", "$8.00")}, self.post, self.update
+        )
+        for variant_id, message in shared:
+            editor.remember(variant_id, message)
+        await editor.send(
+            1, CHANGED_AT, {"price": ("$8.00", "$7.00")}, self.post, self.update
+        )
+
+        self.assertEqual(len(self.posts), 1)
+        self.assertEqual(self.updates, [("1.0", {"price": ("$10.00", "$7.00")})])
+
+
+class EventWorkerPoolTest(unittest.IsolatedAsyncioTestCase):
+    async def test_a_full_queue_refuses_jobs(self):
+        pool = EventWorkerPool(max_queue_size=1, workers=1)
+        release = asyncio.Event()
+
+        self.assertTrue(pool.submit(release.wait))
+        # The worker takes the first job, which frees its place in the queue
+        await asyncio.sleep(0)
+        self.assertTrue(pool.submit(release.wait))
+        self.assertFalse(pool.submit(release.wait))
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+        release.set()
+        await pool.close()
+        self.assertEqual(pool.stats()["completed"], 2)
+
+    async def test_a_failed_job_is_retried(self):
+        pool = EventWorkerPool(retry_delay=0.01)
+        outcomes = [RuntimeError("Slack is down"), 500, 200]
+        attempts = 0
+
+        async def job():
+            nonlocal attempts
+            attempts += 1
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        pool.submit(job)
+        await pool.close()
+
+        self.assertEqual(attempts, 3)
+        self.assertEqual(pool.stats()["retried"], 2)
+        self.assertEqual(pool.stats()["completed"], 1)
+        self.assertEqual(pool.stats()["failed"], 0)
+
+    async def test_a_job_is_given_up_on_after_its_attempts(self):
+        pool = EventWorkerPool(max_attempts=2, retry_delay=0.01)
+        attempts = 0
+
+        async def job():
+            nonlocal attempts
+            attempts += 1
+            return 500
+
+        pool.submit(job)
+        with self.assertLogs("notifications", level="ERROR"):
+            await pool.close()
+
+        self.assertEqual(attempts, 2)
+        self.assertEqual(pool.stats()["failed"], 1)
+        self.assertEqual(pool.stats()["completed"], 0)
+
+    async def test_a_closed_pool_refuses_jobs(self):
+        pool = EventWorkerPool()
+        await pool.close()
+
+        self.assertFalse(pool.submit(asyncio.sleep))
+
+    def test_the_retry_delay_grows_with_the_backlog(self):
+        pool = EventWorkerPool(max_queue_size=1000, workers=10)
+        pool.average_seconds = 0.5
+        for _ in range(100):
+            pool._queue.put_nowait((None, None))
+
+        self.assertEqual(pool.retry_after(), 6)
+        pool.average_seconds = 100.0
+        self.assertEqual(pool.retry_after(), 60)
+
+
+def notification_event(notification_id: str) -> CloudEvent:
+    return CloudEvent(
+        {"type": "io.debezium.postgresql.datachangeevent", "source": "/debezium"},
+        json.dumps(
+            {
+                "payload": {
+                    "op": "c",
+                    "before": None,
+                    "after": {"id": notification_id},
+                    "source": {"table": "shopify_store_product_notifications"},
+                }
+            }
+        ),
+    )
+
+
+class CloudEventBackPressureTest(unittest.IsolatedAsyncioTestCase):
+    def app(self, event_pool: EventWorkerPool) -> SimpleNamespace:
+        async def handle_cloudevent_notifications(notification_id, event_id):
+            await asyncio.Event().wait()
+
+        return SimpleNamespace(
+            idempotency=SimpleNamespace(get=lambda *keys: None),
+            handle_catalog_change=lambda *args, **kwargs: None,
+            handle_cloudevent_notifications=handle_cloudevent_notifications,
+            event_pool=event_pool,
+        )
+
+    async def asyncTearDown(self):
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+    async def test_accepted_events_are_acknowledged(self):
+        app = self.app(EventWorkerPool(max_queue_size=1, workers=1))
+
+        response = await handle_cloudevent(app, notification_event("n1"))
+
+        self.assertEqual(response.status, 202)
+
+    async def test_a_full_queue_asks_the_source_to_back_off(self):
+        app = self.app(EventWorkerPool(max_queue_size=1, workers=1))
+        app.event_pool.average_seconds = 2.0
+
+        await handle_cloudevent(app, notification_event("n1"))
+        response = await handle_cloudevent(app, notification_event("n2"))
+
+        self.assertEqual(response.status, 429)
+        self.assertEqual(response.headers["Retry-After"], "3")
+
+    async def test_a_closing_pool_refuses_events_as_unavailable(self):
+        app = self.app(EventWorkerPool())
+        app.event_pool.accepting = False
+
+        response = await handle_cloudevent(app, notification_event("n1"))
+
+        self.assertEqual(response.status, 503)
+        self.assertIn("Retry-After", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
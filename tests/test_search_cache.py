@@ -0,0 +1,136 @@
+import unittest
+from types import SimpleNamespace
+
+from search_cache import SearchResultCache
+
+PRODUCTS = "shopify_store_products"
+VARIANTS = "shopify_store_variants"
+IMAGES = "shopify_store_images"
+
+
+def product(id, title, vendor="Ubiquiti", **columns):
+    row = {"id": id, "title": title, "handle": title.lower().replace(" ", "-")}
+    row.update(vendor=vendor, product_type="Networking", tags=None, **columns)
+    return row
+
+
+def variant(id, product_id, sku, title="Default"):
+    return {"id": id, "product_id": product_id, "sku": sku, "title": title}
+
+
+def result_row(product_row, variant_row):
+    return (
+        SimpleNamespace(**product_row),
+        SimpleNamespace(**variant_row),
+        SimpleNamespace(src="https://cdn.example.com/image.png"),
+        0.5,
+    )
+
+
+class SearchResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SearchResultCache()
+        self.dream = product(1, "Dream Machine")
+        self.dream_variant = variant(10, 1, "UDM")
+        self.switch = product(2, "Switch Flex")
+        self.switch_variant = variant(20, 2, "USW-FLEX")
+        self.cache_page("dream", [result_row(self.dream, self.dream_variant)])
+        self.cache_page("switch", [result_row(self.switch, self.switch_variant)])
+
+    def cache_page(self, query, rows):
+        key = SearchResultCache.key(query, 10, None)
+        self.cache.set(key, rows, 0.1, self.cache.generation)
+
+    def cached_queries(self):
+        return sorted(key[0] for key in self.cache._entries)
+
+    def test_queries_are_cached_under_their_normalized_text(self):
+        rows = self.cache.get(SearchResultCache.key("  Dream\tMACHINE ", 10, None))
+
+        self.assertIsNone(rows)
+        self.assertIsNotNone(self.cache.get(SearchResultCache.key(" DREAM ", 10, None)))
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+    def test_a_result_queried_during_an_invalidation_is_not_cached(self):
+        generation = self.cache.generation
+        self.cache.apply_change(PRODUCTS, "d", {"id": 2}, None)
+        self.cache.set(SearchResultCache.key("router", 10, None), [], 0.1, generation)
+
+        self.assertEqual(self.cached_queries(), ["dream"])
+
+    def test_the_least_recently_used_page_is_evicted(self):
+        self.cache.max_entries = 2
+        self.cache.get(SearchResultCache.key("dream", 10, None))
+        self.cache_page("router", [])
+
+        self.assertEqual(self.cached_queries(), ["dream", "router"])
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_an_insert_clears_every_page(self):
+        self.cache.apply_change(PRODUCTS, "c", None, product(3, "Cloud Gateway"))
+
+        self.assertEqual(self.cached_queries(), [])
+
+    def test_an_edit_of_a_searchable_column_clears_every_page(self):
+        renamed = dict(self.switch, title="Switch Lite")
+        self.cache.apply_change(PRODUCTS, "u", self.switch, renamed)
+
+        self.assertEqual(self.cached_queries(), [])
+
+    def test_an_edit_of_other_columns_drops_the_pages_showing_the_row(self):
+        updated = dict(self.switch_variant, price="$29.00")
+        self.cache.apply_change(VARIANTS, "u", self.switch_variant, updated)
+
+        self.assertEqual(self.cached_queries(), ["dream"])
+
+    def test_an_update_without_a_before_image_is_compared_with_the_cached_row(self):
+        self.cache.apply_change(PRODUCTS, "u", None, dict(self.switch, status="draft"))
+        self.assertEqual(self.cached_queries(), ["dream"])
+
+        self.cache.apply_change(
+            VARIANTS, "u", None, dict(self.dream_variant, sku="UDM-PRO")
+        )
+        self.assertEqual(self.cached_queries(), [])
+
+    def test_an_update_of_a_row_not_shown_drops_the_queries_it_can_match(self):
+        self.cache.apply_change(PRODUCTS, "u", None, product(3, "Dreams Lamp"))
+
+        self.assertEqual(self.cached_queries(), ["switch"])
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+    def test_a_deleted_row_drops_the_pages_showing_it(self):
+        self.cache.apply_change(VARIANTS, "d", self.dream_variant, None)
+
+        self.assertEqual(self.cached_queries(), ["switch"])
+
+    def test_a_first_image_makes_its_product_searchable(self):
+        self.cache.apply_change(
+            IMAGES, "c", None, {"id": 100, "product_id": 3, "position": 1}
+        )
+
+        self.assertEqual(self.cached_queries(), [])
+
+    def test_other_images_drop_only_the_pages_of_their_product(self):
+        self.cache.apply_change(
+            IMAGES, "c", None, {"id": 100, "product_id": 3, "position": 2}
+        )
+        self.assertEqual(self.cached_queries(), ["dream", "switch"])
+
+        self.cache.apply_change(
+            IMAGES, "u", None, {"id": 101, "product_id": 2, "position": 1}
+        )
+        self.assertEqual(self.cached_queries(), ["dream"])
+
+    def test_notifications_do_not_change_search_results(self):
+        self.cache.apply_change(
+            "shopify_store_product_notifications",
+            "c",
+            None,
+            {"id": "n1", "product_id": 1, "variant_id": 10},
+        )
+
+        self.assertEqual(self.cached_queries(), ["dream", "switch"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+
+from slack_sdk.errors import SlackApiError
+
+from slack_scheduler import Priority, PrioritySlots, SlackScheduler, TokenBucket
+
+# High enough that only Retry-After delays the calls
+FAST = {"chat_postMessage": (100.0, 10)}
+
+
+def rate_limited(retry_after: str) -> SlackApiError:
+    response = SimpleNamespace(status_code=429, headers={"Retry-After": retry_after})
+    return SlackApiError("ratelimited", response)
+
+
+class FakeClient:
+    def __init__(self, *errors: Exception):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def chat_postMessage(self, **kwargs):
+        self.calls.append((time.monotonic(), kwargs))
+        if self.errors:
+            raise self.errors.pop(0)
+        return SimpleNamespace(status_code=200, data={"ok": True})
+
+
+class SlackSchedulerTest(unittest.IsolatedAsyncioTestCase):
+    async def test_a_rate_limited_call_is_retried_after_the_retry_after_delay(self):
+        client = FakeClient(rate_limited("0.2"))
+        scheduler = SlackScheduler(client, rate_limits=FAST)
+
+        response = await scheduler.call("chat_postMessage", channel="C1", text="hi")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(client.calls), 2)
+        self.assertGreaterEqual(client.calls[1][0] - client.calls[0][0], 0.2)
+        self.assertEqual(scheduler.stats()["rate_limited"], 1)
+
+    async def test_the_retry_after_delay_holds_back_other_calls_of_the_bucket(self):
+        client = FakeClient(rate_limited("0.2"))
+        scheduler = SlackScheduler(client, rate_limits=FAST)
+
+        first = asyncio.ensure_future(
+            scheduler.call("chat_postMessage", channel="C1", text="first")
+        )
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        await scheduler.call("chat_postMessage", channel="C1", text="second")
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.1)
+        await first
+
+    async def test_the_error_is_raised_once_the_retries_run_out(self):
+        client = FakeClient(*(rate_limited("0") for _ in range(3)))
+        scheduler = SlackScheduler(client, max_retries=2, rate_limits=FAST)
+
+        with self.assertRaises(SlackApiError):
+            await scheduler.call("chat_postMessage", channel="C1", text="hi")
+        self.assertEqual(len(client.calls), 3)
+
+    async def test_other_errors_are_not_retried(self):
+        response = SimpleNamespace(status_code=200, headers={})
+        client = FakeClient(SlackApiError("channel_not_found", response))
+        scheduler = SlackScheduler(client)
+
+        with self.assertRaises(SlackApiError):
+            await scheduler.call("chat_postMessage", channel="C1", text="hi")
+        self.assertEqual(len(client.calls), 1)
+
+
+class TokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def test_calls_beyond_the_burst_wait_for_a_token(self):
+        bucket = TokenBucket(rate=10.0, burst=2)
+
+        started = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+
+class PrioritySlotsTest(unittest.IsolatedAsyncioTestCase):
+    async def test_free_slots_go_to_interactive_calls_first(self):
+        slots = PrioritySlots(1)
+        order = []
+
+        async def call(name: str, priority: Priority):
+            async with slots.acquire(priority):
+                order.append(name)
+
+        async with slots.acquire(Priority.NOTIFICATION):
+            waiters = [
+                asyncio.ensure_future(call("notification 1", Priority.NOTIFICATION)),
+                asyncio.ensure_future(call("notification 2", Priority.NOTIFICATION)),
+                asyncio.ensure_future(call("interactive", Priority.INTERACTIVE)),
+            ]
+            await asyncio.sleep(0)
+            self.assertEqual(slots.waiting(Priority.NOTIFICATION), 2)
+            self.assertEqual(slots.waiting(Priority.INTERACTIVE), 1)
+        await asyncio.gather(*waiters)
+
+        self.assertEqual(order, ["interactive", "notification 1", "notification 2"])
+        self.assertEqual(slots.free, 1)
+
+    async def test_a_cancelled_waiter_gives_up_its_place(self):
+        slots = PrioritySlots(1)
+
+        async with slots.acquire(Priority.NOTIFICATION):
+            waiter = asyncio.ensure_future(
+                slots.acquire(Priority.INTERACTIVE).__aenter__()
+            )
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            self.assertEqual(slots.waiting(Priority.INTERACTIVE), 0)
+
+        self.assertEqual(slots.free, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from supersession import Superseded, Supersession
+
+
+class SupersessionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_a_newer_search_of_the_view_cancels_the_older(self):
+        supersession = Supersession()
+        cancelled = asyncio.Event()
+
+        async def slow_search():
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def fast_search():
+            return ["result"]
+
+        older = asyncio.ensure_future(supersession.run("V1", slow_search()))
+        # Let the older search start waiting on its query
+        await asyncio.sleep(0.01)
+        newer = await supersession.run("V1", fast_search())
+
+        self.assertEqual(newer, ["result"])
+        with self.assertRaises(Superseded):
+            await older
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(supersession.stats()["cancelled"], 1)
+        self.assertEqual(supersession.stats()["running"], 0)
+
+    async def test_searches_of_other_views_run_side_by_side(self):
+        supersession = Supersession()
+        release = asyncio.Event()
+
+        async def search(view_id):
+            await release.wait()
+            return view_id
+
+        searches = [
+            asyncio.ensure_future(supersession.run(view_id, search(view_id)))
+            for view_id in ("V1", "V2")
+        ]
+        await asyncio.sleep(0)
+        self.assertEqual(supersession.stats()["running"], 2)
+        release.set()
+
+        self.assertEqual(await asyncio.gather(*searches), ["V1", "V2"])
+        self.assertEqual(supersession.stats()["cancelled"], 0)
+
+    async def test_cancelling_the_caller_is_not_reported_as_superseded(self):
+        supersession = Supersession()
+
+        caller = asyncio.ensure_future(supersession.run("V1", asyncio.Event().wait()))
+        await asyncio.sleep(0)
+        caller.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await caller
+        self.assertEqual(supersession.stats()["cancelled"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+from typeahead import TypeaheadIndex
+
+PRODUCTS = "shopify_store_products"
+VARIANTS = "shopify_store_variants"
+
+
+class FakeDataEngine:
+    def __init__(self, products, variants):
+        self.products = [SimpleNamespace(**row) for row in products]
+        self.variants = [SimpleNamespace(**row) for row in variants]
+        self.loaded = asyncio.Event()
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def get_typeahead_rows(self):
+        self.loaded.set()
+        await self.release.wait()
+        return self.products, self.variants
+
+
+def titles(products):
+    return [product.title for product in products]
+
+
+class TypeaheadIndexTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.data_engine = FakeDataEngine(
+            [
+                {"id": 1, "title": "Dream Machine Pro", "vendor": "Ubiquiti"},
+                {"id": 2, "title": "Dream Router", "vendor": "Ubiquiti"},
+                {"id": 3, "title": "Cloud Gateway", "vendor": "Ubiquiti"},
+            ],
+            [
+                {"id": 10, "product_id": 1, "sku": "UDM-PRO"},
+                {"id": 30, "product_id": 3, "sku": "UCG-ULTRA"},
+            ],
+        )
+        self.index = TypeaheadIndex(self.data_engine)
+        await self.index.load()
+
+    async def test_every_typed_word_prefixes_a_term(self):
+        self.assertEqual(
+            titles(self.index.suggest("dre")), ["Dream Router", "Dream Machine Pro"]
+        )
+        self.assertEqual(titles(self.index.suggest("dream pr")), ["Dream Machine Pro"])
+        self.assertEqual(titles(self.index.suggest("udm")), ["Dream Machine Pro"])
+        self.assertEqual(self.index.suggest("dream gateway"), [])
+
+    async def test_an_inserted_product_is_suggested(self):
+        self.index.apply_change(
+            PRODUCTS,
+            "c",
+            None,
+            {"id": 4, "title": "Dream Wall", "vendor": "Ubiquiti"},
+        )
+        self.index.apply_change(
+            VARIANTS, "c", None, {"id": 40, "product_id": 4, "sku": "UDW"}
+        )
+
+        self.assertIn("Dream Wall", titles(self.index.suggest("dream")))
+        self.assertEqual(titles(self.index.suggest("udw")), ["Dream Wall"])
+
+    async def test_an_updated_title_replaces_the_old_terms(self):
+        self.index.apply_change(
+            PRODUCTS,
+            "u",
+            None,
+            {"id": 2, "title": "Express Router", "vendor": "Ubiquiti"},
+        )
+
+        self.assertEqual(titles(self.index.suggest("dream")), ["Dream Machine Pro"])
+        self.assertEqual(titles(self.index.suggest("expr")), ["Express Router"])
+        self.assertNotIn(2, self.index._postings["dream"])
+
+    async def test_a_variant_moved_to_another_product_takes_its_sku_along(self):
+        self.index.apply_change(
+            VARIANTS, "u", None, {"id": 10, "product_id": 2, "sku": "UDM-PRO"}
+        )
+
+        self.assertEqual(titles(self.index.suggest("udm")), ["Dream Router"])
+
+    async def test_deleted_rows_are_no_longer_suggested(self):
+        self.index.apply_change(VARIANTS, "d", {"id": 30}, None)
+        self.assertEqual(self.index.suggest("ultra"), [])
+        self.assertEqual(titles(self.index.suggest("cloud")), ["Cloud Gateway"])
+
+        self.index.apply_change(PRODUCTS, "d", {"id": 1}, None)
+        self.assertEqual(titles(self.index.suggest("dream")), ["Dream Router"])
+        self.assertIsNone(self.index.get(1))
+        # Terms used by no product are dropped from the sorted term list
+        self.assertNotIn("machine", self.index._terms)
+        self.assertNotIn("udm", self.index._terms)
+
+    async def test_changes_received_during_a_load_are_applied_after_it(self):
+        self.data_engine.release.clear()
+        self.data_engine.loaded.clear()
+        loading = asyncio.ensure_future(self.index.load())
+        await self.data_engine.loaded.wait()
+
+        self.index.apply_change(
+            PRODUCTS, "c", None, {"id": 5, "title": "Switch Flex", "vendor": "Ubiquiti"}
+        )
+        self.data_engine.release.set()
+        await loading
+
+        self.assertEqual(titles(self.index.suggest("flex")), ["Switch Flex"])
+        self.assertEqual(self.index.stats()["changes"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import datetime
+import os
+import unittest
+import uuid
+from types import SimpleNamespace
+from unittest import mock
+
+from view_state import (
+    InMemoryViewStateStore,
+    PostgresViewStateStore,
+    compact_search_row,
+    decode_rows,
+    encode_rows,
+)
+
+UPDATED_AT = datetime.datetime(2023, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+
+
+def search_row(variant_id: int = 10):
+    return (
+        SimpleNamespace(
+            id=1,
+            title="Dream Machine",
+            vendor="Ubiquiti",
+            handle="dream-machine",
+            track=True,
+        ),
+        SimpleNamespace(
+            id=variant_id,
+            title="Default",
+            price="$379.00",
+            available=False,
+            updated_at=UPDATED_AT,
+        ),
+        SimpleNamespace(src="https://cdn.example.com/udm.png"),
+        0.5,
+    )
+
+
+class CompactSearchRowTest(unittest.TestCase):
+    def test_a_row_survives_encoding_as_plain_values(self):
+        compact = compact_search_row(search_row())
+
+        decoded = decode_rows(encode_rows([compact]))
+
+        self.assertEqual(
+            decoded,
+            [
+                {
+                    "product_id": 1,
+                    "variant_id": 10,
+                    "title": "Dream Machine",
+                    "variant_title": "Default",
+                    "vendor": "Ubiquiti",
+                    "handle": "dream-machine",
+                    "price": "$379.00",
+                    "available": False,
+                    "track": True,
+                    "image": "https://cdn.example.com/udm.png",
+                    "updated_at": str(UPDATED_AT),
+                }
+            ],
+        )
+
+
+class InMemoryViewStateStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def test_state_expires_after_the_ttl(self):
+        store = InMemoryViewStateStore(ttl=60.0)
+        with mock.patch("view_state.time.monotonic", return_value=1000.0):
+            await store.set("V1", [{"variant_id": 10}])
+        with mock.patch("view_state.time.monotonic", return_value=1059.0):
+            self.assertEqual(await store.get("V1"), [{"variant_id": 10}])
+        with mock.patch("view_state.time.monotonic", return_value=1061.0):
+            self.assertIsNone(await store.get("V1"))
+
+        self.assertEqual(store.stats()["entries"], 0)
+        self.assertEqual(store.stats()["bytes"], 0)
+        self.assertEqual(store.stats()["evictions"], 1)
+
+    async def test_the_least_recently_used_view_goes_beyond_the_entry_budget(self):
+        store = InMemoryViewStateStore(max_entries=2)
+        await store.set("V1", [])
+        await store.set("V2", [])
+        await store.get("V1")
+        await store.set("V3", [])
+
+        self.assertIsNone(await store.get("V2"))
+        self.assertEqual(await store.get("V1"), [])
+        self.assertEqual(await store.get("V3"), [])
+
+    async def test_the_least_recently_used_views_go_beyond_the_byte_budget(self):
+        rows = [{"title": "x" * 100}]
+        size = len(encode_rows(rows))
+        store = InMemoryViewStateStore(max_bytes=size * 2)
+        await store.set("V1", rows)
+        await store.set("V2", rows)
+        await store.get("V1")
+        await store.set("V3", rows)
+
+        self.assertIsNone(await store.get("V2"))
+        self.assertEqual(await store.get("V1"), rows)
+        self.assertEqual(store.stats()["bytes"], size * 2)
+
+    async def test_state_larger_than_the_byte_budget_is_not_kept(self):
+        store = InMemoryViewStateStore(max_bytes=10)
+        await store.set("V1", [])
+        await store.set("V1", [{"title": "Dream Machine"}])
+
+        self.assertIsNone(await store.get("V1"))
+        self.assertEqual(store.stats()["bytes"], 0)
+
+    async def test_setting_a_view_again_replaces_its_state(self):
+        store = InMemoryViewStateStore()
+        await store.set("V1", [{"variant_id": 10}])
+        await store.set("V1", [{"variant_id": 20}])
+
+        self.assertEqual(await store.get("V1"), [{"variant_id": 20}])
+        self.assertEqual(store.stats()["entries"], 1)
+        self.assertEqual(store.stats()["bytes"], len(encode_rows([{"variant_id": 20}])))
+
+
+@unittest.skipUnless(
+    os.environ.get("TEST_POSTGRES_URL"), "TEST_POSTGRES_URL is not set"
+)
+class PostgresViewStateStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        from data_engine import async_database_url
+        from models.slack_view_state import SlackViewState
+
+        self.engine = create_async_engine(
+            async_database_url(os.environ["TEST_POSTGRES_URL"])
+        )
+        async with self.engine.begin() as conn:
+            await conn.run_sync(SlackViewState.__table__.create, checkfirst=True)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.view_id = f"test-{uuid.uuid4()}"
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_state_is_shared_through_the_table(self):
+        writer = PostgresViewStateStore(self.session)
+        reader = PostgresViewStateStore(self.session)
+        await writer.set(self.view_id, [{"variant_id": 10}])
+        await writer.set(self.view_id, [{"variant_id": 20}])
+
+        self.assertEqual(await reader.get(self.view_id), [{"variant_id": 20}])
+
+    async def test_expired_state_is_not_read_and_is_purged(self):
+        store = PostgresViewStateStore(self.session, ttl=-1.0, purge_interval=0.0)
+        await store.set(self.view_id, [{"variant_id": 10}])
+
+        self.assertIsNone(await store.get(self.view_id))
+        await store.set(f"{self.view_id}-next", [])
+        self.assertGreaterEqual(store.stats()["evictions"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()